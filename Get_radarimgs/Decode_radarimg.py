@@ -0,0 +1,189 @@
+"""
+Decode_radarimg.py ver 1.1
+Get_KMAradarimg.py、Get_CWDradarimg.pyで入手した合成レーダー画像・落雷分布図の色を値(反射強度、落雷の時間など)の
+階級番号に変換し、全時刻を1つの圧縮した時系列配列(uint8, 時刻 x 南北 x 東西)として保存する
+Decode radar composite / lightning map images into one compressed uint8 time series of value classes.
+
+Requirements
+Python>=3.8, numpy, pillow
+
+Useage
+python3 Decode_radarimg.py
+*Line 40~51のparameterを設定してから実行すること
+python3 Decode_radarimg.py colors image.png
+*画像に使われている色と画素数を表示する(palette_fileの作成用)
+
+palette_file(1行1色, #以降はコメント)
+    value R G B
+    *上から順に階級番号1, 2, ...になる(0は該当する色がない画素: 無エコー、背景、地図、文字など)
+    *valueは階級の代表値(反射強度の下限値など)。出力のvaluesに保存する
+
+出力(numpy .npz, np.loadで読み込む)
+    data: 階級番号(uint8, 時刻 x 南北 x 東西、cropの範囲)
+    times: 時刻(yyyymmddHHMM, 画像の時刻(各機関の地方時))、names: 元の画像のファイル名
+    values: 階級番号ごとの値(values[0]はnan)、colors: 階級番号ごとの色(RGB)
+    crop: 切り出した範囲(x0, y0, x1, y1 [画素])
+
+*色→階級番号の変換表(LUT, 2^24色)はpalette_fileから1度だけ作成し、全画像で使い回す
+*パレット付きPNGはパレット(256色)だけを変換表で変換し、画素はパレット番号から直接階級番号にする
+*color_tol > 0なら、palette_fileのどの色とも一致しない画素を最も近い色(RGBの距離がcolor_tol以下)の階級にする(JPEG用)
+*復号した階級番号はメモリではなく一時ファイル(outname.tmp.npy、画像数 x 南北 x 東西バイト)のメモリマップに書き込み、
+ 圧縮しながらoutnameに保存した後で削除する(使用メモリは画像数によらず一定。outnameのディレクトリに一時ファイル分の空きが必要)
+ 例: 5分間隔・1000x1000画素の画像1か月分で約8.6 GB
+*np.load(outname)['data']は全時刻を展開してメモリに読み込むため、長い期間はsdate, edateで分けて保存すること
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 全時刻の配列をメモリに確保せず、一時ファイルのメモリマップに書き込むよう変更 2026.10.18
+"""
+###Parameter settings###
+source = 'KMA' #Source of images (KMA, CWB)
+product = 'RDR_CMP_WRC' #Product (RDR_CMP_WRC, lgt_kma (KMA), CV1_TW_3600, CV1_3600, lgts (CWB))
+indir = './rimg_kma/radar' #Directory of images (ignored if store_db is given)
+store_db = None #Image store of Get_KMAradarimg.py / Get_CWDradarimg.py (store_db). None: read images in indir
+sdate = None #Start date (yyyymmddHHMM, local time of the source. None: all)
+edate = None #End date (yyyymmddHHMM, local time of the source. None: all)
+palette_file = './palette_kma_rdr.txt' #Colour table of the product (see above)
+crop = None #Data area of images (x0, y0, x1, y1 [pixel], x1 and y1 are not included. None: whole image)
+color_tol = 0 #Max RGB distance to the nearest colour of palette_file (0: exact match only, e.g. 30 for JPEG)
+outname = './kma_rdr.npz' #Output file of the time series
+
+perf_log = None #Log file of elapsed time, memory and bytes (JSON lines, None: no log)
+###End of Parameter settings###
+
+#import libraries
+import sys
+import os
+import re
+from io import BytesIO
+from os import listdir, makedirs
+from os.path import dirname, abspath, join, isfile
+import numpy as np
+from PIL import Image
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+import imgfetch
+
+#%%
+#Read_Palette: Read palette_file and return (values, colors) of classes 1, 2, ...
+def Read_Palette(fname):
+    values, colors = [], []
+    with open(fname, 'r') as fp:
+        for line in fp:
+            cols = line.split('#')[0].split()
+            if len(cols) == 0: continue
+            values.append(float(cols[0]))
+            colors.append([int(c) for c in cols[1:4]])
+    if len(values) == 0 or len(values) > 255:
+        raise ValueError(f'{fname}: 1 to 255 colours are required')
+    return np.array(values), np.array(colors, dtype=np.uint8)
+
+#Make_LUT: Colour (R*65536+G*256+B) -> class number table
+#With color_tol > 0, colours not in the palette are assigned to the nearest palette colour
+#(computed on a 32x32x32 grid of RGB and used only if the colour does not match exactly)
+def Make_LUT(colors, color_tol=0):
+    lut = np.zeros(2**24, dtype=np.uint8)
+    codes = colors[:,0].astype(np.int64) * 65536 + colors[:,1].astype(np.int64) * 256 + colors[:,2]
+    lut[codes[::-1]] = np.arange(len(colors), 0, -1) #The first line has priority for the same colour
+    if color_tol <= 0:
+        return lut, None
+    c = np.arange(32) * 8 + 4
+    grid = np.stack(np.meshgrid(c, c, c, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    dist = np.sqrt(((grid - colors.astype(np.float64)[None,:,:])**2).sum(axis=-1))
+    near = np.argmin(dist, axis=1)
+    lut15 = np.where(dist[np.arange(len(near)), near] <= color_tol, near + 1, 0).astype(np.uint8)
+    return lut, lut15
+
+#To_Class: RGB (int, ... x 3) -> class numbers with the tables of Make_LUT
+def To_Class(rgb, lut, lut15=None):
+    cls = lut[rgb[...,0] * 65536 + rgb[...,1] * 256 + rgb[...,2]]
+    if lut15 is not None:
+        miss = cls == 0
+        q = rgb[miss] >> 3
+        cls[miss] = lut15[q[:,0] * 1024 + q[:,1] * 32 + q[:,2]]
+    return cls
+
+#Decode_Image: Image (bytes or file name) -> class numbers (uint8, ny x nx of crop)
+def Decode_Image(img, lut, lut15=None, crop=None):
+    img = Image.open(BytesIO(img) if isinstance(img, bytes) else img)
+    if crop is not None: img = img.crop(crop)
+    if img.mode == 'P':
+        pal = np.array(img.getpalette(), dtype=np.int64).reshape(-1, 3)
+        table = np.zeros(256, dtype=np.uint8)
+        table[:len(pal)] = To_Class(pal, lut, lut15)
+        return table[np.asarray(img)]
+    return To_Class(np.asarray(img.convert('RGB')).astype(np.int64), lut, lut15)
+
+#%%
+#List_Frames: [(time, name, file name or None)] of the product from sdate to edate in time order
+def List_Frames(store=None):
+    frames = []
+    if store is not None:
+        rows = store.execute('SELECT time, name FROM frames WHERE source = ? AND product = ? AND hash IS NOT NULL '
+                             'ORDER BY time', (source, product))
+        frames = [(t, n, None) for t, n in rows]
+    else:
+        for n in listdir(indir):
+            m = re.search(r'(\d{12})', n) #yyyymmddHHMM in the file name
+            if product in n and m is not None and isfile(join(indir, n)): frames.append((m.group(1), n, join(indir, n)))
+        frames.sort()
+    return [f for f in frames if (sdate is None or f[0] >= sdate) and (edate is None or f[0] <= edate)]
+
+#Print_Colors: Colours used in the image and the number of pixels (for making palette_file)
+def Print_Colors(fname, nmax=64):
+    rgb = np.asarray(Image.open(fname).convert('RGB')).reshape(-1, 3)
+    colors, counts = np.unique(rgb, axis=0, return_counts=True)
+    order = np.argsort(counts)[::-1][:nmax]
+    print(f'{len(colors)} colours in {fname} (R G B npixels)')
+    for i in order:
+        print(f'{colors[i][0]:3d} {colors[i][1]:3d} {colors[i][2]:3d} {counts[i]}')
+
+#%%
+###Main###
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'colors':
+        Print_Colors(sys.argv[2])
+        sys.exit(0)
+    perflog.Setup(perf_log, 'Decode_radarimg')
+
+    values, colors = Read_Palette(palette_file)
+    lut, lut15 = Make_LUT(colors, color_tol)
+    store = None if store_db is None else imgfetch.Open_Store(store_db)
+    frames = List_Frames(store)
+    if len(frames) == 0: raise ValueError(f'No images of {source} {product}')
+    print(f'{len(frames)} images of {source} {product} ({frames[0][0]}-{frames[-1][0]}) will be decoded')
+
+    if dirname(outname) != '': makedirs(dirname(outname), exist_ok=True)
+    tmpname = outname + '.tmp.npy' #復号した階級番号のメモリマップ(保存後に削除)
+    data = None
+    times, names = [], []
+    with perflog.Stage('decode', product, nfiles=len(frames)):
+        for t, n, path in frames:
+            img = path if store is None else imgfetch.Load_Image(store, source, product, t)
+            try:
+                cls = Decode_Image(img, lut, lut15, crop)
+            except (OSError, ValueError) as e:
+                print(f'{n}: {e}. Skip this image.')
+                continue
+            if data is None:
+                data = np.lib.format.open_memmap(tmpname, mode='w+', dtype=np.uint8, shape=(len(frames),) + cls.shape)
+            elif cls.shape != data.shape[1:]:
+                print(f'{n}: image size {cls.shape} differs from {data.shape[1:]}. Skip this image.')
+                continue
+            data[len(times)] = cls
+            times.append(t)
+            names.append(n)
+    if len(times) == 0: raise ValueError('No images decoded')
+    data = data[:len(times)]
+    nodata = sum(not data[i].any() for i in range(len(times))) #1時刻ずつ調べる(全時刻をメモリに読み込まない)
+    print(f'{len(times)} images decoded ({nodata} images have no pixels of palette_file colours)')
+
+    with perflog.Stage('write', outname):
+        #savez_compressedはメモリマップを少しずつ読み出して圧縮する
+        np.savez_compressed(outname, data=data, times=np.array(times), names=np.array(names),
+                            values=np.concatenate([[np.nan], values]), colors=np.concatenate([[[0, 0, 0]], colors]),
+                            crop=np.array(crop if crop is not None else (0, 0, data.shape[2], data.shape[1])), source=source, product=product)
+    shape = data.shape
+    del data
+    os.remove(tmpname)
+    print(f'Saved to {outname} ({shape[0]} x {shape[1]} x {shape[2]})')
@@ -10,10 +10,15 @@ Python>=3.8, requests, tqdm, pandas
 
 Useage
 python3 Get_KMAradarimg.py
-*Line 20~25のparameterを設定してから実行すること
+*Line 25~39のparameterを設定してから実行すること
 
 HISTORY(yyyy.mm.dd)
 ver 1.0 First created 2023.06.12 A.NISHII
+ver 1.1 Add perf_log (elapsed time, memory and bytes of each download, ../common/perflog.py) 2026.10.18
+ver 1.2 Download images concurrently with a shared session (imgfetch.py): retry on 5xx errors and timeouts,
+        skip images already downloaded, and accept responses without content-length 2026.10.18
+ver 1.3 Add store_db: store each image once by its content (SHA-256) in a SQLite file with an index of
+        (source, product, time) instead of saving separate files (imgfetch.py) 2026.10.18
 
 """
 ###Parameter settings###
@@ -22,36 +27,28 @@ edate = '202306011200' #End date of dl (yyyymmddHHMM, KST(UTC+9))
 freq  = 5 #DL inverbal of images (in minutes, 5 is minimum)
 lighting = True #True: Lightning map also downloaded
 
+nthreads = 4 #Number of concurrent downloads
+retries = 3 #Number of retries on 5xx errors, connection errors and timeouts
+backoff = 1.0 #Wait before retries (backoff*2^n seconds)
+url_base = 'https://web.kma.go.kr/repositary/image' #Base URL of images (e.g. 'http://localhost:8000' for a local test server)
+
+store_db = None #SQLite file to store images once by content with an index of times
+                #(e.g. f'{outdir}/images.db'. None: save each image in outdir/radar, outdir/lightning)
+                #Summary of failed and duplicated frames: python3 imgfetch.py store_db
+perf_log = None #Log file of elapsed time, memory and bytes (JSON lines, None: no log)
 outdir = './rimg_kma' #Saving directory of figures
 ###End of Parameter settings###
 
 #import libraries
-import requests
-from tqdm import tqdm
+import sys
 from pandas import date_range
 from os import makedirs
 from datetime import datetime
-
-#Function for downloading images.
-def dl_file(url,savepath):
-    res = requests.get(url,stream=True,timeout=6.1)
-    stc = res.status_code
-    if stc == requests.codes.ok:
-        fsize = int(res.headers['content-length'])
-        if res.headers['Content-Type'] != 'image/png':
-            print('Link is not an image. Skip downloading this file.')
-            return -1
-        pbar = tqdm(total=fsize,unit='B',unit_scale=True)
-        with open(savepath,'wb') as f:
-            for chunk in res.iter_content(chunk_size=1024):
-                f.write(chunk)
-                pbar.update(len(chunk))
-        pbar.close()
-    else:
-        print(f'{res.status_code} error raised. Skip downloading this file.')
-        return stc
-    
-    return 0
+from os.path import dirname, abspath, join
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+import imgfetch
+perflog.Setup(perf_log, 'Get_KMAradarimg')
 
 ###Main###
 #Define array of dates
@@ -61,25 +58,27 @@ dts   = date_range(sd_dt,ed_dt,freq=f'{freq}min',inclusive='both')
 if len(dts) == 0: raise ValueError('Invalid range of dates')
 
 rfigdir=f'{outdir}/radar'
-makedirs(rfigdir,exist_ok=True)
-if lighting: 
-    lgtdir = f'{outdir}/lightning'
-    makedirs(lgtdir,exist_ok=True)
+lgtdir = f'{outdir}/lightning'
+if store_db is None:
+    makedirs(rfigdir,exist_ok=True)
+    if lighting: makedirs(lgtdir,exist_ok=True)
 
 #Get images
+jobs = []
 for dt in dts:
-    print(f'Downloading {dt}...')
     dt_str = dt.strftime('%Y%m%d%H%M')
     rfigname = f'RDR_CMP_WRC_{dt_str}.png'
-    rfigurl  = f'https://web.kma.go.kr/repositary/image/rdr/img/{rfigname}'
-    rfigpath = f'{rfigdir}/{rfigname}'
-    print(rfigurl)
-    dl_file(rfigurl,rfigpath)
+    jobs.append((f'{url_base}/rdr/img/{rfigname}', f'{rfigdir}/{rfigname}', ('KMA', 'RDR_CMP_WRC', dt_str)))
     if lighting:
         lgtfigname = f'lgt_kma_{dt_str}.png'
-        lgturl = f'https://web.kma.go.kr/repositary/image/lgt/img/{lgtfigname}'
-        lgtfigpath = f'{lgtdir}/{lgtfigname}'
-        print(lgturl)
-        dl_file(lgturl,lgtfigpath)
-    
-print('Finish')
+        jobs.append((f'{url_base}/lgt/img/{lgtfigname}', f'{lgtdir}/{lgtfigname}', ('KMA', 'lgt_kma', dt_str)))
+
+print(f'Downloading {len(jobs)} files...')
+session = imgfetch.Make_Session(nthreads, retries, backoff)
+store = None if store_db is None else imgfetch.Open_Store(store_db)
+with perflog.Stage('download', outdir, nfiles=len(jobs)):
+    count, failed = imgfetch.Fetch_All(session, jobs, nthreads, store=store, content_type='image/png')
+print(f'Finish: {count["new"]} downloaded, {count["skip"]} skipped, {len(failed)} failed')
+if store is not None:
+    print(f'{count["same"]} of downloaded images were already in {store_db}')
+    store.close()
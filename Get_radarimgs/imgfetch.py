@@ -0,0 +1,227 @@
+"""
+imgfetch.py ver 1.0
+合成レーダー画像・落雷分布図をまとめて並列にダウンロードするモジュール
+Get_CWDradarimg.py、Get_KMAradarimg.pyから呼び出して使用する
+Shared downloader of radar composite / lightning map images.
+
+Useage(スクリプト側)
+    session = imgfetch.Make_Session(nthreads, retries, backoff)
+    count, failed = imgfetch.Fetch_All(session, [(url, savepath, (source, product, time)), ...], nthreads, store=store)
+    store: Open_Storeで開いたSQLiteの画像ストア(Noneなら画像を1つずつsavepathに保存する)
+画像ストアの集計(欠測・重複した時刻の一覧)
+    python3 imgfetch.py store.db
+
+*1つのrequests.Sessionで接続(TLS)を使い回す(接続数はnthreadsまで)
+*5xxエラー・接続エラー・タイムアウトはbackoff*2^n秒待って最大retries回やり直す
+*保存済みのファイル(サイズ0より大きい)はダウンロードしない(skip)
+*ダウンロード中はsavepath.partに書き込み、完了してから名前を変える(途中で止まっても壊れたファイルが残らない)
+*content-lengthがない応答もダウンロードする(ある場合は受信したサイズと比べる)
+
+画像ストア(store)の形式(mbtiles.pyと同じく、画像の中身と時刻ごとの対応を分けて保存する)
+    blobs(hash, size, data): 画像(hashは中身のSHA-256)。同じ中身の画像(空の落雷分布図、欠測時の同じ画像など)は1つだけ保存する
+    frames(source, product, time, name, hash, status): 時刻ごとの画像(time: yyyymmddHHMM(各機関の地方時)、name: 元のファイル名)
+                                                       ダウンロードに失敗した時刻はhashをNULL、statusにエラー内容を保存する
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 画像を中身のハッシュで1つだけ保存するSQLiteの画像ストア(Open_Store, Add_Frame, Load_Image, Store_Summary)を追加 2026.10.18
+"""
+
+import os
+import sys
+import sqlite3
+import hashlib
+from os.path import exists, getsize, dirname
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+#%%
+#Make_Session: Session with a connection pool of nthreads and retries on 5xx errors, connection errors and timeouts
+def Make_Session(nthreads=4, retries=3, backoff=1.0):
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=('GET',), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=nthreads, pool_maxsize=nthreads, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+#%%
+#Check_Response: None if the response is an image to download, otherwise the status ('notimage' or the HTTP status code)
+def Check_Response(res, content_type=None):
+    if res.status_code != requests.codes.ok:
+        return res.status_code
+    if content_type is not None and res.headers.get('Content-Type') != content_type:
+        return 'notimage'
+    return None
+
+#Check_Length: Raise IOError if the received size differs from content-length (if any)
+def Check_Length(res, nbytes, url):
+    fsize = res.headers.get('content-length')
+    if fsize is not None and int(fsize) != nbytes and 'Content-Encoding' not in res.headers:
+        raise IOError(f'{url}: {nbytes} bytes received, {fsize} bytes expected')
+
+#Download: Download one file and return (status, bytes)
+#status: 'new', 'skip', 'notimage' (Content-Type is not content_type) or the HTTP status code (int)
+def Download(session, url, savepath, timeout=6.1, content_type=None):
+    if exists(savepath) and getsize(savepath) > 0:
+        return 'skip', 0
+    with session.get(url, stream=True, timeout=timeout) as res:
+        status = Check_Response(res, content_type)
+        if status is not None:
+            return status, 0
+        part = savepath + '.part'
+        nbytes = 0
+        with open(part, 'wb') as f:
+            for chunk in res.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+                nbytes += len(chunk)
+        try:
+            Check_Length(res, nbytes, url)
+        except IOError:
+            os.remove(part)
+            raise
+    os.replace(part, savepath)
+    return 'new', nbytes
+
+#Fetch: Download one file to memory and return (status, bytes of the image or None)
+def Fetch(session, url, timeout=6.1, content_type=None):
+    with session.get(url, timeout=timeout) as res:
+        status = Check_Response(res, content_type)
+        if status is not None:
+            return status, None
+        Check_Length(res, len(res.content), url)
+        return 'new', res.content
+
+#%%
+#Open_Store: Open the image store (SQLite, created if it does not exist)
+def Open_Store(dbname):
+    if dirname(dbname) != '': os.makedirs(dirname(dbname), exist_ok=True)
+    conn = sqlite3.connect(dbname)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, data BLOB);
+        CREATE TABLE IF NOT EXISTS frames (source TEXT, product TEXT, time TEXT, name TEXT, hash TEXT, status TEXT,
+                                           PRIMARY KEY (source, product, time));
+        CREATE INDEX IF NOT EXISTS frames_hash ON frames (hash);
+    ''')
+    return conn
+
+#Stored_Frames: Set of (source, product, time) already stored (failed frames are not included)
+def Stored_Frames(conn):
+    return set(conn.execute('SELECT source, product, time FROM frames WHERE hash IS NOT NULL'))
+
+#Add_Frame: Store the image of the frame key=(source, product, time) and return True if the same image was already stored
+#data=None records a failed frame (status: error)
+def Add_Frame(conn, key, name, data, status='ok'):
+    if data is None:
+        conn.execute('INSERT OR REPLACE INTO frames VALUES (?,?,?,?,?,?)', key + (name, None, str(status)))
+        return False
+    h = hashlib.sha256(data).hexdigest()
+    same = conn.execute('SELECT 1 FROM blobs WHERE hash = ?', (h,)).fetchone() is not None
+    if not same: conn.execute('INSERT INTO blobs VALUES (?,?,?)', (h, len(data), data))
+    conn.execute('INSERT OR REPLACE INTO frames VALUES (?,?,?,?,?,?)', key + (name, h, status))
+    return same
+
+#Load_Image: Bytes of the stored image of (source, product, time) (None if not stored)
+def Load_Image(conn, source, product, time):
+    row = conn.execute('''SELECT blobs.data FROM frames JOIN blobs ON blobs.hash = frames.hash
+                          WHERE source = ? AND product = ? AND time = ?''', (source, product, time)).fetchone()
+    return None if row is None else row[0]
+
+#%%
+#Fetch_All: Download files of jobs ([(url, savepath, (source, product, time))]) with nthreads threads
+#store: image store (Open_Store). None: save each file to savepath
+#Return: (number of files for each status, [(url, status or error message)] of failed files)
+#        count['same'] is the number of new frames whose image was already in the store
+def Fetch_All(session, jobs, nthreads=4, timeout=6.1, content_type=None, store=None):
+    count = {'new': 0, 'skip': 0, 'same': 0}
+    failed = []
+    pbar = tqdm(total=len(jobs), unit='file')
+    def done(url, status, nbytes):
+        if status in count:
+            count[status] += 1
+        else:
+            failed.append((url, status))
+            tqdm.write(f'{url}: ' + ('Link is not an image.' if status == 'notimage' else f'{status} error raised.')
+                       + ' Skip downloading this file.')
+        pbar.update(1)
+        if nbytes > 0: pbar.set_postfix_str(f'{url.rsplit("/", 1)[-1]} {nbytes/1024:.0f}kB')
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        if store is None:
+            futures = {executor.submit(Download, session, url, path, timeout, content_type): (url, path, key)
+                       for url, path, key in jobs}
+        else:
+            stored = Stored_Frames(store)
+            futures = {}
+            for url, path, key in jobs:
+                if key in stored:
+                    done(url, 'skip', 0)
+                else:
+                    futures[executor.submit(Fetch, session, url, timeout, content_type)] = (url, path, key)
+        for fut in as_completed(futures):
+            url, path, key = futures[fut]
+            try:
+                status, data = fut.result()
+            except (requests.RequestException, IOError) as e:
+                status, data = f'{type(e).__name__} ({e})', None
+            if store is None:
+                done(url, status, data or 0)
+                continue
+            #The store is written only in this thread
+            if status == 'new':
+                count['same'] += Add_Frame(store, key, os.path.basename(path), data)
+            else:
+                Add_Frame(store, key, os.path.basename(path), None, status)
+            done(url, status, 0 if data is None else len(data))
+            if pbar.n % 100 == 0: store.commit()
+    if store is not None: store.commit()
+    pbar.close()
+    return count, failed
+
+#%%
+#Store_Summary: Number of frames, failed frames, duplicated frames and bytes for each (source, product)
+#and the times of failed frames and of frames with the same image as the previous frame
+def Store_Summary(conn):
+    summary = {}
+    rows = conn.execute('''SELECT source, product, time, frames.hash, status, blobs.size
+                           FROM frames LEFT JOIN blobs ON blobs.hash = frames.hash ORDER BY source, product, time''')
+    for source, product, time, h, status, size in rows:
+        s = summary.setdefault((source, product), {'n': 0, 'failed': [], 'repeated': [], 'ndup': 0, 'hashes': set(),
+                                                   'bytes': 0, 'stored_bytes': 0, 'prev': None})
+        s['n'] += 1
+        if h is None:
+            s['failed'].append((time, status))
+            s['prev'] = None
+            continue
+        if h in s['hashes']:
+            s['ndup'] += 1
+        else:
+            s['hashes'].add(h)
+            s['stored_bytes'] += size
+        if h == s['prev']: s['repeated'].append(time)
+        s['bytes'] += size
+        s['prev'] = h
+    return summary
+
+def Print_Summary(dbname):
+    conn = Open_Store(dbname)
+    total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+    print(f'{"source":<8}{"product":<16}{"frames":>8}{"failed":>8}{"dup":>8}{"images[MB]":>12}{"stored[MB]":>12}')
+    for (source, product), s in Store_Summary(conn).items():
+        print(f'{source:<8}{product:<16}{s["n"]:>8}{len(s["failed"]):>8}{s["ndup"]:>8}'
+              f'{s["bytes"]/1e6:>12.2f}{s["stored_bytes"]/1e6:>12.2f}')
+        for time, status in s['failed']:
+            print(f'  failed: {time} ({status})')
+        if len(s['repeated']) > 0:
+            print(f'  same as the previous frame: {" ".join(s["repeated"])}')
+    print(f'{total[0]} images ({total[1]/1e6:.2f} MB) in {dbname}')
+    conn.close()
+
+#%%
+if __name__ == '__main__':
+    Print_Summary(sys.argv[1])
@@ -1,5 +1,5 @@
 """
-dl_draw_jmagpv.py ver 1.0 coded by A.NISHII 
+dl_draw_jmagpv.py ver 1.8 coded by A.NISHII 
 
 京大生存圏データベースからJMA-GPVデータをダウンロードして
 降雨強度データを描画するスクリプト
@@ -12,30 +12,53 @@ Set variables around Line 45-60 and run
 python3 dl_draw_jmagpv.py
 
 NOTE
-wgirb2のpathが通っている必要がある
-You need wgrib2 to use this script
-Get wgrib2: https://www.cpc.ncep.noaa.gov/products/wesley/wgrib2/
+GRIB2の復号はjma_grib2.py(numpy)で行うため、wgrib2は不要(ver 1.3以降)
+wgrib2 is not needed (GRIB2 is decoded by jma_grib2.py)
+accum_dirを指定すると、cutrangeの範囲の期間全体の積算雨量と、移動積算雨量(accum_windows時間)の最大値・
+閾値(accum_thresholds)以上になった回数を計算してaccum_out(NetCDF)に保存する(jma_accum.py)
+途中で止まった場合は同じaccum_dirで再実行すると、積算済みの時刻の次から処理する(描画なども行わない)
 
 HISTORY(yyyy.mm.dd)
 Ver 1.0: Code Created 2022.12.14 by A.NISHII
+Ver 1.1: 処理段階(download,decode,read,render,cleanup)ごとの時間・メモリ・読み書き量の記録(perf_log, ../common/perflog.py)を追加 2026.10.18
+Ver 1.2: 降雨強度をWebメルカトルのタイルにしてMBTilesファイルに保存する機能(tile_db, tile_zooms, ../common/mbtiles.py)を追加 2026.10.18
+Ver 1.3: tarファイルの展開とwgrib2の代わりに、tarファイルから1km格子のGRIB2ファイルだけをメモリ上に読み出して
+         numpyで復号するよう変更(jma_grib2.py)。作業ディレクトリに一時ファイルを作らない 2026.10.18
+Ver 1.4: 時刻ごとの処理(復号、描画、バイナリ保存)を並列に行うモード(nproc)と、同時ダウンロード数(ndl)を追加。
+         データがない・処理に失敗した時刻は止めずに飛ばし、最後に一覧を表示・保存する(missing_list)
+         Bug fixed (edateが時間間隔(dint)の倍数でないと終わらない、ダウンロードに失敗したページをtarファイルとして保存していた) 2026.10.18
+Ver 1.5: 描画範囲ごとに地図(海岸線、目盛り、カラーバー)の図を1度だけ作成して使い回し、
+         各時刻は画像のデータとタイトルだけを入れ替えて保存するよう変更(Make_Map。出力画像は変わらない) 2026.10.18
+Ver 1.6: 積算雨量・移動積算雨量の最大値・閾値以上の回数を時刻ごとに加えていく機能(accum_dir, accum_windows,
+         accum_thresholds, accum_ckpt, accum_out, jma_accum.py)を追加。途中で止まっても続きから再開できる
+         Bug fixed (使っていない配列rintsを確保していた。期間が1日以上のときhoursが正しくなかった) 2026.10.18
+Ver 1.7: Bug fixed (nproc>1のとき、ダウンロードのスレッドが動いている間に子プロセスをforkしていた(ロックを持ったまま複製されると
+         子プロセスが止まることがある)。子プロセスはforkserver(使えない場合はspawn)で起動する) 2026.10.18
+Ver 1.8: Bug fixed (積算のNetCDF(accum_out)のhistoryがVer 1.6のままだった。バージョンはVERSIONの1か所で管理する) 2026.10.18
 
 """
+VERSION = '1.8' #HISTORYの最新のバージョン(NetCDFのhistoryに記録する)
 
 # In[72]:
 import numpy as np
-import subprocess
-import tarfile
 import datetime
 import matplotlib.pyplot as plt
-import glob
 import requests
-from os.path import exists
-from os import makedirs, remove
-from shutil import move
+import sys
+import traceback
+import multiprocessing
+from os.path import exists, dirname, abspath, join
+from os import makedirs, replace
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import matplotlib.ticker as mticker
 from matplotlib.colors import ListedColormap, BoundaryNorm
 import cartopy.crs as ccrs
 from cartopy.mpl.ticker import LatitudeFormatter,LongitudeFormatter
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+import mbtiles
+import jma_grib2
+import jma_accum
 
 
 #%% 
@@ -49,12 +72,24 @@ xtick_info = np.arange(120,150.1,10.0) #表示する経度ラベルをリスト
 ytick_info = np.arange(25,45.01,5.0)   #表示する緯度ラベルを指定
 
 DL_rish = True #True: 京大生存圏データベースからダウンロードする
-savebin = False #True: wgrib2で変換したバイナリファイルを保存する(現段階ではFalse推奨)
+savebin = False #True: 復号した降雨強度をバイナリファイル(wgrib2 -no_header -binと同じ形式)で保存する
 savefig = True #True: 画像を保存するかどうか
 
 rawd_path = './jmagpv_raw'    #京大生存圏からDLしたデータを保存するディレクトリ
 outdir_bin = './jmagpv_bin'   #変換したバイナリファイルを保存するディレクトリ(savebin=Trueのとき有効)
 outdir_fig = './fig_rint' #変換した画像を保存するディレクトリ(savefig=Trueのとき有効)
+tile_db = None #降雨強度(cutrangeの範囲)のWebメルカトルのタイル(XYZ, 256x256画素のPNG)を保存するMBTilesファイル(Noneなら作成しない)
+               #前の時刻から変わったタイルだけ画像を作成する(../common/mbtiles.py)
+tile_zooms = (4,5,6,7,8) #タイルを作成するズームレベル
+nproc = 1 #時刻ごとの処理(復号、描画、バイナリ保存)に使うプロセス数(1:逐次処理)
+ndl = 4 #同時にダウンロードするファイル数(DL_rish=Trueのとき有効)
+accum_dir = None #積算の状態(リングバッファ、途中結果)を保存するディレクトリ(Noneなら積算しない)
+accum_windows = (1,3,24,72) #移動積算雨量の時間(時間)
+accum_thresholds = {1:(20,50), 3:(50,100), 24:(100,200), 72:(200,400)} #移動積算雨量の閾値(mm)。閾値以上になった時刻数を数える
+accum_ckpt = 36 #積算の状態を保存する間隔(時刻数)
+accum_out = './jmagpv_accum.nc' #積算雨量・移動積算雨量の最大値・閾値以上の回数を保存するNetCDFファイル
+missing_list = './missing_jmagpv.txt' #データがない・処理に失敗した時刻の一覧を保存するファイル(Noneなら保存しない)
+perf_log = None #処理段階ごとの時間・メモリ・読み書き量を記録するファイル(JSON lines。Noneなら記録しない)
 
 #plt.rcParams['font.family'] = 'Times New Roman'
 plt.rcParams['font.size'] = 14 #フォントサイズ
@@ -62,46 +97,39 @@ plt.rcParams['xtick.labelsize'] = 12 #経度ラベルのフォントサイズ
 plt.rcParams['ytick.labelsize'] = 12 #緯度ラベルのフォントサイズ
 
 ##End of set parameters
+perflog.Setup(perf_log, 'dl_draw_jmagpv')
 
 # In[77]: Definision of functions
 def DL_RawGPV(path,date):
     url = 'http://database.rish.kyoto-u.ac.jp/arch/jmadata/data/jma-radar/synthetic/original/'+date[0:4]+'/'+date[4:6]+'/'+date[6:8]
     #print(url)
     fname = 'Z__C_RJTD_'+date+'00_RDR_JMAGPV__grib2.tar'
-    file = requests.get(url+'/'+fname)
+    file = requests.get(url+'/'+fname, timeout=60)
+    file.raise_for_status() #データがない場合(404など)は保存しない
     
     dlpath = path+'/'+date[0:4]+'/'+date[4:6]+'/'+date[6:8]+'/'
     #print(dlpath)
     makedirs(dlpath,exist_ok=True)
         
-    with open(dlpath + fname, 'wb') as f:
+    with open(dlpath + fname + '.part', 'wb') as f:
         f.write(file.content)
+    replace(dlpath + fname + '.part', dlpath + fname)
 
 
 # In[78]:
 
 
-def Unzip_Decode(tarpath,binname, date):
-    ##tarファイルを展開
-    with tarfile.open(tarpath,'r') as tf:
-        tf.extractall(path='.')
-    
-    ##1km 解像度のgrib2ファイルのpathを取得
-    gribpath = 'Z__C_RJTD_{0}00_RDR_JMAGPV_Ggis1km_Prr10lv_ANAL_grib2.bin'.format(date)
-        
-    ##Decode grib2 by wgrib2 (4-byte浮動小数点型バイナリに変換)
-    commands = ['wgrib2',gribpath,'-no_header','-bin',binname]
-    subprocess.run(commands)
-
-
-# In[79]:
-def Get_Rint(fname, xnum, ynum):
-    print(fname)
-    rint = np.fromfile(fname, dtype=np.float32)
-    rint = rint.reshape((ynum, xnum))
+def Unzip_Decode(tarpath, xnum, ynum):
+    ##tarファイルから1km 解像度のgrib2ファイル(Ggis1km_Prr10lv_ANAL)だけを読み出して復号する(ファイルには書き出さない)
+    print(tarpath)
+    rint = jma_grib2.Read_JMAGPV(tarpath, 'Ggis1km_Prr10lv_ANAL')
+    if rint.shape != (ynum, xnum):
+        raise ValueError(f'Unexpected grid size {rint.shape} in {tarpath}')
     return rint
 
 # In[103]:
+rint_levels = [0,5,10,20,30,50,80,120] #降雨強度の色の境界値(mm/h)
+
 def Create_Cmap(clevs):
     ##0,5,10,20,30,50,80,120
     cmap_rgb=np.array(
@@ -137,48 +165,169 @@ def Set_Map_Ticks(ax,xticks,yticks):
     #ax.set_ylabel('Latitude')
 
 
-def Draw_JMAGPV(rint, lons, lats, xticks, yticks, date,savepath,save=False):
-    levels = [0,5,10,20,30,50,80,120]
+#描画範囲ごとの図(地図、目盛り、カラーバー)。各時刻は画像のデータとタイトルだけを入れ替える
+_map_cache = {}
+
+#Make_Map: 描画範囲の図を作成し、(図, 画像, タイトル)を返す(作成済みならそれを返す)
+def Make_Map(lons, lats, xticks, yticks):
+    key = (float(lons[0]), float(lons[-1]), float(lats[0]), float(lats[-1]), len(lons), len(lats),
+           tuple(xticks), tuple(yticks))
+    if key in _map_cache:
+        return _map_cache[key]
+    levels = rint_levels
     extent = [lons[0],lons[-1],lats[0],lats[-1]]
     fig = plt.figure()
     ax = fig.add_subplot(111,projection=ccrs.PlateCarree())
     ax.coastlines(resolution='10m',linewidth=0.5)
     ax.set_extent(extent,ccrs.PlateCarree())
-    rint_draw = np.where(rint>0.01,rint,-1.)
-    rint_draw = np.where(rint_draw<999,rint_draw,np.nan)
     cmap, norm = Create_Cmap(levels)
-    print(rint_draw.shape)
-    cm = ax.imshow(rint_draw, cmap=cmap, norm=norm, extent=extent, origin='lower')
+    cm = ax.imshow(np.full((len(lats),len(lons)),np.nan), cmap=cmap, norm=norm, extent=extent, origin='lower')
     #cm = ax.contourf(lons,lats,rint_draw,cmap=cmap, norm=norm)
     cbar = fig.colorbar(cm, ax=ax, ticks=levels,extend='both',shrink=0.8)
     cbar.set_label('[mm/h]')
     Set_Map_Ticks(ax,xticks, yticks)
-    ax.set_title('JMA-GPV Rainfall Intensity [mm/h]\n{0}/{1}/{2} {3}:{4} JST'.format(
-                 date[0:4],date[4:6],date[6:8],date[8:10],date[10:12]))
+    title = ax.set_title('')
+    _map_cache[key] = (fig, cm, title)
+    return _map_cache[key]
+
+def Draw_JMAGPV(rint, lons, lats, xticks, yticks, date,savepath,save=False):
+    fig, cm, title = Make_Map(lons, lats, xticks, yticks)
+    rint_draw = np.where(rint>0.01,rint,-1.)
+    rint_draw = np.where(rint_draw<999,rint_draw,np.nan)
+    print(rint_draw.shape)
+    cm.set_data(rint_draw)
+    title.set_text('JMA-GPV Rainfall Intensity [mm/h]\n{0}/{1}/{2} {3}:{4} JST'.format(
+                   date[0:4],date[4:6],date[6:8],date[8:10],date[10:12]))
     if savefig:
         savedir = '{0}/{1}/'.format(savepath, date[0:8])
         makedirs(savedir,exist_ok=True)
         ofname = savedir + 'jmagpv_{0}jst.jpg'.format(date)
-        plt.savefig(ofname,dpi=300,bbox_inches='tight')
+        fig.savefig(ofname,dpi=300,bbox_inches='tight')
     else:
+        #表示したウィンドウを閉じると図は使えなくなるため、次の時刻は作り直す
+        _map_cache.clear()
         plt.show()
-    plt.close()
-
+        plt.close(fig)
+
+
+#Tile_Colors: 降雨強度をタイルの色番号(uint8)にする(0.01 mm/h以下と欠測は0(透明))
+def Tile_Colors(rint):
+    cnum = np.digitize(rint, rint_levels).astype(np.uint8)
+    cnum[(rint <= 0.01) | ~(rint < 999)] = 0
+    return cnum
+
+#Write_JMAGPV_Tiles: 色番号(Tile_Colors)をWebメルカトルのタイルにしてMBTilesファイルに保存する
+#(色はDraw_JMAGPVと同じ)
+def Write_JMAGPV_Tiles(conn, cnum, lons, lats, date, luts):
+    levels = np.array(rint_levels, dtype=np.float64)
+    cmap, norm = Create_Cmap(rint_levels)
+    rep = np.append((levels[1:] + levels[:-1]) / 2., levels[-1] + 1.) #各区間と最後の境界値以上の代表値
+    rgb = np.round(cmap(norm(rep))[:,:3] * 255).astype(np.uint8)
+    lut_func = mbtiles.Regular_LUT(lons[0], 0.012500, len(lons), lats[0], 0.008333, len(lats))
+    bounds = [lons[0], lats[0], lons[-1], lats[-1]]
+    nnew, nsame = mbtiles.Write_Tiles(conn, date, cnum, [0, 0, 0] + rgb.ravel().tolist(), lut_func, luts,
+                                      tile_zooms, bounds)
+    print(f'Tiles saved to {tile_db} ({date}, new: {nnew}, unchanged: {nsame})')
+
+
+def Save_Bin(rint, outdir_bin, date):
+    ##4-byte浮動小数点型バイナリ(南から北の順、欠測は9.999e20)
+    savedir = '{0}/{1}/'.format(outdir_bin,date[0:8])
+    makedirs(savedir,exist_ok=True)
+    rint.astype(np.float32).tofile(savedir + 'jmagpv_'+date+'00.bin')
+
+
+#Tar_Path: 時刻date(UTC, yyyymmddHHMM)のtarファイルのパス
+def Tar_Path(date):
+    return rawd_path + '/{0}/{1}/{2}/Z__C_RJTD_{3}00_RDR_JMAGPV__grib2.tar'.format(
+           date[0:4],date[4:6],date[6:8],date)
+
+#Get_Step: 時刻dateのtarファイルを用意する(なければダウンロードする)
+#(ダウンロードのスレッドで実行する。perf_logにはこのスレッドの経過時間・CPU時間・バイト数だけが記録される(perflog.py ver 1.1))
+def Get_Step(date):
+    tpath = Tar_Path(date)
+    if not exists(tpath):
+        if not DL_rish:
+            raise FileNotFoundError(tpath + ' Not found!')
+        print('Download data from Internet: ' + date)
+        with perflog.Stage('download', tpath):
+            DL_RawGPV(rawd_path, date)
+    return tpath
 
-def Move_Clear(savebin, outdir_bin, date):
-    flist = glob.glob('Z__C_RJTD*.bin')
+#Process_Step: 時刻date_dtのデータを復号して描画・保存し、(タイルの色番号, cutrangeの降雨強度)を返す
+#(それぞれtile_db, accum_dirがNoneならNone。並列処理の各プロセスで実行する。一時ファイルは使わない)
+def Process_Step(date_dt, tpath):
+    date = date_dt.strftime("%Y%m%d%H%M")
+    with perflog.Stage('decode', tpath):
+        rint_full = Unzip_Decode(tpath,raw_xmax,raw_ymax)
+    crint = rint_full[clat_idx[0]:clat_idx[1],clon_idx[0]:clon_idx[1]]
+    date_jst = (date_dt+datetime.timedelta(hours=9)).strftime("%Y%m%d%H%M")
+    with perflog.Stage('render', tpath):
+        Draw_JMAGPV(crint, cutlon, cutlat, xtick_info, ytick_info, date_jst, outdir_fig, savefig)
     if savebin:
-        savedir = '{0}/{1}/'.format(outdir_bin,date[0:8])
-        makedirs(savedir,exist_ok=True)
-        flist_bin = glob.glob('jmagpv_*.bin')
-        for f in flist_bin:
-            move(f,savedir)
-    else:
-        flist.extend(glob.glob('jmagpv_*.bin'))
-        
-    for f in flist:
-        remove(f)
-        #print(f+' removed.')
+        with perflog.Stage('savebin', tpath):
+            Save_Bin(rint_full, outdir_bin, date)
+    return (None if tile_db is None else Tile_Colors(crint)), (None if accum_dir is None else crint)
+
+#Run_Step: Process_Stepを実行し、(エラー内容(成功したらNone), 結果)を返す(失敗しても処理は止めない)
+def Run_Step(date_dt, tpath):
+    try:
+        return None, Process_Step(date_dt, tpath)
+    except Exception:
+        return traceback.format_exc(), None
+
+#Run_Steps: 全時刻を逐次(nproc=1)または並列に処理し、データがない・失敗した時刻の一覧[(時刻, エラー内容)]を返す
+#ダウンロードはndl個のスレッドで先に進め、届いた時刻から処理する
+#結果は時刻順にwriter(時刻, Process_Stepの結果(失敗した時刻はNone))に渡す(タイルの保存、積算)
+def Run_Steps(dates, nproc, writer=None):
+    missing = []
+    pending = {}  #順番待ちの結果
+    nextidx = [0] #次にwriterに渡す番号
+
+    def collect(i, err, res):
+        if err is not None:
+            print(f'{dates[i].strftime("%Y%m%d%H%M")}: Skip this time\n{err}')
+            missing.append((dates[i], err))
+        pending[i] = res
+        while nextidx[0] in pending:
+            res = pending.pop(nextidx[0])
+            if writer is not None: writer(dates[nextidx[0]], res)
+            nextidx[0] += 1
+
+    with ThreadPoolExecutor(max_workers=max(1, ndl)) as downloader:
+        downloads = {downloader.submit(Get_Step, d.strftime("%Y%m%d%H%M")): i for i, d in enumerate(dates)}
+        if nproc <= 1:
+            for fut, i in downloads.items(): #時刻順に処理する
+                try:
+                    tpath = fut.result()
+                except Exception:
+                    collect(i, traceback.format_exc(), None)
+                    continue
+                collect(i, *Run_Step(dates[i], tpath))
+            return missing
+
+        #ダウンロードのスレッドが動いているため、子プロセスはforkではなくforkserver(またはspawn)で起動する
+        #(子プロセスはこのスクリプトを読み込み直すので、パラメータはファイルに書いた値が使われる)
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=nproc, mp_context=multiprocessing.get_context(method)) as executor:
+            futures = dict(downloads)
+            tasks = {}
+            while len(futures) > 0:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = futures.pop(fut)
+                    try:
+                        res = fut.result()
+                    except Exception:
+                        collect(i, traceback.format_exc(), None)
+                        continue
+                    if fut in tasks:
+                        collect(i, *res)
+                    else:
+                        task = executor.submit(Run_Step, dates[i], res)
+                        tasks[task] = i
+                        futures[task] = i
+    return missing
 
 
 # In[102]: Main
@@ -197,40 +346,50 @@ clat_idx = np.array([clat_midx,clat_midx+len(cutlat)],dtype=np.int32)
 
 sdate_dt = datetime.datetime.strptime(sdate,'%Y%m%d%H%M')
 edate_dt = datetime.datetime.strptime(edate,'%Y%m%d%H%M')
-hours =  int((edate_dt - sdate_dt).seconds / 3600.)
-
-rints = np.zeros((hours*int(60/dint),len(cutlat),len(cutlon)))
-
-date_dt = sdate_dt
-date = date_dt.strftime("%Y%m%d%H%M")
-
-while True:
-    tpath = rawd_path + '/{0}/{1}/{2}/Z__C_RJTD_{3}00_RDR_JMAGPV__grib2.tar'.format(
-            date[0:4],date[4:6],date[6:8],date)
 
-    #print(cum_count,tpath)
-    if not exists(tpath):
-        if DL_rish:
-            print('Download data from Internet')
-            DL_RawGPV(rawd_path, date)
-        else:
-            print(tpath + 'Not found! Skip this time')
-            date_dt = date_dt+datetime.timedelta(minutes=dint)
-            date = date_dt.strftime("%Y%m%d%H%M")
-            continue
-
-    binname = './jmagpv_'+date+'00.bin'
-    Unzip_Decode(tpath,binname,date)
-
-    rint_full = Get_Rint(binname,raw_xmax,raw_ymax)
-    crint = rint_full[clat_idx[0]:clat_idx[1],clon_idx[0]:clon_idx[1]]
-    date_jst = (date_dt+datetime.timedelta(hours=9)).strftime("%Y%m%d%H%M")
-    Draw_JMAGPV(crint, cutlon, cutlat, xtick_info, ytick_info, date_jst, outdir_fig, savefig)
-
-    Move_Clear(savebin, outdir_bin, date)
-            
-    if date == edate:
-        break
-    
-    date_dt = date_dt+datetime.timedelta(minutes=dint)
-    date = date_dt.strftime("%Y%m%d%H%M")
+if __name__ == '__main__':
+    acc = None
+    if accum_dir is not None:
+        acc = jma_accum.Open_Accum(accum_dir, (len(cutlat), len(cutlon)), dint, accum_windows, accum_thresholds,
+                                   accum_ckpt)
+        if acc['start'] is not None and acc['start'] != sdate_dt:
+            raise ValueError(f'{accum_dir} started at {acc["start"]} (sdate: {sdate}). Use another accum_dir')
+
+    dates = []
+    date_dt = sdate_dt
+    while date_dt <= edate_dt:
+        #積算済みの時刻(再実行時)は処理しない
+        if acc is None or acc['n'] == 0 or date_dt > jma_accum.Step_Time(acc, acc['n']-1):
+            dates.append(date_dt)
+        date_dt = date_dt+datetime.timedelta(minutes=dint)
+    if len(dates) == 0: print('All times have already been accumulated')
+
+    if tile_db is not None:
+        tile_conn = mbtiles.Open_MBTiles(tile_db, 'JMA-GPV rainfall intensity',
+                                         [cutlon[0], cutlat[0], cutlon[-1], cutlat[-1]], tile_zooms)
+        tile_luts = {} #タイルの画素→格子の対応表(全時刻で使い回す)
+
+    def writer(date_dt, res):
+        cnum, crint = (None, None) if res is None else res
+        if cnum is not None:
+            with perflog.Stage('tiles', date_dt.strftime("%Y%m%d%H%M")):
+                Write_JMAGPV_Tiles(tile_conn, cnum, cutlon, cutlat, date_dt.strftime('%Y-%m-%dT%H:%MZ'), tile_luts)
+        if acc is not None:
+            with perflog.Stage('accum', date_dt.strftime("%Y%m%d%H%M")):
+                jma_accum.Add_Frame(acc, date_dt, crint) #失敗した時刻は欠測として加える
+
+    missing = Run_Steps(dates, nproc, writer)
+    print(f'Finish: {len(dates)-len(missing)}/{len(dates)} times processed')
+    if acc is not None and acc['n'] > 0:
+        with perflog.Stage('accum', accum_out):
+            jma_accum.Checkpoint(acc)
+            jma_accum.Save_Stats(acc, accum_out, cutlon, cutlat, f'Created by dl_draw_jmagpv.py ver {VERSION}')
+        print(f'Accumulation of {acc["n"]} times ({acc["nmissing"]} missing) saved to {accum_out}')
+    if len(missing) > 0:
+        missing.sort()
+        print('Missing times (UTC): ' + ' '.join(d.strftime("%Y%m%d%H%M") for d, _ in missing))
+        if missing_list is not None:
+            with open(missing_list, 'w') as fp:
+                for d, err in missing:
+                    fp.write(d.strftime("%Y%m%d%H%M") + '\t' + err.strip().splitlines()[-1] + '\n')
+            print(f'List of missing times saved to {missing_list}')
@@ -0,0 +1,188 @@
+"""
+jma_accum.py ver 1.1
+JMA-GPV(10分ごとの降水強度)を1時刻ずつ加えていき、期間全体の積算雨量と、
+移動積算雨量(1、3、24、72時間など)の最大値・閾値以上になった回数を計算するモジュール
+dl_draw_jmagpv.pyから呼び出して使用する
+
+Useage(スクリプト側)
+    acc = jma_accum.Open_Accum(accum_dir, shape, dint, windows, thresholds)  #前回の続きがあれば読み込む
+    jma_accum.Add_Frame(acc, date_dt, rint)   #時刻順に呼ぶ(rint: 降水強度(mm/h)、Noneなら欠測時刻)
+    jma_accum.Checkpoint(acc)                 #状態を保存(ckpt_steps時刻ごとにAdd_Frameからも呼ばれる)
+    jma_accum.Save_Stats(acc, ncname, lons, lats, history)  #history: NetCDFのhistory(作成したスクリプトとバージョン)
+
+*使用メモリは期間の長さによらず一定(格子数 x (積算時間の数 x 2 + 閾値の数 + 3) x 4〜8バイト)
+*移動積算には最長の積算時間+ckpt_steps時刻分の降水強度のリングバッファ(uint16, 0.01 mm/h単位)を
+ accum_dir/ring.npyのメモリマップで使う(ディスクに置くため、メモリは使わない)
+*積算値は0.01 mm/h x 時刻数の整数で持つ(長期間足し引きしても誤差がたまらない)
+*状態(積算値、最大値、回数、時刻)はckpt_steps時刻ごとにaccum_dir/state.npzへ保存する(一時ファイルに書いてから置き換える)
+ 途中で止まった場合は同じaccum_dirで再実行すると、保存した時刻の次から処理し直す
+*欠測(格子の欠測値、ファイルがない時刻)は0 mm/hとして積算し、格子ごとの有効な時刻数をnvalidに数える
+*移動積算の最大値と閾値以上の回数は、積算時間分のデータがそろった時刻(開始からwindow時間後)から数える
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 Save_Statsのhistoryを呼び出し側から渡すよう変更(dl_draw_jmagpv.pyのバージョンが固定されていた) 2026.10.18
+"""
+
+import os
+import json
+import datetime
+from os.path import exists, join
+import numpy as np
+import netCDF4
+
+VERSION = '1.1' #HISTORYの最新のバージョン(NetCDFのhistoryに記録する)
+SCALE = 100.   #リングバッファの単位(0.01 mm/h)
+RMAX = 65534   #リングバッファの最大値(655.34 mm/h)
+
+#%%
+#Open_Accum: 積算の状態を作成する(accum_dirに前回の状態があれば読み込む)
+def Open_Accum(accum_dir, shape, dint=10, windows=(1, 3, 24, 72), thresholds=None, ckpt_steps=36):
+    ##shape: 格子の大きさ(ny, nx)、dint: 時間間隔(分)、windows: 移動積算の時間(時間)
+    ##thresholds: 積算時間ごとの閾値(mm)の辞書({1: (20, 50), ...})、ckpt_steps: 状態を保存する間隔(時刻数)
+    os.makedirs(accum_dir, exist_ok=True)
+    thresholds = {int(w): tuple(float(t) for t in (thresholds or {}).get(w, ())) for w in windows}
+    wsteps = [int(w * 60 // dint) for w in windows]
+    nring = max(wsteps) + ckpt_steps #保存後に上書きされる分を余分に持つ(再実行時に必要な時刻が残るように)
+    meta = {'shape': [int(n) for n in shape], 'dint': int(dint), 'windows': [int(w) for w in windows],
+            'thresholds': {str(w): list(t) for w, t in thresholds.items()}, 'nring': nring, 'ckpt_steps': ckpt_steps}
+
+    sname = join(accum_dir, 'state.npz')
+    rname = join(accum_dir, 'ring.npy')
+    acc = {'dir': accum_dir, 'meta': meta, 'wsteps': wsteps, 'windows': list(windows), 'thresholds': thresholds,
+           'zero': np.zeros(shape, dtype=np.uint16), 'zero_run': 0}
+    #閾値(mm)を積算値の単位(0.01 mm/h x 時刻数)にする
+    acc['thr_int'] = [[int(np.ceil(round(t * 60. / dint * SCALE, 6))) for t in thresholds[w]] for w in windows]
+    if exists(sname):
+        with np.load(sname) as st:
+            saved = json.loads(str(st['meta']))
+            if {k: saved[k] for k in meta} != meta:
+                raise ValueError(f'{accum_dir} was created with different settings ({saved}). Use another accum_dir')
+            for k in ('sums', 'maxs', 'counts', 'total', 'nvalid'):
+                acc[k] = np.array(st[k])
+        acc['ring'] = np.load(rname, mmap_mode='r+')
+        acc['start'] = datetime.datetime.strptime(saved['start'], '%Y%m%d%H%M')
+        acc['n'] = saved['n']
+        acc['nmissing'] = saved['nmissing']
+        print(f'Accumulation resumed: {acc["n"]} steps from {saved["start"]} UTC in {accum_dir}')
+    else:
+        nw = len(windows)
+        nthr = sum(len(t) for t in thresholds.values())
+        acc['ring'] = np.lib.format.open_memmap(rname, mode='w+', dtype=np.uint16, shape=(nring,) + tuple(shape))
+        acc['sums'] = np.zeros((nw,) + tuple(shape), dtype=np.int32)   #移動積算(0.01 mm/h x 時刻数)
+        acc['maxs'] = np.zeros((nw,) + tuple(shape), dtype=np.int32)   #移動積算の最大値
+        acc['counts'] = np.zeros((nthr,) + tuple(shape), dtype=np.int32) #閾値以上になった時刻数
+        acc['total'] = np.zeros(shape, dtype=np.int64)                 #期間全体の積算
+        acc['nvalid'] = np.zeros(shape, dtype=np.int32)                #有効な時刻数
+        acc['start'] = None
+        acc['n'] = 0
+        acc['nmissing'] = 0
+    return acc
+
+#Step_Time: n番目の時刻
+def Step_Time(acc, n):
+    return acc['start'] + datetime.timedelta(minutes=acc['meta']['dint'] * n)
+
+#%%
+#Fold: 1時刻分(0.01 mm/h単位のuint16)をリングバッファと積算値に加える
+def Fold(acc, x):
+    n = acc['n']
+    ring, nring = acc['ring'], acc['meta']['nring']
+    x32 = x.astype(np.int32)
+    k = 0
+    for i, (w, ws) in enumerate(zip(acc['windows'], acc['wsteps'])):
+        s = acc['sums'][i]
+        s += x32
+        if n - ws >= 0: s -= ring[(n - ws) % nring]
+        if n + 1 >= ws: #積算時間分のデータがそろった
+            np.maximum(acc['maxs'][i], s, out=acc['maxs'][i])
+            for j, t in enumerate(acc['thr_int'][i]):
+                acc['counts'][k + j] += s >= t
+        k += len(acc['thr_int'][i])
+    ring[n % nring] = x
+    acc['total'] += x32
+    acc['n'] = n + 1
+    if acc['n'] % acc['meta']['ckpt_steps'] == 0: Checkpoint(acc)
+
+#Add_Frame: 時刻date_dt(UTC)の降水強度rint(mm/h, 欠測は999以上)を加える(rint=Noneなら欠測時刻)
+#前の時刻との間の時刻は欠測として加える。加えた時刻以前の時刻(再実行時)は何もせずFalseを返す
+def Add_Frame(acc, date_dt, rint):
+    if acc['start'] is None: acc['start'] = date_dt
+    dint = acc['meta']['dint']
+    n = int(round((date_dt - acc['start']).total_seconds() / 60. / dint))
+    if n < acc['n']:
+        return False
+    #間の欠測時刻(nring時刻続けて欠測するとリングバッファと移動積算は全て0になり、それ以降の欠測時刻は何も変えないので飛ばす)
+    while acc['n'] < n:
+        if acc['zero_run'] >= acc['meta']['nring']:
+            acc['nmissing'] += n - acc['n']
+            acc['n'] = n
+            Checkpoint(acc)
+            break
+        Add_Missing(acc)
+    if rint is None:
+        Add_Missing(acc)
+        return True
+    valid = rint < 999
+    x = np.where(valid, np.clip(np.round(rint * SCALE), 0, RMAX), 0).astype(np.uint16)
+    acc['nvalid'] += valid
+    acc['zero_run'] = 0
+    Fold(acc, x)
+    return True
+
+def Add_Missing(acc):
+    acc['nmissing'] += 1
+    acc['zero_run'] += 1
+    Fold(acc, acc['zero'])
+
+#%%
+#Checkpoint: 状態をaccum_dir/state.npzに保存する(リングバッファを書き出してから、一時ファイルに書いて置き換える)
+def Checkpoint(acc):
+    if acc['start'] is None: return
+    acc['ring'].flush()
+    meta = dict(acc['meta'], start=acc['start'].strftime('%Y%m%d%H%M'), n=acc['n'], nmissing=acc['nmissing'])
+    sname = join(acc['dir'], 'state.npz')
+    with open(sname + '.tmp', 'wb') as fp:
+        np.savez(fp, meta=json.dumps(meta), sums=acc['sums'], maxs=acc['maxs'], counts=acc['counts'],
+                 total=acc['total'], nvalid=acc['nvalid'])
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(sname + '.tmp', sname)
+
+#%%
+#Save_Stats: 積算雨量・移動積算の最大値・閾値以上の回数をNetCDFファイルに保存する
+def Save_Stats(acc, ncname, lons, lats, history=''):
+    if acc['n'] == 0:
+        raise ValueError('No steps accumulated')
+    dint = acc['meta']['dint']
+    tomm = dint / 60. / SCALE #0.01 mm/h x 時刻数 → mm
+    ny, nx = acc['meta']['shape']
+    nc = netCDF4.Dataset(ncname, 'w', format='NETCDF4')
+    nc.createDimension('lat', ny)
+    nc.createDimension('lon', nx)
+    def save(name, var, long_name, units, dtype, dims, **kwargs):
+        v = nc.createVariable(name, dtype, dims, zlib=True, complevel=4, **kwargs)
+        v.long_name = long_name
+        v.units = units
+        v[:] = var
+    save('lat', lats, 'latitude', 'degrees_north', 'f8', ('lat',))
+    save('lon', lons, 'longitude', 'degrees_east', 'f8', ('lon',))
+    save('total', (acc['total'] * tomm).astype(np.float32), 'total precipitation', 'mm', 'f4', ('lat', 'lon'))
+    save('nvalid', acc['nvalid'], 'number of valid 10-minute steps', '1', 'i4', ('lat', 'lon'))
+    k = 0
+    for i, w in enumerate(acc['windows']):
+        save(f'max_{w}h', (acc['maxs'][i] * tomm).astype(np.float32), f'maximum {w}-hour precipitation', 'mm',
+             'f4', ('lat', 'lon'))
+        for t in acc['thresholds'][w]:
+            save(f'count_{w}h_ge{t:g}mm', acc['counts'][k], f'number of steps with {w}-hour precipitation >= {t:g} mm',
+                 '1', 'i4', ('lat', 'lon'))
+            k += 1
+    nc.title = 'Precipitation accumulation statistics of JMA-GPV (Ggis1km_Prr10lv_ANAL)'
+    nc.time_start = acc['start'].strftime('%Y-%m-%d %H:%M UTC')
+    nc.time_end = Step_Time(acc, acc['n'] - 1).strftime('%Y-%m-%d %H:%M UTC')
+    nc.nsteps = acc['n']
+    nc.nsteps_missing = acc['nmissing']
+    nc.comment = f'Moving accumulations of {dint}-minute rainfall intensity ending at each step. ' \
+                 'Missing values are counted as 0 mm/h.'
+    nc.history = f'{history} (jma_accum.py ver {VERSION})'.strip()
+    nc.close()
@@ -0,0 +1,119 @@
+"""
+jma_grib2.py ver 1.0
+JMA-GPV(全国合成レーダーGPV、1km格子の降水強度)のGRIB2ファイルをwgrib2を使わずにnumpyで復号するモジュール
+dl_draw_jmagpv.pyから呼び出して使用する
+
+RISHのtarファイルから必要なGRIB2ファイル(Ggis1km_Prr10lv_ANAL)だけをメモリ上に読み出し、
+ランレングス圧縮(GRIB2 資料表現テンプレート5.200)されたレベル値を展開して代表値の配列にする。
+一時ファイルは作らない。
+*配列はwgrib2 -no_header -binの出力と同じく南から北の順(y, x)、欠測は9.999e20
+*ランレングスの展開はnumpyでまとめて行う(レベル値の位置と各ランの長さを求め、np.repeatで並べる)
+
+参考: WMO FM92 GRIB Edition 2 (資料表現テンプレート5.200: ランレングス圧縮)
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+"""
+
+import struct
+import tarfile
+import numpy as np
+
+UNDEF = 9.999e20 #欠測値(wgrib2と同じ)
+
+#%%
+#Read_Member: tarファイルから名前がpatternを含むファイルだけを読み出し、中身(bytes)を返す
+def Read_Member(tarpath, pattern):
+    with tarfile.open(tarpath, 'r') as tf:
+        for m in tf:
+            if pattern in m.name and m.isfile():
+                return tf.extractfile(m).read()
+    raise FileNotFoundError(f'{pattern} is not found in {tarpath}')
+
+#%%
+#Split_Sections: GRIB2の1つ目のメッセージを節ごとに分け、{節番号: 節の中身(bytes)}を返す
+#(1メッセージに複数の格子がある場合は最初のものを使う)
+def Split_Sections(buf):
+    if buf[0:4] != b'GRIB' or buf[7] != 2:
+        raise ValueError('Not a GRIB edition 2 message')
+    total = struct.unpack('>Q', buf[8:16])[0]
+    sections = {}
+    pos = 16
+    while pos < total - 4:
+        length, num = struct.unpack('>IB', buf[pos:pos+5])
+        if num not in sections: sections[num] = buf[pos:pos+length]
+        if num == 7: break
+        pos += length
+    return sections
+
+#Unpack_Bits: nbitビットずつ詰められた符号なし整数をn個取り出す
+def Unpack_Bits(data, nbit, n):
+    if nbit == 8:
+        return np.frombuffer(data, dtype=np.uint8, count=n).astype(np.int64)
+    if nbit == 16:
+        return np.frombuffer(data, dtype='>u2', count=n).astype(np.int64)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:n * nbit].reshape(n, nbit)
+    return bits.astype(np.int64) @ (1 << np.arange(nbit - 1, -1, -1, dtype=np.int64))
+
+#%%
+#Decode_RunLength: ランレングス圧縮されたレベル値をnpoints個のレベル値(int)に展開する
+def Decode_RunLength(codes, maxv, nbit, npoints):
+    ##codes: 第7節の各値、maxv: 使用しているレベル値の最大値(V)
+    ##maxvより大きい値はランレングス(直前のレベル値の繰り返し数-1)を(2^nbit-1-V)進数で下の桁から表したもの
+    lngu = 2**nbit - 1 - maxv
+    is_level = codes <= maxv
+    pos = np.flatnonzero(is_level)
+    if len(pos) == 0 or pos[0] != 0:
+        raise ValueError('Invalid run-length data')
+    group = np.cumsum(is_level) - 1 #各値が属するラン(レベル値)の番号
+    digit = np.flatnonzero(~is_level)
+    k = digit - pos[group[digit]] - 1 #ランレングスの桁
+    runs = np.ones(len(pos), dtype=np.int64)
+    np.add.at(runs, group[digit], (codes[digit] - maxv - 1) * lngu**k)
+    if runs.sum() != npoints:
+        raise ValueError(f'Run-length data has {runs.sum()} points ({npoints} points expected)')
+    return np.repeat(codes[pos], runs)
+
+#%%
+#Decode_GRIB2: GRIB2(bytes)の降水強度などを(南北, 東西)の配列(float32, 南から北の順)にする
+def Decode_GRIB2(buf):
+    sec = Split_Sections(buf)
+    s3, s5, s6, s7 = sec[3], sec[5], sec[6], sec[7]
+    tmpl3 = struct.unpack('>H', s3[12:14])[0]
+    if tmpl3 != 0:
+        raise ValueError(f'Grid definition template 3.{tmpl3} is not supported')
+    ni, nj = struct.unpack('>II', s3[30:38])
+    scan = s3[71]
+
+    npoints, tmpl5 = struct.unpack('>IH', s5[5:11])
+    if tmpl5 != 200:
+        raise ValueError(f'Data representation template 5.{tmpl5} is not supported (5.200 only)')
+    nbit = s5[11]
+    maxv, maxlv = struct.unpack('>HH', s5[12:16])
+    dscale = s5[16] if s5[16] < 128 else -(s5[16] - 128) #符号付き(最上位ビットが符号)
+    levels = np.frombuffer(s5[17:17 + 2 * maxlv], dtype='>u2').astype(np.float64) / 10.**dscale
+
+    #レベル値→代表値(レベル0は欠測)
+    table = np.full(maxlv + 1, UNDEF, dtype=np.float32)
+    table[1:] = levels
+    ncodes = (len(s7) - 5) * 8 // nbit
+    lv = Decode_RunLength(Unpack_Bits(s7[5:], nbit, ncodes), maxv, nbit, npoints)
+    values = table[lv]
+
+    #ビットマップ(0: 第6節のビットマップを使用、255: なし)
+    if s6[5] == 0:
+        bitmap = np.unpackbits(np.frombuffer(s6[6:], dtype=np.uint8))[:ni * nj].astype(bool)
+        full = np.full(ni * nj, UNDEF, dtype=np.float32)
+        full[bitmap] = values
+        values = full
+    elif s6[5] != 255:
+        raise ValueError(f'Bitmap indicator {s6[5]} is not supported')
+
+    values = values.reshape(nj, ni)
+    if not scan & 0x40: values = values[::-1] #北から南の順なら南から北の順に並べ替える
+    if scan & 0x80: values = values[:, ::-1]  #東から西の順なら西から東の順に並べ替える
+    return np.ascontiguousarray(values)
+
+#Read_JMAGPV: RISHのtarファイルからpatternを含むGRIB2ファイルを読み出して復号する
+def Read_JMAGPV(tarpath, pattern='Ggis1km_Prr10lv_ANAL'):
+    return Decode_GRIB2(Read_Member(tarpath, pattern))
@@ -0,0 +1,362 @@
+#%%
+"""
+Bench_NEXRAD.py ver 1.1
+NEXRADの処理(Make_CAPPI_NEXRAD.py、Draw_NEXRAD_Level2.py)の各段階の処理時間を計測するベンチマーク
+ネットワークは使わず、Level-II形式(LDM形式、MSG31)の疑似ボリュームを作成して計測する
+結果はJSONファイルに保存し、スクリプトやライブラリを変更した前後の比較に使う
+
+計測する段階(stagesで選択)
+ make_volume    : 疑似ボリュームの作成(参考値)
+ read           : pyart.io.read_nexrad_archiveで全スイープ・全変数を読み出す(変更前のMake_CAPPIと同じ)
+ read_selected  : nexrad_l2reader.Read_Level2でppi_useのスイープと必要な変数だけを読み出す(現在のMake_CAPPIと同じ)
+ extract        : Radar.extract_sweeps(ppi_use)でスイープを抽出する
+ kdp            : pyart.retrieve.kdp_vulpianiでKdpを計算する
+ kdp_fast       : nexrad_kdp.Kdp_Vulpianiで反射強度のgatefilterを通るゲートのKdpを計算する
+                  (kdpと同時に計測した場合、gatefilterを通るゲートでのkdpとの差をvalidationに記録する)
+ grid           : pyart.map.grid_from_radarsでCAPPIを作成する
+ grid_wcache    : 保存済みの内挿重み(cappi_wcache.py)でCAPPIを作成する(重みの作成時間はgrid_wcache_buildに記録)
+ extract_4bytes : グリッドデータを(変数,z,y,x)の4-byte配列に格納する
+ out_nc         : netCDFファイルを出力する(Make_CAPPI_NEXRAD.out_nc)
+ grads          : GrADSバイナリとctlファイルを出力する
+ draw           : Draw_NEXRAD_Level2.Draw_Level2で全スイープを描画する(1スイープあたりの時間はdraw_per_sweep)
+*CAPPIの設定(グリッド、内挿方法など)はMake_CAPPI_NEXRAD.pyの設定を使用し、ppi_useとgrid_shapeだけこのスクリプトで上書きする
+*Kdpと偏波パラメータを含めて計測するため、flag_v、flag_dupolはTrueにして計測する
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 高速版Kdp(nexrad_kdp.py)の計測と精度の確認(kdp_fast)を追加 2026.10.18
+"""
+
+import sys
+import os
+import json
+import time
+import datetime
+import platform
+import subprocess
+import bz2
+import struct
+import shutil
+from contextlib import contextmanager
+from os.path import basename, dirname, abspath
+from os import makedirs
+import numpy as np
+import pyart
+from pyart.io import nexrad_level2 as l2
+
+#Make_CAPPI_NEXRAD.py、Draw_NEXRAD_Level2.pyは入力ファイルをargv[1]から受け取るため、読み込み時だけ空にする
+argv_save = sys.argv
+sys.argv = sys.argv[:1]
+import Make_CAPPI_NEXRAD as MC
+import Draw_NEXRAD_Level2 as DR
+sys.argv = argv_save
+import cappi_wcache
+import nexrad_l2reader
+import nexrad_kdp
+
+#%%
+##パラメータ設定
+workdir = './bench_work'   #疑似ボリューム・出力ファイルの作業ディレクトリ
+outdir  = './bench_results' #結果(JSON)の出力ディレクトリ(bench_yyyymmddHHMMSS.jsonで保存)
+stages = ('read','read_selected','extract','kdp','kdp_fast','grid','grid_wcache','extract_4bytes','out_nc','grads','draw')
+nrepeat = 3                #各段階の計測回数(最初の1回も含めて記録する)
+nvol = 1                   #疑似ボリュームの数(各段階はボリュームごとに計測する)
+
+#疑似ボリュームの設定(VCP212に近い設定)
+site = 'KSYN'              #サイト名(Tで始まる名前はpyartが位置を置き換えるので使わない)
+lat, lon, alt = 35.0, -97.0, 370 #レーダーの位置(度, 度, m)
+elevs = (0.5, 0.5, 0.9, 0.9, 1.3, 1.3, 1.8, 2.4, 3.1, 4.0, 5.1, 6.4, 8.0, 10.0, 12.5, 15.6, 19.5) #各スイープの仰角(度)
+nray = 360                 #1スイープあたりのレイ数(方位角の分解能は360/nray度)
+ngate = 1832               #1レイあたりのゲート数
+gate_first, gate_spacing = 2125, 250 #最初のゲートまでの距離とゲート間隔(m)
+moments = ('REF','VEL','SW','ZDR','PHI','RHO') #作成するモーメント
+seed = 0                   #乱数のシード
+
+#CAPPIの設定(Make_CAPPI_NEXRAD.pyの設定を上書き)
+ppi_use = (0, 2, 4, 6, 7, 8, 9, 10, 11, 12, 13)
+grid_shape = (21,601,601)
+##パラメータ設定ここまで
+
+#計測値を記録する段階のうち、stagesの段階に付随するもの
+DERIVED = {'grid_wcache_build': 'grid_wcache', 'grid_wcache_load': 'grid_wcache', 'draw_per_sweep': 'draw'}
+
+#%%
+#Pack_Structure: pyart.io.nexrad_level2の構造定義に従ってバイト列を作る(指定しない項目は0)
+def Pack_Structure(structure, **values):
+    fmt = '>' + ''.join(s[1] for s in structure)
+    vals = []
+    for name, code in structure:
+        v = values.get(name)
+        if v is None: v = b'' if code.endswith('s') else 0
+        vals.append(v)
+    return struct.pack(fmt, *vals)
+
+#%%
+#Make_Moments: 降水セルを含む疑似的なモーメントデータ(生の値)を作成する
+def Make_Moments(rng, az, el, r):
+    ##Return: {モーメント名: (生の値の配列[nray,ngate], scale, offset, word_size)}
+    #降水セル(ガウス分布の反射強度)を方位角・距離方向にランダムに配置する
+    ref = np.full((len(az), len(r)), -10., dtype='float32')
+    for _ in range(12):
+        caz, cr = rng.uniform(0, 360), rng.uniform(10e3, 250e3)
+        saz, sr, peak = rng.uniform(3, 15), rng.uniform(5e3, 30e3), rng.uniform(30, 60)
+        daz = (az[:,None] - caz + 180.) % 360. - 180.
+        ref = np.maximum(ref, peak * np.exp(-0.5*((daz/saz)**2 + ((r[None,:]-cr)/sr)**2)) - 5.)
+    ref += rng.normal(0, 1.5, ref.shape)
+    ref[ref < -5.] = np.nan                                    #エコーなし
+    rain = np.isfinite(ref)
+
+    #一様な風によるドップラー速度、Kdpを距離方向に積算した偏波間位相差
+    vel = 15. * np.cos(np.deg2rad(az[:,None] - 240.)) * np.cos(np.deg2rad(el)) + rng.normal(0, 1., ref.shape)
+    kdp = np.where(rain, np.clip((np.nan_to_num(ref) - 30.) / 10., 0, None), 0.)
+    phi = 60. + 2. * np.cumsum(kdp, axis=1) * (r[1]-r[0]) / 1000. + rng.normal(0, 3., ref.shape)
+    zdr = np.clip(np.nan_to_num(ref) / 20., 0, 4) + rng.normal(0, 0.3, ref.shape)
+    rho = np.clip(0.99 - rng.exponential(0.01, ref.shape), 0.2, 1.05)
+    sw = np.abs(rng.normal(2., 1., ref.shape))
+
+    #NEXRADと同じscale/offsetで生の値にする(0:閾値未満)
+    values = {'REF': (ref, 2., 66., 8), 'VEL': (vel, 2., 129., 8), 'SW': (sw, 2., 129., 8),
+              'ZDR': (zdr, 16., 128., 8), 'PHI': (phi % 360., 2.8361, 2., 16), 'RHO': (rho, 300., -60.5, 8)}
+    out = {}
+    for m in moments:
+        v, scale, offset, ws = values[m]
+        vmax = 255 if ws == 8 else 1023
+        raw = np.clip(np.round(v * scale + offset), 2, vmax)
+        raw[~rain] = 0
+        out[m] = (raw.astype('>u1' if ws == 8 else '>u2'), scale, offset, ws)
+    return out
+
+#%%
+#Make_Volume: LDM形式(約120レイごとにbzip2圧縮)の疑似Level-IIファイルを作成する
+def Make_Volume(fname, date_dt, rng):
+    ctm = bytes(12)
+    days = (date_dt - datetime.datetime(1970,1,1)).days + 1
+    ms = int((date_dt - date_dt.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds() * 1000)
+    r = gate_first + gate_spacing * np.arange(ngate, dtype='float64')
+
+    #MSG5(VCP)
+    cuts = b''.join(Pack_Structure(l2.MSG_5_ELEV, elevation_angle=int(round(e / 360. * 65536))) for e in elevs)
+    body = Pack_Structure(l2.MSG_5, pattern_number=212, num_cuts=len(elevs)) + cuts
+    body = body.ljust(l2.RECORD_SIZE - 12 - 16, b'\0')
+    head = Pack_Structure(l2.MSG_HEADER, size=(16+len(body))//2, channels=8, type=5, date=days, ms=ms,
+                          segments=1, seg_num=1)
+    records = [ctm + head + body]
+
+    #MSG31(1レイ1メッセージ)
+    vol = Pack_Structure(l2.VOLUME_DATA_BLOCK, block_type=b'R', data_name=b'VOL', lrtup=44, version_major=1,
+                         lat=lat, lon=lon, height=alt, feedhorn_height=20, vcp=212)
+    elv = Pack_Structure(l2.ELEVATION_DATA_BLOCK, block_type=b'R', data_name=b'ELV', lrtup=12)
+    rad = Pack_Structure(l2.RADIAL_DATA_BLOCK, block_type=b'R', data_name=b'RAD', lrtup=20,
+                         unambig_range=4660, nyquist_vel=2800)
+    hsize = struct.calcsize('>' + ''.join(s[1] for s in l2.MSG_31))
+    msgs = []
+    for e, el in enumerate(elevs):
+        az = (np.arange(nray) + 0.5) * 360. / nray
+        data = Make_Moments(rng, az, el, r)
+        for i in range(nray):
+            blocks = [vol, elv, rad]
+            for m in moments:
+                raw, scale, offset, ws = data[m]
+                blocks.append(Pack_Structure(l2.GENERIC_DATA_BLOCK, block_type=b'D', data_name=m.ljust(3).encode(),
+                                             ngates=ngate, first_gate=gate_first, gate_spacing=gate_spacing,
+                                             word_size=ws, scale=scale, offset=offset) + raw[i].tobytes())
+            pointers, pos = [], hsize
+            for b in blocks:
+                pointers.append(pos)
+                pos += len(b)
+            pointers = dict((f'block_pointer_{k+1}', p) for k, p in enumerate(pointers))
+            msg_ms = ms + int((e * nray + i) * 20) #1レイ20msで走査したとする
+            status = 0 if i == 0 else (2 if i == nray-1 else 1)
+            if i == 0 and e == 0: status = 3
+            if i == nray-1 and e == len(elevs)-1: status = 4
+            body = Pack_Structure(l2.MSG_31, id=site.encode(), collect_ms=msg_ms, collect_date=days,
+                                  azimuth_number=i+1, azimuth_angle=az[i], radial_length=pos,
+                                  azimuth_resolution=2 if nray == 360 else 1, radial_spacing=status,
+                                  elevation_number=e+1, cut_sector=1, elevation_angle=el,
+                                  block_count=len(blocks), **pointers) + b''.join(blocks)
+            if len(body) % 2 == 1: body += b'\0'
+            head = Pack_Structure(l2.MSG_HEADER, size=(16+len(body))//2, channels=8, type=31, date=days,
+                                  ms=msg_ms, segments=1, seg_num=1)
+            msgs.append(ctm + head + body)
+    records += [b''.join(msgs[i:i+120]) for i in range(0, len(msgs), 120)]
+
+    out = bytearray(Pack_Structure(l2.VOLUME_HEADER, tape=b'AR2V0006.', extension=b'001', date=days, time=ms,
+                                   icao=site.encode()))
+    for k, rec in enumerate(records):
+        c = bz2.compress(rec)
+        out += struct.pack('>i', len(c) if k < len(records)-1 else -len(c)) + c
+    with open(fname, 'wb') as fp:
+        fp.write(out)
+
+#%%
+#Timer: with文で囲んだ処理の経過時間とCPU時間をresults[stage]に追加する
+@contextmanager
+def Timer(results, stage):
+    t0, c0 = time.perf_counter(), time.process_time()
+    yield
+    results.setdefault(stage, []).append({'wall': time.perf_counter() - t0, 'cpu': time.process_time() - c0})
+
+#%%
+#Summarize: 段階ごとの計測値を集計する(stagesで選択していない段階は除く)
+def Summarize(results):
+    summary = {}
+    for stage, runs in results.items():
+        if stage != 'make_volume' and DERIVED.get(stage, stage) not in stages: continue
+        wall = np.array([r['wall'] for r in runs])
+        cpu = np.array([r['cpu'] for r in runs])
+        summary[stage] = {'n': len(runs), 'wall_min': wall.min(), 'wall_median': float(np.median(wall)),
+                          'wall_mean': wall.mean(), 'wall_max': wall.max(), 'cpu_median': float(np.median(cpu)),
+                          'wall': wall.tolist()}
+    return summary
+
+#%%
+#Compare_Kdp: gatefilterを通るゲートでpyartのKdpと高速版のKdpを比べる
+def Compare_Kdp(kdp_ref, kdp_test, gatefilter):
+    use = ~gatefilter.gate_excluded
+    mref, mtest = np.ma.getmaskarray(kdp_ref)[use], np.ma.getmaskarray(kdp_test)[use]
+    diff = np.abs(np.ma.getdata(kdp_ref)[use] - np.ma.getdata(kdp_test)[use])[~mref & ~mtest]
+    return {'ngates': int((~mref).sum()), 'mask_mismatch': int((mref != mtest).sum()),
+            'max_abs_diff': float(diff.max()) if diff.size > 0 else 0.}
+
+#%%
+#Get_Environment: 比較のための実行環境の情報(git commitを含む)
+def Get_Environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=dirname(abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pyart': pyart.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'git_commit': commit}
+
+#%%
+def Run_Bench():
+    makedirs(workdir + '/vol', exist_ok=True)
+    makedirs(workdir + '/out', exist_ok=True)
+    makedirs(outdir, exist_ok=True)
+    shutil.rmtree(workdir + '/wcache', ignore_errors=True) #内挿重みの作成時間を毎回計測する
+    results = {}
+    validation = {}
+
+    #Make_CAPPI_NEXRAD.pyの設定の上書き
+    MC.ppi_use, MC.grid_shape = ppi_use, grid_shape
+    MC.flag_v, MC.flag_dupol = True, True
+    MC.outdir = workdir + '/out'
+    DR.figdir = workdir + '/fig'
+    makedirs(DR.figdir, exist_ok=True)
+    grid_limits = (MC.limit_z, MC.limit_y, MC.limit_x)
+    vnames, gnames = MC.get_varnames()
+
+    #疑似ボリュームの作成
+    rng = np.random.default_rng(seed)
+    files = []
+    for v in range(nvol):
+        date_dt = datetime.datetime(2026,1,1) + datetime.timedelta(minutes=5*v)
+        f = workdir + '/vol/' + date_dt.strftime(f'{site}%Y%m%d_%H%M%S_V06')
+        with Timer(results, 'make_volume'):
+            Make_Volume(f, date_dt, rng)
+        files.append(f)
+        print(f'Volume created: {f} ({os.path.getsize(f)/1e6:.1f} MB)')
+
+    rnames = ['reflectivity','velocity','differential_reflectivity','differential_phase','cross_correlation_ratio']
+    for f in files:
+        for n in range(nrepeat):
+            print(f'{basename(f)} ({n+1}/{nrepeat})')
+            if 'read' in stages or 'extract' in stages:
+                with Timer(results, 'read'):
+                    radar = pyart.io.read_nexrad_archive(f)
+                if 'extract' in stages:
+                    with Timer(results, 'extract'):
+                        radar_4ppi = radar.extract_sweeps(ppi_use)
+                del radar
+            with Timer(results, 'read_selected'):
+                radar_4ppi = nexrad_l2reader.Read_Level2(f, ppi_use, rnames)
+                for g in rnames: radar_4ppi.fields[g]['data'] #遅延読み込みの変数を展開する
+
+            gatefilter = pyart.filters.GateFilter(radar_4ppi)
+            gatefilter.exclude_below('reflectivity', 0)
+            kdp_fast = None
+            if 'kdp_fast' in stages:
+                with Timer(results, 'kdp_fast'):
+                    kdp_fast = nexrad_kdp.Kdp_Vulpiani(radar_4ppi, gatefilter, psidp_field='differential_phase',
+                                                       band='S', prefilter_psidp=True, nthreads=MC.kdp_nthreads)
+                kdp = kdp_fast
+            if 'kdp' in stages or kdp_fast is None:
+                #pyartのkdp_vulpianiは偏波間位相差を書き換えるので高速版の後に計算する
+                with Timer(results, 'kdp'):
+                    kdp, _ = pyart.retrieve.kdp_vulpiani(radar=radar_4ppi, psidp_field='differential_phase',
+                                                         band='S', prefilter_psidp=True)
+                if kdp_fast is not None:
+                    validation.setdefault('kdp_fast', []).append(Compare_Kdp(kdp['data'], kdp_fast['data'], gatefilter))
+            radar_4ppi.add_field('specific_differential_phase', kdp, replace_existing=True)
+
+            df = np.empty((len(gnames),)+tuple(grid_shape), dtype='float32')
+            latlon = None
+            if 'grid' in stages or 'extract_4bytes' in stages:
+                with Timer(results, 'grid'):
+                    grid = pyart.map.grid_from_radars(radar_4ppi, grid_shape=grid_shape, grid_limits=grid_limits,
+                                                      weighting_function=MC.interp_method, roi_func='constant',
+                                                      constant_roi=MC.roi_const, gatefilters=gatefilter, fields=gnames)
+                with Timer(results, 'extract_4bytes'):
+                    MC.extract_4bytes(grid.fields, gnames, df, -9999.)
+                latlon = grid.get_point_longitude_latitude()
+                del grid
+            if 'grid_wcache' in stages and MC.interp_method != 'Nearest':
+                with Timer(results, 'grid_wcache_build' if n == 0 and f == files[0] else 'grid_wcache_load'):
+                    W, order = cappi_wcache.Get_Weights(radar_4ppi, grid_shape, grid_limits, MC.roi_const,
+                                                        workdir + '/wcache', MC.interp_method)
+                with Timer(results, 'grid_wcache'):
+                    cappi_wcache.Grid_Fields(radar_4ppi, W, order, gnames, df, gatefilter, -9999.)
+                del W
+                if latlon is None: latlon = cappi_wcache.Get_LonLat(radar_4ppi, grid_shape, grid_limits)
+            if latlon is None: latlon = cappi_wcache.Get_LonLat(radar_4ppi, grid_shape, grid_limits)
+
+            meta = [[radar_4ppi.fields[g]['long_name'], radar_4ppi.fields[g]['units']] for g in gnames]
+            date_dt = MC.define_time_fromNEXRAD(f)
+            if 'out_nc' in stages:
+                with Timer(results, 'out_nc'):
+                    MC.out_nc(workdir + '/out/' + basename(f) + '_3D.nc', -9999.,
+                              grid_shape[2], MC.limit_x[0], (MC.limit_x[1]-MC.limit_x[0])/(grid_shape[2]-1), latlon[0],
+                              grid_shape[1], MC.limit_y[0], (MC.limit_y[1]-MC.limit_y[0])/(grid_shape[1]-1), latlon[1],
+                              grid_shape[0], MC.limit_z[0], (MC.limit_z[1]-MC.limit_z[0])/(grid_shape[0]-1),
+                              date_dt.strftime('%Y-%m-%d %H:%M:%S+00:00'), df, vnames, meta, basename(f),
+                              ppi_use, MC.interp_method, MC.roi_const)
+            if 'grads' in stages:
+                with Timer(results, 'grads'):
+                    slon, dlon, slat, dlat = MC.calc_lonlat_info(latlon)
+                    MC.Make_GradsCtl(workdir + '/out/' + basename(f) + '_3D_latlon.ctl', basename(f) + '_3D.bin', -9999.,
+                                     grid_shape[2], slon, dlon, grid_shape[1], slat, dlat, grid_shape[0], MC.limit_z[0],
+                                     (MC.limit_z[1]-MC.limit_z[0])/(grid_shape[0]-1)/1000.,
+                                     date_dt.strftime('%H:%MZ%d%b%Y'), vnames)
+                    df.tofile(workdir + '/out/' + basename(f) + '_3D.bin', format='<f4')
+            del radar_4ppi, df
+
+            if 'draw' in stages:
+                with Timer(results, 'draw'):
+                    fignames = DR.Draw_Level2(f)
+                results.setdefault('draw_per_sweep', []).append(
+                    {k: v / len(fignames) for k, v in results['draw'][-1].items()})
+
+    summary = Summarize(results)
+    out = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'environment': Get_Environment(),
+           'config': {'nvol': nvol, 'nrepeat': nrepeat, 'elevs': elevs, 'nray': nray, 'ngate': ngate,
+                      'gate_spacing': gate_spacing, 'moments': moments, 'ppi_use': ppi_use, 'grid_shape': grid_shape,
+                      'limits': grid_limits, 'interp_method': MC.interp_method, 'roi_const': MC.roi_const,
+                      'volume_bytes': [os.path.getsize(f) for f in files]},
+           'stages': summary, 'validation': validation}
+    outname = outdir + '/bench_' + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + '.json'
+    with open(outname, 'w') as fp:
+        json.dump(out, fp, indent=1)
+
+    print(f'{"stage":<20}{"median [s]":>12}{"min [s]":>10}{"n":>4}')
+    for stage, s in summary.items():
+        print(f'{stage:<20}{s["wall_median"]:>12.3f}{s["wall_min"]:>10.3f}{s["n"]:>4}')
+    for stage, v in validation.items():
+        print(f'{stage}: max_abs_diff={max(x["max_abs_diff"] for x in v)}, '
+              f'mask_mismatch={max(x["mask_mismatch"] for x in v)}')
+    print('Results saved to ' + outname)
+    return outname
+
+#%%
+if __name__ == '__main__':
+    Run_Bench()
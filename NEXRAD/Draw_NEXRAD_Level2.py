@@ -9,22 +9,50 @@ ver 1.0 First created 2022.12.15 A.NISHII
 ver 2.0 Implimented filelist mode 2023.05.14 A.NISHII
 ver 2.1 Bug fixed 2023.05.23 A.NISHII
 ver 2.2 Implimented drawing height circles 2023.05.23 A.NISHII
+ver 2.3 反射強度とドップラー速度だけを読み出すよう変更(nexrad_l2reader.py) 2026.10.18
+ver 2.4 ディレクトリを監視して新しいファイルだけを描画する監視モード(watch, nexrad_watch.py)を追加 2026.10.18
+ver 2.5 Bench_NEXRAD.pyから描画関数(Draw_Level2)を呼べるよう、実行部分をif __name__ == '__main__':の中に移動 2026.10.18
+ver 2.6 処理段階ごとの時間・メモリ・読み書き量の記録(perf_log, ../common/perflog.py)を追加 2026.10.18
+ver 2.7 図を使い回してメッシュと円だけを更新する描画モード(fig_template)を追加、保存後の再描画(plt.savefig)をやめた 2026.10.18
+ver 2.8 スイープを複数のプロセスで並列に描画するモード(nproc, max_inflight)を追加、
+        描画に失敗したファイルがあっても残りのファイルを描画するよう変更 2026.10.18
+ver 2.9 ゲートの座標とビーム高度の円の距離をキャッシュし(nexrad_geom.py)、
+        円の距離をビーム高度の式から直接求めるよう変更(find_dis_ataltを削除) 2026.10.18
+ver 2.10 matplotlibを使わずにPNGの簡易画像を作成するquicklookモード(quicklook, ql_npix, nexrad_quicklook.py)を追加 2026.10.18
+ver 2.11 反射強度をWebメルカトルのタイルにしてMBTilesファイルに保存する機能(tile_db, tile_sweep, tile_zooms,
+         ../common/mbtiles.py)を追加 2026.10.18
 """
 
 import pyart
 from matplotlib import colors
 import matplotlib.pyplot as plt
-from os.path import basename
+from os.path import basename, dirname, abspath, join
 from os import makedirs
 import numpy as np
-from sys import argv
+import sys
+from sys import argv, exit
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import nexrad_l2reader
+import nexrad_watch
+import nexrad_geom
+import nexrad_quicklook
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+import mbtiles
 
 #%%
 ##パラメータ設定
 #fname = './PGUA/PGUA20230522_150343_V06' #NEXRAD Level-IIデータorLevel-IIデータのファイルリストを指定
-fname = argv[1]
+fname = argv[1] if len(argv) > 1 else ''
 flist = True #Ture:fnameはファイルリスト、False:fnameはNEXRAD LEVEL2ファイル
+watch = False #True:fnameのディレクトリを監視し、新しく届いたファイルを順次描画する(flistは無視。Ctrl-Cで終了)
+watch_pattern = '*_V06' #watch=Trueのとき描画するファイル名のパターン
+watch_interval = 30. #watch=Trueのときディレクトリを確認する間隔(秒)
+watch_manifest = 'processed_draw.txt' #watch=Trueのとき描画済みファイルを記録するファイル(figdir内。再起動時は続きから描画する)
 figdir = '../fig/pgua_zv' #画像を出力するディレクトリ
+nproc = 1 #並列に描画するプロセス数(1:逐次処理)。各ファイルは1度だけ読み出し、スイープごとに並列に描画する
+max_inflight = 8 #nproc>1のとき描画待ちにするスイープ数の上限(メモリ使用量の目安: 1スイープ数十MB)
 xmin = -400 #描画範囲の西端 (レーダーを中心とした座標で東が正。kmで指定)
 xmax = 400  #東端 (km)
 ymin = -400 #南端 (レーダーを中心とした座標で北が正。kmで指定)
@@ -35,18 +63,19 @@ circle_range = np.array([2,4.5,8]) #dis:レーダーから半径circle_range km
 circle_label = True  #True:円にレーダーからの距離orビーム高度を表示する
 labelpad = 15 #labelと円の距離 [km](半径400 km表示なら15,200 km表示なら5を推奨)
 hair_length = 15 #レーダー中心を示す十字の長さ(km)('non'のときは描かない)
+fig_template = True #True:図・カラーバー・十字を1度だけ作成し、スイープごとにメッシュと円だけを更新する(高速)
+                    #False:スイープごとに図を作成する
+geom_tol_az = 0.1 #fig_template=Trueのとき、方位角・仰角の差がgeom_tol_az, geom_tol_el [deg.]以内のスイープは
+geom_tol_el = 0.1 #ゲートの座標を使い回す(nexrad_geom.py)
+quicklook = False #True:matplotlibを使わず、画素ごとのゲート番号の表(LUT)と色番号でPNGの簡易画像を作成する(高速。nexrad_quicklook.py)
+ql_npix = 800 #quicklook=Trueのときの1パネルの大きさ(画素)。描画範囲(xmin〜xmax, ymin〜ymax)を正方形の画素に分ける
+tile_db = None #反射強度のWebメルカトルのタイル(XYZ, 256x256画素のPNG)を保存するMBTilesファイル(Noneなら作成しない)
+               #前の時刻から変わったタイルだけ画像を作成する(../common/mbtiles.py)
+tile_sweep = 0 #タイルを作成するスイープ番号(0:最下層)
+tile_zooms = (5,6,7,8,9) #タイルを作成するズームレベル
+perf_log = None #処理段階(read,render,write)ごとの時間・メモリ・読み書き量を記録するファイル(JSON lines。Noneなら記録しない)
 ##パラメータ設定ここまで
-
-#%%
-#入力ファイル情報の取得
-print(f'Inputfile: {fname}')
-makedirs(figdir,exist_ok=True)
-if flist:
-    with open(fname,'r') as f:
-        files = f.readlines()
-        files = [s.replace('\n','') for s in files]
-else:
-    files = [fname,]
+perflog.Setup(perf_log, 'Draw_NEXRAD_Level2')
 
 #%%
 #反射強度用カラーマップの作成
@@ -55,84 +84,246 @@ cmap_z = plt.get_cmap('pyart_NWSRef').copy()
 cmap_z.set_under('white')
 norm_z = colors.BoundaryNorm(clevs_z,cmap_z.N,extend='both')
 
+template = {} #fig_template=Trueのときに使い回す図(Update_Templateで作成)
+tile_conn = {} #tile_dbの接続(Write_PPI_Tilesで作成)
+
+#quicklook用の色(反射強度はcmap_zの区間、ドップラー速度はpyartの既定のカラーマップを64段階に分ける)
+ql_panels = [('reflectivity',) + nexrad_quicklook.Make_Colors(cmap_z, norm_z) + ('ZH [dBZ]',),
+             ('velocity',) + nexrad_quicklook.Make_Colors(plt.get_cmap(pyart.config.get_field_colormap('velocity')),
+                                                          vmin=-24.78, vmax=24.78) + ('V [m/s]',)]
+
 #%%
-#ビーム高度がh_tofid kmになる、レーダーからの距離を計算
-def find_dis_atalt(h_tofid,anthgt,el,farthest,prec=0.1):
-    ##dis: distance from the radar [km] (numpy 1d-array)
-    ##anthgt: Anntena height [km] (velue)
-    ##el: elevation angle [deg.] (value)
-    ##prec: precision of height [km] (value)
-    ##farthest: distance from a radar to the farthest gate [km]
-    ##Return: Beam altitude [km] (numpy 1d-array)
-    er_km = 8493.3121 ##Equivalent Earth radious [km] (~4/3 of the Earth radious)
-    elrad = np.deg2rad(el)
-    sinel = np.sin(elrad)
-    cosel = np.cos(elrad)
-
-    #Compute central beam altitude every prec km.
-    dis = np.arange(0,farthest,prec,dtype='float')
-    c = dis * cosel / (er_km+dis*sinel)
-    c = elrad + np.arctan(c)
-    height = dis * np.sin(c) - np.power(dis*np.cos(c),2.0) / (2 * er_km) + anthgt
-
-    #Find distance which have the nearest altitude.
-    dis_atalt = []
-    ap = dis_atalt.append
-    for h in h_tofid:
-        diff = np.abs(height-h)
-        ap(dis[np.argmin(diff)])
-
-    return dis_atalt
+#円(距離orビーム高度)とラベルを描き、描いたartistのリストを返す
+def Draw_Rings(display, axes, draw_crange):
+    artists = []
+    for a in axes:
+        nline = len(a.lines)
+        for r in draw_crange:
+            display.plot_range_ring(r,ax=a, ls='-', col='k', lw=1)
+        artists.extend(a.lines[nline:])
+
+        if circle_label:
+            for r in range(len(draw_crange)):
+                artists.append(a.text(0,draw_crange[r]+hair_length,f'{circle_range[r]:.1f} km',
+                                      horizontalalignment='center',transform=a.transData,
+                                      clip_on=True))
+    return artists
+
 #%%
-#描画
-for f in files:
-    radar = pyart.io.read_nexrad_archive(f)
-    display = pyart.graph.RadarDisplay(radar)
-    print(f,' is opened')
+#Make_Figure: 2パネルの図(反射強度、ドップラー速度)を作成し、スイープeを描画する
+def Make_Figure(display, e):
+    fig = plt.figure(figsize=(13,5.5))
+    ax = fig.add_subplot(121)
+    ax.set_aspect(1)
+    display.plot('reflectivity',e, cmap=cmap_z, norm=norm_z, colorbar_label='ZH [dBZ]',ax=ax)
+    display.set_limits((xmin, xmax), (ymin, ymax), ax=ax)
+    if c_dis_or_alt != 'non': display.plot_cross_hair(hair_length,ax=ax)
 
-    antenna_h = radar.altitude['data'][0] / 1000.
+    ax2 = fig.add_subplot(122)
+    ax2.set_aspect(1)
+    display.plot('velocity',e,vmin=-24.78,vmax=24.78,colorbar_label='V [m/s]',ax=ax2)
+    display.set_limits((xmin, xmax), (ymin, ymax),ax=ax2)
+    if c_dis_or_alt != 'non': display.plot_cross_hair(hair_length,ax=ax2)
+    return fig, (ax, ax2), display.plots[-2:]
 
-    for e in range(len(radar.sweep_number['data'])):
-        fig = plt.figure(figsize=(13,5.5))
-        ax = fig.add_subplot(121)
-        ax.set_aspect(1)
-        display.plot('reflectivity',e, cmap=cmap_z, norm=norm_z, colorbar_label='ZH [dBZ]',ax=ax)
-        display.set_limits((xmin, xmax), (ymin, ymax), ax=ax)
-        if c_dis_or_alt != 'non': display.plot_cross_hair(hair_length,ax=ax)
+#%%
+#Update_Template: 作成済みの図(テンプレート)のメッシュ、タイトル、円だけを更新してスイープeを描画する
+#(図、カラーバー、十字は最初の1回だけ作成する。レイとゲートの位置が前回と同じならメッシュの値だけを入れ替える)
+def Update_Template(display, radar, e, draw_crange, geom):
+    ##geom: スイープの座標(nexrad_geom.Get_Sweep_Geometry。レイは方位角順)
+    if len(template) == 0:
+        fig, axes, meshes = Make_Figure(display, e)
+        template.update(fig=fig, axes=axes, meshes=list(meshes), geom=None, crange=None, rings=[])
+    else:
+        for i, (a, field) in enumerate(zip(template['axes'], ('reflectivity','velocity'))):
+            pm = template['meshes'][i]
+            data = radar.get_field(e, field)[geom['order']]
+            if geom is template['geom']:
+                pm.set_array(data)
+            else:
+                #ゲートの位置が変わったらメッシュを作り直す(軸の範囲は固定されているので変わらない)
+                pm.remove()
+                template['meshes'][i] = a.pcolormesh(geom['x'] + display.shift[0] / 1000., geom['y'] + display.shift[1] / 1000.,
+                                                     data, cmap=pm.cmap, norm=pm.norm)
+            a.set_title(display.generate_title(field, e))
+        template['geom'] = geom
+
+    #円は半径が変わったときだけ描き直す
+    if draw_crange is not None and (template['crange'] is None or not np.array_equal(template['crange'], draw_crange)):
+        for artist in template['rings']: artist.remove()
+        template['rings'] = Draw_Rings(display, template['axes'], draw_crange)
+        template['crange'] = np.array(draw_crange)
+    return template['fig']
+#%%
+#Read_Volume: 描画する変数(反射強度、ドップラー速度)だけを読み出す
+def Read_Volume(f):
+    with perflog.Stage('read', f):
+        radar = nexrad_l2reader.Read_Level2(f, fields=['reflectivity','velocity'])
+        for g in ('reflectivity','velocity'): radar.fields[g]['data'] #遅延読み込みの変数を展開する
+    print(f,' is opened')
+    return radar
 
-        ax2 = fig.add_subplot(122)
-        ax2.set_aspect(1)
-        display.plot('velocity',e,vmin=-24.78,vmax=24.78,colorbar_label='V [m/s]',ax=ax2)
-        display.set_limits((xmin, xmax), (ymin, ymax),ax=ax2)
-        if c_dis_or_alt != 'non': display.plot_cross_hair(hair_length,ax=ax2)
+#%%
+#Draw_Sweep: radarのスイープeを描画して保存し、画像ファイル名を返す
+#(並列処理では1スイープだけを取り出したRadarを渡すので、e=0、scnumに元のスイープ番号を指定する)
+def Draw_Sweep(radar, f, e, scnum=None):
+    if scnum is None: scnum = e
+    display = pyart.graph.RadarDisplay(radar)
 
-        #円を描く
+    with perflog.Stage('render', f, sweep=scnum):
+        #円を描く距離
         el = radar.fixed_angle['data'][e].round(1)
+        geom = nexrad_geom.Get_Sweep_Geometry(radar, e, geom_tol_az, geom_tol_el)
         if c_dis_or_alt == 'dis':
             draw_crange = circle_range
         elif c_dis_or_alt == 'alt':
-            draw_crange = find_dis_atalt(circle_range,antenna_h,el,
-                                         radar.range['data'][-1]/1000.)
-        
-        if c_dis_or_alt == 'dis' or c_dis_or_alt == 'alt':
-            for r in draw_crange:
-                display.plot_range_ring(r,ax=ax, ls='-', col='k', lw=1)
-                display.plot_range_ring(r,ax=ax2, ls='-', col='k', lw=1)
-            
-            if circle_label:
-                for r in range(len(draw_crange)):
-                    ax.text(0,draw_crange[r]+hair_length,f'{circle_range[r]:.1f} km',
-                            horizontalalignment='center',transform=ax.transData,
-                            clip_on=True)
-                    ax2.text(0,draw_crange[r]+hair_length,f'{circle_range[r]:.1f} km',
-                            horizontalalignment='center',transform=ax2.transData,
-                            clip_on=True)
-            
+            draw_crange = nexrad_geom.Get_Rings(radar, e, circle_range, geom)
+        else:
+            draw_crange = None
+
+        if quicklook:
+            img = nexrad_quicklook.Draw_Quicklook(radar, e, ql_panels, (xmin, xmax), (ymin, ymax), ql_npix, geom,
+                                                  draw_crange, [f'{r:.1f} km' for r in circle_range] if circle_label else None,
+                                                  None if c_dis_or_alt == 'non' else hair_length)
+        elif fig_template:
+            fig = Update_Template(display, radar, e, draw_crange, geom)
+        else:
+            fig, axes, _ = Make_Figure(display, e)
+            if draw_crange is not None: Draw_Rings(display, axes, draw_crange)
+
         angle = int(el * 10.)
-        figname = figdir + '/' + basename(f) + f'_ZV_scnum{e:02d}_el{angle:04d}.jpg'
-        plt.savefig(figname,bbox_inches='tight',dpi=200)
-        print(f'Fig saved to {figname}')
-        plt.close()
-        #break
+        figname = figdir + '/' + basename(f) + f'_ZV_scnum{scnum:02d}_el{angle:04d}' + ('.png' if quicklook else '.jpg')
+    with perflog.Stage('write', f, sweep=scnum):
+        if quicklook:
+            img.save(figname, compress_level=1)
+        else:
+            fig.savefig(figname,bbox_inches='tight',dpi=200)
+    print(f'Fig saved to {figname}')
+    if not fig_template and not quicklook: plt.close(fig)
+    return figname
+
+#%%
+#Write_PPI_Tiles: スイープtile_sweepの反射強度をWebメルカトルのタイルにしてtile_dbに保存する
+#(0 dBZ未満と欠損値は透明。色はquicklookと同じcmap_zの区間)
+def Write_PPI_Tiles(radar, f):
+    if tile_db is None or tile_sweep >= radar.nsweeps:
+        return
+    with perflog.Stage('tiles', f, sweep=tile_sweep):
+        lon0 = float(radar.longitude['data'][0])
+        lat0 = float(radar.latitude['data'][0])
+        dlat = radar.range['data'][-1] / 1000. / 111.19
+        dlon = dlat / np.cos(np.deg2rad(lat0))
+        bounds = [lon0 - dlon, lat0 - dlat, lon0 + dlon, lat0 + dlat]
+        if 'conn' not in tile_conn:
+            tile_conn['conn'] = mbtiles.Open_MBTiles(tile_db, 'NEXRAD reflectivity', bounds, tile_zooms)
+
+        #タイルの画素→ゲートの対応表はスイープの座標と一緒に保存して使い回す
+        geom = nexrad_geom.Get_Sweep_Geometry(radar, tile_sweep, geom_tol_az, geom_tol_el)
+        rng = radar.range['data']
+        def lut_func(lon, lat):
+            x, y = mbtiles.Lonlat_To_Aeqd(lon, lat, lon0, lat0)
+            return nexrad_quicklook.Gate_Index(geom, rng, x / 1000., y / 1000.)
+
+        _, bounds_z, rgb, _ = ql_panels[0]
+        data = np.ma.filled(np.ma.asarray(radar.get_field(tile_sweep, 'reflectivity'), dtype=np.float64), np.nan)
+        cnum = np.digitize(data, bounds_z).astype(np.uint8)
+        cnum[np.isnan(data)] = 0
+        palette = [0, 0, 0] + rgb[1:].ravel().tolist()
+        tstr = pyart.util.datetime_from_radar(radar).strftime('%Y-%m-%dT%H:%M:%SZ')
+        nnew, nsame = mbtiles.Write_Tiles(tile_conn['conn'], tstr, cnum, palette, lut_func,
+                                          geom.setdefault('tiles', {}), tile_zooms, bounds)
+    print(f'Tiles saved to {tile_db} ({tstr}, new: {nnew}, unchanged: {nsame})')
+
+#%%
+#描画(保存した画像ファイル名のリストを返す)
+def Draw_Level2(f):
+    radar = Read_Volume(f)
+    fignames = [Draw_Sweep(radar, f, e) for e in range(len(radar.sweep_number['data']))]
+    Write_PPI_Tiles(radar, f)
+    return fignames
+
+#%%
+#Init_Worker: 並列処理のワーカーは画面を使わないAggで描画する
+def Init_Worker():
+    plt.switch_backend('Agg')
+
+#Draw_Parallel: 各ファイルを1度だけ読み出し、スイープごとにnproc個のプロセスで並列に描画する
+#描画待ちのスイープ数をmax_inflight以下に抑え、空きができるまで次のファイルを読み出さない
+def Draw_Parallel(files, nproc, max_inflight):
+    results = {f: [] for f in files}
+    inflight = {} #描画中のスイープ(future: ファイルパス)
+
+    def collect(nmax):
+        #描画中のスイープがnmax個以下になるまで待つ
+        while len(inflight) > nmax:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                f = inflight.pop(fut)
+                try:
+                    figname = fut.result()
+                except Exception:
+                    print(f'Failed: {f}\n{traceback.format_exc()}')
+                    results[f] = None
+                    continue
+                if results[f] is not None: results[f].append(figname)
+
+    with ProcessPoolExecutor(max_workers=nproc, initializer=Init_Worker) as executor:
+        for f in files:
+            try:
+                radar = Read_Volume(f)
+            except Exception:
+                print(f'Failed: {f}\n{traceback.format_exc()}')
+                results[f] = None
+                continue
+            for e in range(len(radar.sweep_number['data'])):
+                collect(max_inflight - 1)
+                inflight[executor.submit(Draw_Sweep, radar.extract_sweeps([e]), f, 0, e)] = f
+            try:
+                Write_PPI_Tiles(radar, f) #タイルは(SQLiteに書き込むため)メインプロセスで作成する
+            except Exception:
+                print(f'Failed: {f}\n{traceback.format_exc()}')
+                results[f] = None
+            del radar
+        collect(0)
+    return {f: None if r is None else sorted(r) for f, r in results.items()}
+
+#%%
+#Draw_Files: ファイルリストを描画し、{ファイルパス: 画像ファイル名のリスト(失敗はNone)}を返す(失敗しても処理は止めない)
+def Draw_Files(files):
+    if nproc > 1:
+        return Draw_Parallel(files, nproc, max_inflight)
+    results = {}
+    for f in files:
+        try:
+            results[f] = Draw_Level2(f)
+        except Exception:
+            print(f'Failed: {f}\n{traceback.format_exc()}')
+            plt.close('all')
+            template.clear()
+            results[f] = None
+    return results
+
+#%%
+if __name__ == '__main__':
+    #入力ファイル情報の取得
+    print(f'Inputfile: {fname}')
+    makedirs(figdir,exist_ok=True)
+
+    if watch:
+        #ディレクトリ監視モード(描画に影響する設定を変えた場合は全ファイルを描画し直す)
+        phash = nexrad_watch.Params_Hash((xmin, xmax, ymin, ymax, c_dis_or_alt, list(circle_range), circle_label,
+                                          labelpad, hair_length, quicklook, ql_npix))
+        nexrad_watch.Watch_Dir(fname, watch_pattern, Draw_Files, figdir + '/' + watch_manifest, phash, watch_interval)
+    else:
+        if flist:
+            with open(fname,'r') as f:
+                files = f.readlines()
+                files = [s.replace('\n','') for s in files]
+        else:
+            files = [fname,]
+        results = Draw_Files(files)
+        failed = [f for f in files if results[f] is None]
+        print(f'Finish: {len(files)-len(failed)}/{len(files)}')
+        if len(failed) > 0: exit(1)
 
-# %%
+# %%
\ No newline at end of file
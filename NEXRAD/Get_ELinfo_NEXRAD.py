@@ -9,31 +9,43 @@ python3 Get_ELinfo_NEXRAD.py path/to/level-ii
 
 HISTORY(yyyy.mm.dd)
 ver 1.0 First created 2023.05.16 A.NISHII
+ver 1.1 変数(モーメント)を読み出さないよう変更(nexrad_l2reader.py) 2026.10.18
+ver 1.2 読み出しの時間・メモリ・読み込み量の記録(perf_log, ../common/perflog.py)を追加 2026.10.18
+ver 1.3 ヘッダ情報だけを読み出すよう変更(nexrad_l2reader.Read_Header)。多数のファイルの情報はMake_Catalog_NEXRAD.pyを使う 2026.10.18
 """
 
-import pyart
+import nexrad_l2reader
+import sys
 from sys import argv
 from os import makedirs
-from os.path import basename
+from os.path import basename, dirname, abspath, join
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
 
 #%%
 ##Parameters
 
 #fname = './RODN/maysak/RODN20200831_180549_V06'
 fname = argv[1]
-radar = pyart.io.read_nexrad_archive(fname)
 savetxt = True #True:Save elevation info to txt file
 txtdir = './elinfo'
+perf_log = None #Log file of elapsed time, memory and bytes read (JSON lines, None: no log)
 
 ##End of params
+perflog.Setup(perf_log, 'Get_ELinfo_NEXRAD')
+
+#%%
+with perflog.Stage('read', fname):
+    info = nexrad_l2reader.Read_Header(fname) #仰角情報だけを使うのでレイのデータは展開しない
 
 #%%
 #Read Elevation info from data
 print(f'Input file: {fname}')
-els = radar.fixed_angle['data']
+els = [s['fixed_angle'] for s in info['sweeps']]
+scnums = [s['scnum'] for s in info['sweeps']]
 print('scnum el[deg.]')
 for e in range(len(els)):
-    print(f'{e:02d} {els[e]:4.01f}')
+    print(f'{scnums[e]:02d} {els[e]:4.01f}')
 
 # %%
 #Save Elevations to a txt file if savetxt is true.
@@ -43,5 +55,5 @@ if savetxt:
     with open(txtname,'w') as fp:
         fp.write('scnum el[deg.]\n')
         for e in range(len(els)):
-            fp.write(f'{e:02d} {els[e]:4.01f}\n')
+            fp.write(f'{scnums[e]:02d} {els[e]:4.01f}\n')
     print('Elevation info saved to '+txtname)
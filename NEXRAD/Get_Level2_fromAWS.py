@@ -1,49 +1,183 @@
 #%%
 """
 Get_Level2_fromAWS.py coded by A.NISHII 2023.05.14
-Get NEXRAD Level-II data from AWS by using nexradaws
-Data is downloaded in the current directory.
+Get NEXRAD Level-II data from AWS
+Data is saved in outdir/SITE/yyyymmdd/ (see dir_format).
+Files already downloaded (same size and ETag) are skipped, and interrupted downloads (*.part) are resumed.
 
 Useage 1:
 python3 Get_Level2_fromAWS.py
-*site, sdate, and edate variables in this script must be specified.
+*sites, sdate, and edate variables in this script must be specified.
 
 Useage 2:
 python3 Get_Level2_fromAWS.py yyyymmddHHMM yyyymmddHHMM
                              (start DL time) (end DL time) *UTC
-*site variable must be specified.
-                             
+*sites variable must be specified.
+
 Useage 3:
 python3 Get_Level2_fromAWS.py yyyymmddHHMM yyyymmddHHMM SITE
+*Several sites can be given as a comma-separated list (e.g. KTLX,KINX)
+
+HISTORY(yyyy.mm.dd)
+ver 1.1 Add perf_log (elapsed time, memory and bytes of the download, ../common/perflog.py) 2026.10.18
+ver 1.2 Download files concurrently with boto3 (nthreads) instead of nexradaws, skip downloaded files (size/ETag),
+        resume interrupted downloads, download several sites at once, save files by site/date (dir_format),
+        and add s3_endpoint to use a local S3-compatible server 2026.10.18
+ver 1.3 Move the main part into if __name__ == '__main__': so that Make_CAPPI_NEXRAD.py can use
+        List_Scans, Make_Client and Fetch_Bytes (download to memory) 2026.10.18
 """
 
+import sys
 from sys import argv,exit
-import nexradaws
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
+from os.path import dirname, abspath, join, basename, exists, getsize
+from os import makedirs
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import boto3
+from botocore import UNSIGNED
+from botocore.config import Config
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
 
 #%%
-site="RODN" #RODN: Kadena air base in Japan
+sites = ["RODN"] #RODN: Kadena air base in Japan
 sdate = datetime(2022,8,31,00,00) #(year,month,day,hour,minute) in UTC
 edate = datetime(2022,8,31,00,10)
+outdir = '.' #Output directory
+dir_format = '{site}/{date}' #Sub directory in outdir ({site}: site name, {date}: yyyymmdd, '': save in outdir)
+nthreads = 6 #Number of concurrent downloads
+bucket = 'unidata-nexrad-level2' #S3 bucket of NEXRAD Level-II data
+s3_endpoint = None #S3 endpoint URL (None: AWS, e.g. 'http://localhost:5000' for a local S3-compatible server)
+s3_anonymous = True #True: access without credentials (public bucket), False: use the AWS credentials (e.g. ~/.aws)
+manifest = 'downloaded_aws.txt' #Record of downloaded files (size and ETag) in outdir
+perf_log = None #Log file of elapsed time, memory and bytes (JSON lines, None: no log)
+
+#%%
+#Make_Client: S3 client (anonymous: access without credentials)
+def Make_Client(endpoint=None, anonymous=True, nthreads=6):
+    config = Config(max_pool_connections=max(10, nthreads), retries={'max_attempts': 5, 'mode': 'standard'})
+    if anonymous: config = config.merge(Config(signature_version=UNSIGNED))
+    return boto3.client('s3', endpoint_url=endpoint, config=config)
+
+#List_Scans: List Level-II files of the site from sdate to edate ([(key, size, ETag, time)])
+def List_Scans(s3, site, sdate, edate):
+    scans = []
+    day = datetime(sdate.year, sdate.month, sdate.day)
+    while day <= edate:
+        prefix = day.strftime('%Y/%m/%d/') + site + '/'
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                name = basename(obj['Key'])
+                if name.endswith('_MDM'): continue #Metadata files
+                try:
+                    t = datetime.strptime(name[4:19], '%Y%m%d_%H%M%S')
+                except ValueError:
+                    continue
+                if sdate <= t <= edate:
+                    scans.append((obj['Key'], obj['Size'], obj['ETag'], t))
+        day += timedelta(days=1)
+    return scans
+
+#Local_Path: Path of the downloaded file
+def Local_Path(key, t):
+    site = basename(key)[0:4]
+    return join(outdir, dir_format.format(site=site, date=t.strftime('%Y%m%d')), basename(key))
 
 #%%
-#Check site and date settings
-if len(argv) == 3 or len(argv) ==4:
-    sdstr = argv[1]
-    sdate = datetime(int(sdstr[0:4]),int(sdstr[4:6]),int(sdstr[6:8]),int(sdstr[8:10]),int(sdstr[10:12]))
-    edstr = argv[2]
-    edate = datetime(int(edstr[0:4]),int(edstr[4:6]),int(edstr[6:8]),int(edstr[8:10]),int(edstr[10:12]))
-elif len(argv) != 1:
-    print('Invalid number of argments!')
-    exit(-1)
-
-if len(argv) == 4: site = argv[3]
+#Load_Manifest / Add_Manifest: Record of downloaded files (path, size, ETag. The last line is valid)
+lock = threading.Lock()
+
+def Load_Manifest(fname):
+    etags = {}
+    if exists(fname):
+        with open(fname, 'r') as fp:
+            for line in fp:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) == 3: etags[cols[0]] = (int(cols[1]), cols[2])
+    return etags
+
+def Add_Manifest(fname, etags, path, size, etag):
+    with lock:
+        etags[path] = (size, etag)
+        with open(fname, 'a') as fp:
+            fp.write(f'{path}\t{size}\t{etag}\n')
 
 #%%
-#Download data from AWS
-print('Data from {0} to {1}Z will be donwloaded'.format(
-      sdate.strftime('%y-%m-%d %H:%M'),edate.strftime('%y-%m-%d %H:%M')))
-conn = nexradaws.NexradAwsInterface()
-files = conn.get_avail_scans_in_range(sdate,edate,site)
-conn.download(files,'.')
-print('Finish')
+#Download_Scan: Download one file and return (status, bytes) (status: 'skip', 'new' or 'resume')
+#The file is written to path.part and renamed when it is complete.
+#The ETag of the partial file is recorded so that a changed object is downloaded again from the start.
+def Download_Scan(s3, key, size, etag, path, etags, mname):
+    if exists(path) and getsize(path) == size and etags.get(path, (size, etag)) == (size, etag):
+        return 'skip', 0
+    makedirs(dirname(path), exist_ok=True)
+    part = path + '.part'
+    pos = getsize(part) if exists(part) else 0
+    if pos > size or etags.get(part, (size, etag)) != (size, etag): pos = 0
+    if pos == 0: Add_Manifest(mname, etags, part, size, etag)
+    if pos < size:
+        kwargs = {'Range': f'bytes={pos}-'} if pos > 0 else {}
+        resp = s3.get_object(Bucket=bucket, Key=key, IfMatch=etag, **kwargs)
+        with open(part, 'ab' if pos > 0 else 'wb') as fp:
+            for chunk in resp['Body'].iter_chunks(1024 * 1024):
+                fp.write(chunk)
+    if getsize(part) != size:
+        raise IOError(f'{key}: {getsize(part)} bytes downloaded, {size} bytes expected')
+    os.replace(part, path)
+    Add_Manifest(mname, etags, path, size, etag)
+    return ('resume' if pos > 0 else 'new'), size - pos
+
+#Fetch_Bytes: Download one file to memory (bytes)
+def Fetch_Bytes(s3, key, etag=None):
+    kwargs = {'IfMatch': etag} if etag is not None else {}
+    return s3.get_object(Bucket=bucket, Key=key, **kwargs)['Body'].read()
+
+#%%
+if __name__ == '__main__':
+    perflog.Setup(perf_log, 'Get_Level2_fromAWS')
+
+    #Check site and date settings
+    if len(argv) == 3 or len(argv) ==4:
+        sdstr = argv[1]
+        sdate = datetime(int(sdstr[0:4]),int(sdstr[4:6]),int(sdstr[6:8]),int(sdstr[8:10]),int(sdstr[10:12]))
+        edstr = argv[2]
+        edate = datetime(int(edstr[0:4]),int(edstr[4:6]),int(edstr[6:8]),int(edstr[8:10]),int(edstr[10:12]))
+    elif len(argv) != 1:
+        print('Invalid number of argments!')
+        exit(-1)
+
+    if len(argv) == 4: sites = argv[3].split(',')
+
+    #Download data from AWS
+    print('Data from {0} to {1}Z will be donwloaded'.format(
+          sdate.strftime('%y-%m-%d %H:%M'),edate.strftime('%y-%m-%d %H:%M')))
+    s3 = Make_Client(s3_endpoint, s3_anonymous, nthreads)
+    files = []
+    for site in sites:
+        scans = List_Scans(s3, site, sdate, edate)
+        print(f'{site}: {len(scans)} files')
+        files.extend(scans)
+
+    makedirs(outdir, exist_ok=True)
+    mname = join(outdir, manifest)
+    etags = Load_Manifest(mname)
+    count = {'skip': 0, 'new': 0, 'resume': 0}
+    failed = []
+    with perflog.Stage('download', ','.join(sites), nfiles=len(files)):
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            futures = {executor.submit(Download_Scan, s3, key, size, etag, Local_Path(key, t), etags, mname): key
+                       for key, size, etag, t in files}
+            for fut in as_completed(futures):
+                try:
+                    status, _ = fut.result()
+                except Exception:
+                    print(f'Failed: {futures[fut]}\n{traceback.format_exc()}')
+                    failed.append(futures[fut])
+                    continue
+                count[status] += 1
+                if status != 'skip': print(f'{basename(futures[fut])} downloaded' + (' (resumed)' if status == 'resume' else ''))
+    print(f'Finish: {count["new"]+count["resume"]} downloaded ({count["resume"]} resumed), {count["skip"]} skipped, '
+          f'{len(failed)} failed')
+    if len(failed) > 0: exit(1)
@@ -1,9 +1,9 @@
 #%%
 """
-Make_CAPPI_NEXRAD.py ver 1.0 coded by A.NISHII
+Make_CAPPI_NEXRAD.py ver 1.18 coded by A.NISHII
 NEXRAD Level-IIデータからPyartを用いてCAPPIを作成する
 偏波パラメータ(Kdp、Zdr、ρhv)の出力にも対応
-*偏波間位相差変化率(Kdp)は偏波間位相差(psidp)から算出したものを使用 (kdp_vulpianiを使用)
+*偏波間位相差変化率(Kdp)は偏波間位相差(psidp)から算出したものを使用 (kdp_vulpianiと同じ方法。kdp_methodで選択)
 *緯度経度座標系への投影はレーダーを中心とした正距方位図法を使用
 *反射強度0 dBZ未満のグリッドは内挿に用いない点に注意
 
@@ -11,27 +11,91 @@ HISTORY(yyyy.mm.dd)
 ver 1.0 First created 2023.05.15 A.NISHII
 ver 1.1 Bug fixed (fill_valueの設定ミス) ドップラー速度出力をフラグ化 2024.07.09 A.NISHII
 ver 1.2 Bug fixed (gatefilter設定ミス) 2024.07.10 A.NISHII
+ver 1.3 ファイルリストの並列処理モード(nproc)を追加 2026.10.18
+ver 1.4 内挿重みを保存・再利用する高速グリッド化(flag_wcache, cappi_wcache.py)を追加 2026.10.18
+ver 1.5 全変数を1回で内挿し、確保済みの(変数,z,y,x)配列に直接書き込むよう変更 2026.10.18
+ver 1.6 全ボリュームを1つのNetCDF4ファイルに追記する時系列出力(nc_mode='series')を追加 2026.10.18
+ver 1.7 全ボリュームを1つのGrADSバイナリ(メモリマップ)に書き込む時系列出力(grads_mode='series')を追加 2026.10.18
+ver 1.8 ppi_useのスイープと出力に必要な変数だけを読み出すよう変更(nexrad_l2reader.py)
+        Bug fixed (Zdrバイアス補正がCAPPIに反映されていなかった) 2026.10.18
+ver 1.9 ディレクトリを監視して新しいファイルだけを処理する監視モード(watch, nexrad_watch.py)を追加 2026.10.18
+ver 1.10 Bench_NEXRAD.pyから関数を呼べるよう、読み込み時に入力ファイルの指定がなくても止まらないよう変更 2026.10.18
+ver 1.11 Kdpを複数レイまとめて計算し、反射強度のgatefilterを通るゲートだけを計算する高速版(nexrad_kdp.py)を追加 2026.10.18
+ver 1.12 処理段階ごとの時間・メモリ・読み書き量の記録(perf_log, ../common/perflog.py)を追加 2026.10.18
+ver 1.13 反射強度のCAPPI(1高度)をWebメルカトルのタイルにしてMBTilesファイルに保存する機能
+         (tile_db, tile_height, tile_zooms, ../common/mbtiles.py)を追加 2026.10.18
+ver 1.14 AWSからダウンロードしながらメモリ上のデータでCAPPIを作成するパイプラインモード(stream_sites)を追加 2026.10.18
+ver 1.15 Bug fixed (grads_mode='series'で同じ時刻(grads_tint間隔)に複数のボリュームが入る場合、後のボリュームで上書きされていた。
+         最も近いボリュームだけを書き込み、他は飛ばして報告する。書き込み済みの時刻にはファイル名も記録する) 2026.10.18
+ver 1.16 Bug fixed (パイプラインモードで複数のサイトを指定すると、時系列出力(series)に異なるレーダーのボリュームが混ざっていた。
+         時系列出力では1サイトだけを指定するよう変更) 2026.10.18
+ver 1.17 Bug fixed (パイプラインモードでnproc>1のとき、ダウンロードのスレッドが動いている間に子プロセスをforkしていた。
+         子プロセスはforkserver(使えない場合はspawn)で起動する) 2026.10.18
+ver 1.18 Bug fixed (NetCDFのhistoryがver 1.14のままだった。バージョンはVERSIONの1か所で管理する) 2026.10.18
 """
+VERSION = '1.18' #HISTORYの最新のバージョン(NetCDFのhistoryに記録する)
 
 import numpy as np
 import pyart
-from os.path import basename
+from os.path import basename, exists, dirname, abspath, join
 import datetime
 import locale
 from os import makedirs
-from sys import argv
+import sys
+from sys import argv, exit
 import netCDF4
+import traceback
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import cappi_wcache
+import nexrad_l2reader
+import nexrad_watch
+import nexrad_kdp
+import nexrad_quicklook
+import matplotlib
+from matplotlib.colors import BoundaryNorm
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+import mbtiles
 
 #%%
 ##パラメータ設定
 #fname = '../data/RODN/RODN20220831_032654_V06'
-fname = argv[1] #入力ファイル(NEXRAD Level-IIデータorLevel-IIデータのファイルリストを指定)
+fname = argv[1] if len(argv) > 1 else '' #入力ファイル(NEXRAD Level-IIデータorLevel-IIデータのファイルリストを指定。watch=Trueのときは監視するディレクトリ)
 flist = False #Ture:fnameはNEXRADレベル2のファイルリスト(1行1ファイル。相対パスでも絶対パスでも可)、False:fnameはNEXRAD LEVEL2ファイルのパス
 ppi_use = (0, 2, 4, 6, 7, 8, 9, 10, 11, 12, 13) #CAPPIに使用するPPI仰角番号
+nproc = 1 #並列処理に使うプロセス数(flist=Trueまたはwatch=Trueのとき有効。1:逐次処理)
+watch = False              #True:fnameのディレクトリを監視し、新しく届いたファイルを順次処理する(Ctrl-Cで終了)
+watch_pattern = '*_V06'    #watch=Trueのとき処理するファイル名のパターン
+watch_interval = 30.       #watch=Trueのときディレクトリを確認する間隔(秒)
+watch_manifest = 'processed_cappi.txt' #watch=Trueのとき処理済みファイルを記録するファイル(outdir内。再起動時は続きから処理する)
+stream_sites = None        #AWSからダウンロードしながらCAPPIを作成する(パイプラインモード)サイト名のリスト(例: ['KTLX']。Noneなら使わない)
+                           #fnameは無視し、ダウンロードしたデータはファイルに保存せずメモリから読む
+                           #バケット・エンドポイントはGet_Level2_fromAWS.pyの設定(bucket, s3_endpoint, s3_anonymous)を使う
+                           #時系列出力(nc_mode, grads_mode='series')はレーダー中心の座標のため、1サイトだけ指定できる
+stream_period = ('202305221500','202305221600') #パイプラインモードでダウンロードする期間(UTC, yyyymmddHHMM)
+stream_ndl = 4             #パイプラインモードで同時にダウンロードするファイル数
+stream_queue = 4           #パイプラインモードでダウンロード済み(処理中を含む)のボリューム数の上限(nproc以上にする。1ボリューム数十〜百MB)
+stream_save = None         #パイプラインモードでダウンロードしたファイルも保存するディレクトリ(Noneなら保存しない)
 
 outdir = './out_cappi_ver20240709'     #出力ディレクトリ
 flag_nc = True             #True:NetCDFファイルを出力(推奨。GrADSで読みだすにはctlファイルが必要)
+nc_mode = 'file'           #'file':1ボリューム1ファイル(NETCDF3)で出力、'series':全ボリュームを時刻順に1つのNETCDF4ファイルに追記
+nc_series_name = 'CAPPI_3D_series.nc' #nc_mode='series'のときの出力ファイル名(既に存在する場合は続きに追記し、追記済みのボリュームは飛ばす)
+nc_chunk = (4,1,76,76)     #nc_mode='series'のときのチャンクサイズ(time,z,y,x)。水平断面と時系列の両方の読み出しを考慮
 flag_gradsbin = True       #True:grads 4byteバイナリとctlファイルを出力
+grads_mode = 'file'        #'file':1ボリュームごとにbinとctlを出力、'series':全ボリュームを1つのbin(tdef=時刻数)に格納
+grads_series_name = 'CAPPI_3D_series' #grads_mode='series'のときのbin/ctlファイル名(拡張子なし)
+grads_tint = 5             #grads_mode='series'のときの時間間隔(分)。各ボリュームは最も近い時刻に格納される
+                           #1つの時刻に複数のボリュームが入る場合(ボリュームの間隔がgrads_tintより短い場合)は、最も近いボリュームだけを格納し、
+                           #他のボリュームは飛ばして失敗したファイルの一覧に記録する(VCP 212(約4.5分間隔)など)
+                           #途中で止まった場合は同じ設定で再実行すると、書き込み済みの時刻を飛ばして続きから処理する
+tile_db = None             #反射強度のCAPPIのWebメルカトルのタイル(XYZ, 256x256画素のPNG)を保存するMBTilesファイル(Noneなら作成しない)
+                           #前の時刻から変わったタイルだけ画像を作成する(../common/mbtiles.py)
+tile_height = 2000         #タイルを作成するCAPPIの高度(m。最も近い高度の格子を使う)
+tile_zooms = (5,6,7,8,9)   #タイルを作成するズームレベル
+perf_log = None            #処理段階(read,kdp,grid,write_grads,write_nc,tiles)ごとの時間・メモリ・読み書き量を記録するファイル(JSON lines。Noneなら記録しない)
 
 #各方向の解像度は(limit[1]-limit[0])/(grid_shape-1) [m]となる
 grid_shape = (21,601,601)  #(z方向Grid数,南北方向Grid数,東西方向Grid数)
@@ -41,15 +105,22 @@ limit_x = (-300000,300000) #東西方向のCAPPI作成範囲(m)
 
 interp_method = 'Cressman' #内挿方法(Cressman, Barnes2推奨、他にBarnes, Nearestが選択可)
 roi_const = 2000.          #内挿の影響円半径(meter,このスクリプトでは半径を固定させて内挿を実施する)
+flag_wcache = True         #True:内挿重みをサイト・VCP・グリッド設定ごとに保存して再利用する(Nearest以外で有効。初回のみ重みを作成)
+                           #結果はpyartと最大で約0.004 dBZ(Cressman)、約0.05 dBZ(Barnes2)、約0.19 dBZ(Barnes)異なる(cappi_wcache.py)
+wcache_dir = './wcache'    #内挿重みの保存ディレクトリ(設定1つあたり約1GB)
+wcache_tol = (0.25, 0.1)   #保存した重みを作り直す方位角・仰角のずれ(deg.)
 
 flag_v     = False        #True:ドップラー速度も出力
 flag_dupol = False        #True:偏波パラメータ(Zdr,Kdp,ρhv)も出力
 zdrbias    = None         #Zdrバイアス(未知の場合はNoneと入力)
+kdp_method = 'fast'       #Kdpの計算方法 'fast':nexrad_kdp.py(pyartと同じ結果で高速)、'pyart':pyart.retrieve.kdp_vulpiani
+kdp_nthreads = 1          #kdp_method='fast'のときスイープを並列に処理するスレッド数
 
 ##パラメータ設定ここまで
+perflog.Setup(perf_log, 'Make_CAPPI_NEXRAD')
 #%%
-#extract_4bytes(GrADSデータの作成とctlファイル向け移動経度情報の計算)
-def extract_4bytes(grid, latlon, varname):
+#calc_lonlat_info(ctlファイル向け移動経度情報の計算)
+def calc_lonlat_info(latlon):
     #latlon = grid.get_point_longitude_latitude()
     lons = latlon[0]
     lats = latlon[1]
@@ -58,9 +129,14 @@ def extract_4bytes(grid, latlon, varname):
     dlon = abs(lons[int(len(lons)/2),-1] - slon) / (len(lons[0]) - 1.)
     dlat = abs(lats[-1, int(len(lats)/2)] - slat) / (len(lats[0]) - 1.)
 
-    data = grid.fields[varname]['data'].filled(-9999.).astype('float32')
+    return slon, dlon, slat, dlat
 
-    return data, slon, dlon, slat, dlat
+#extract_4bytes(pyartのGridの各変数を確保済みの4-byte配列df[変数,z,y,x]にコピー)
+def extract_4bytes(gfields, varnames, df, undef):
+    for v in range(len(varnames)):
+        data = gfields[varnames[v]]['data']
+        np.copyto(df[v], np.ma.getdata(data))
+        df[v][np.ma.getmaskarray(data)] = undef
 
 
 # %%
@@ -76,9 +152,22 @@ def define_time_fromNEXRAD(fname):
 
     return time_dt
 
+#%%
+#get_varnames: 出力する変数名のリスト(GrADS/netCDFでの変数名, Py-ARTでの変数名)を返す
+def get_varnames():
+    vnames = ['ref']
+    gnames = ['reflectivity']
+    if flag_v:
+        vnames.append('vel')
+        gnames.append('velocity')
+    if flag_dupol:
+        vnames.extend(['zdr','kdp','rhv'])
+        gnames.extend(['differential_reflectivity','specific_differential_phase','cross_correlation_ratio'])
+    return vnames, gnames
+
 #%%
 #Make_GradsCtl: GrADSコントロールファイルを作成
-def Make_GradsCtl(ctlfname, binfname, undef, xnum, slon, dlon, ynum, slat, dlat, znum, sz, dz, date_str, vars):
+def Make_GradsCtl(ctlfname, binfname, undef, xnum, slon, dlon, ynum, slat, dlat, znum, sz, dz, date_str, vars, tnum=1, tint='5mn'):
     with open(ctlfname,'w') as f:
         f.write(f'dset ^{binfname}\n')
         f.write('title\n')
@@ -87,7 +176,7 @@ def Make_GradsCtl(ctlfname, binfname, undef, xnum, slon, dlon, ynum, slat, dlat,
         f.write(f'xdef {xnum} linear {slon:.6f} {dlon:.6f}\n')
         f.write(f'ydef {ynum} linear {slat:.6f} {dlat:.6f}\n')
         f.write(f'zdef {znum} linear {sz} {dz:.3f}\n')
-        f.write(f'tdef 1 linear ' + date_str + ' 5mn\n')
+        f.write(f'tdef {tnum} linear ' + date_str + f' {tint}\n')
         f.write(f'vars {len(vars)}\n')
         for n in range(len(vars)):
             f.write(f'{vars[n]} {znum} 0 {vars[n]}\n')
@@ -96,13 +185,14 @@ def Make_GradsCtl(ctlfname, binfname, undef, xnum, slon, dlon, ynum, slat, dlat,
 
 #%%
 #save_ncvariable: netCDFに変数情報を保存する
-def save_ncvariable(nc,var,undef,vname,vname_long,vunits,vdtype,vdim,comment=None):
-    ncvar = nc.createVariable(vname,vdtype,vdim)
+#(var=Noneのときは変数の定義のみ。kwargsはcreateVariableに渡す)
+def save_ncvariable(nc,var,undef,vname,vname_long,vunits,vdtype,vdim,comment=None,**kwargs):
+    ncvar = nc.createVariable(vname,vdtype,vdim,**kwargs)
     ncvar.long_name = vname_long
     ncvar.standatd_name = vname_long
     ncvar.units = vunits
     if undef != None: ncvar.missing_value = undef
-    ncvar[:] = var
+    if var is not None: ncvar[:] = var
     if comment is not None: ncvar.comment = comment
 
 #out_nc: netCDFファイルに解析結果を出力する
@@ -133,108 +223,535 @@ def out_nc(ncname,undef,xnum,sx,dx,lons,ynum,sy,dy,lats,znum,sz,dz,
         save_ncvariable(nc,vars[v],undef,varnames[v],meta[v][0],meta[v][1],np.dtype('float32').char,('time','z','y','x'))
 
     nc.title    = 'CAPPI created from NEXRAD Level-II PPIs using Py-ART'
-    nc.history  = 'Created by Make_CAPPI_NEXRAD.py ver 1.2 (author: A.NISHII)'
+    nc.history  = f'Created by Make_CAPPI_NEXRAD.py ver {VERSION} (author: A.NISHII)'
     nc.source   = f'{origfname} Used scum numbers: ({" ".join([str(p) for p in ppi_use])})'
     nc.comment  = f'PPIs are interpolated using {interp_method} method with {roi_const:.0f} m radius'
 
     nc.close()
 
 #%%
-if flag_nc:  makedirs(outdir+'/nc/', exist_ok=True)
-if flag_gradsbin: makedirs(outdir+'/bin/', exist_ok=True)
-print('Input file: '+fname)
-if flist:
-    with open(fname,'r') as f:
-        files = f.readlines()
-        files = [s.replace('\n','') for s in files]
-else:
-    files = [fname,]
+#grads_slot: 時系列GrADSバイナリでdate_dtを格納する時刻の番号(t0から最も近いgrads_tint間隔の時刻)
+def grads_slot(t0, date_dt):
+    return int(round((date_dt - t0).total_seconds() / 60. / grads_tint))
+
+#open_grads_series: 時系列GrADSバイナリを準備する(なければ全時刻分の大きさで作成)
+#書き込みが終わった時刻と元のファイル名は{name}_done.txtに記録し、再実行時はその続きから処理する
+#(既存のファイルより後の時刻を含む場合はファイルを後ろに延長する)
+#Return: (時系列バイナリの情報, {書き込み済みの時刻の番号: 元のファイル名(ver 1.14以前に書き込んだ時刻はNone)})
+def open_grads_series(binname, dates, nvar):
+    donename = binname.replace('.bin','_done.txt')
+    tsize = nvar * int(np.prod(grid_shape)) * 4 #1時刻あたりのバイト数
+    if exists(donename) and exists(binname):
+        with open(donename,'r') as fp:
+            t0, nt, tint, nvar0 = fp.readline().split()
+            done = {}
+            for l in fp:
+                cols = l.split()
+                if len(cols) > 0: done[int(cols[0])] = cols[1] if len(cols) > 1 else None
+        t0 = datetime.datetime.strptime(t0,'%Y%m%d%H%M')
+        nt = int(nt)
+        if int(tint) != grads_tint or int(nvar0) != nvar:
+            raise ValueError(f'{binname} was created with different settings (grads_tint or variables)')
+    else:
+        t0 = min(dates).replace(second=0, microsecond=0)
+        nt = 0
+        done = {}
+        open(binname,'wb').close()
+
+    nt_new = max(nt, grads_slot(t0, max(dates)) + 1)
+    if nt_new > nt:
+        with open(binname,'r+b') as fp:
+            fp.truncate(nt_new * tsize)
+        with open(donename,'w') as fp:
+            fp.write(f'{t0.strftime("%Y%m%d%H%M")} {nt_new} {grads_tint} {nvar}\n')
+            for t in sorted(done): fp.write(f'{t}\n' if done[t] is None else f'{t} {done[t]}\n')
+        nt = nt_new
+    return {'bin': binname, 'done': donename, 't0': t0, 'nt': nt}, done
+
+#close_grads_series: 書き込まれなかった時刻を欠損値で埋める
+def close_grads_series(gseries, done, nvar, undef):
+    mm = np.memmap(gseries['bin'], dtype='<f4', mode='r+', shape=(gseries['nt'],nvar)+tuple(grid_shape))
+    for t in range(gseries['nt']):
+        if t not in done: mm[t] = undef
+    mm.flush()
+    del mm
+
+#open_nc_series: 時系列netCDF4ファイルを開く(存在しない場合は作成し、座標は作成時に1回だけ書き込む)
+def open_nc_series(ncname,undef,xnum,sx,dx,lons,ynum,sy,dy,lats,znum,sz,dz,
+                   date_str,varnames,meta,site,ppi_use,interp_method,roi_const,chunk):
+    if exists(ncname):
+        nc = netCDF4.Dataset(ncname,'a')
+    else:
+        nc = netCDF4.Dataset(ncname,'w',format='NETCDF4')
+        nc.createDimension('time',None)
+        nc.createDimension('z',znum)
+        nc.createDimension('y',ynum)
+        nc.createDimension('x',xnum)
+        z = sz   + np.arange(znum) * dz
+        y = sy   + np.arange(ynum) * dy
+        x = sx   + np.arange(xnum) * dx
+        time_unit = 'seconds since ' + date_str
+        save_ncvariable(nc,None,None,'time','time',time_unit,np.dtype('float64').char,('time',))
+        save_ncvariable(nc,z,None,'z','height_above_sea_level','m',np.dtype('float32').char,('z',))
+        save_ncvariable(nc,y,None,'y','y coord from radar','m',np.dtype('float32').char,('y',))
+        save_ncvariable(nc,x,None,'x','x coord from radar','m',np.dtype('float32').char,('x',))
+
+        save_ncvariable(nc,lats,None,'lat','latitude','degrees_north',np.dtype('float32').char,('y','x'),
+                        "Projection: Azimuthal equidistant centered at radar",zlib=True)
+        save_ncvariable(nc,lons,None,'lon','longitude','degrees_east',np.dtype('float32').char,('y','x'),
+                        "Projection: Azimuthal equidistant centered at radar",zlib=True)
+        srcvar = nc.createVariable('source_file',str,('time',))
+        srcvar.long_name = 'NEXRAD Level-II file used for each time'
+
+        chunk = tuple(min(c,n) for c,n in zip(chunk,(chunk[0],znum,ynum,xnum)))
+        for v in range(len(varnames)):
+            save_ncvariable(nc,None,undef,varnames[v],meta[v][0],meta[v][1],np.dtype('float32').char,('time','z','y','x'),
+                            zlib=True,complevel=4,shuffle=True,chunksizes=chunk,fill_value=undef)
+
+        nc.title    = 'CAPPI time series created from NEXRAD Level-II PPIs using Py-ART'
+        nc.history  = f'Created by Make_CAPPI_NEXRAD.py ver {VERSION} (author: A.NISHII)'
+        nc.source   = f'{site} Used scum numbers: ({" ".join([str(p) for p in ppi_use])})'
+        nc.comment  = f'PPIs are interpolated using {interp_method} method with {roi_const:.0f} m radius'
+
+    #追記中のチャンクがキャッシュに残るよう、1チャンク分の時間の全格子が入る大きさにする
+    for v in varnames:
+        chunk = nc[v].chunking()
+        nchunk = int(np.prod([-(-n//c) for n,c in zip(nc[v].shape[1:],chunk[1:])]))
+        nc[v].set_var_chunk_cache(size=nchunk*int(np.prod(chunk))*4, nelems=nchunk*4+1)
+    return nc
+
+#append_nc_series: 時系列netCDF4ファイルの末尾に1時刻分を追記する
+def append_nc_series(nc,vars,varnames,date_dt,origfname):
+    t = len(nc.dimensions['time'])
+    nc['time'][t] = netCDF4.date2num(date_dt,nc['time'].units)
+    nc['source_file'][t] = origfname
+    for v in range(len(varnames)):
+        nc[varnames[v]][t] = vars[v]
 
 #%%
-for f in files:
-    #データ読み出し
-    radar = pyart.io.read_nexrad_archive(f)
+#Make_CAPPI: 1ファイル分のCAPPIを作成して保存し、変数名や時刻などの情報を返す
+#(nc_mode='series'のときは時系列ファイルへの追記をメインプロセスで行うため、CAPPIの配列も返す)
+#gseries: grads_mode='series'のときの時系列バイナリの情報(open_grads_seriesの戻り値)
+#data: ファイルの中身(bytes。パイプラインモードでダウンロードしたもの。fはファイル名として出力ファイル名などに使う)
+def Make_CAPPI(f, gseries=None, data=None):
+    #データ読み出し(ppi_useのスイープと必要な変数だけを展開する)
+    rnames = ['reflectivity']
+    if flag_v: rnames.append('velocity')
+    if flag_dupol: rnames.extend(['differential_reflectivity','differential_phase','cross_correlation_ratio'])
+    with perflog.Stage('read', f):
+        radar_4ppi = nexrad_l2reader.Read_Level2(f if data is None else data, ppi_use, rnames)
+        for g in rnames: radar_4ppi.fields[g]['data'] #遅延読み込みの変数を展開する
     print(f,' is opened')
-    radar_4ppi = radar.extract_sweeps(ppi_use)
+
+    #Set filter
+    gatefilter = pyart.filters.GateFilter(radar_4ppi)
+    gatefilter.exclude_below('reflectivity',0) #反射強度0 dBZ未満のデータはマスクする
 
     if flag_dupol:
-        kdp,pdp = pyart.retrieve.kdp_vulpiani(radar=radar_4ppi,psidp_field='differential_phase',
-                                              band='S',prefilter_psidp=True)
+        with perflog.Stage('kdp', f):
+            if kdp_method == 'fast':
+                #内挿に使われるゲート(gatefilterを通るゲート)だけを計算する
+                kdp = nexrad_kdp.Kdp_Vulpiani(radar_4ppi, gatefilter, psidp_field='differential_phase', band='S',
+                                              prefilter_psidp=True, nthreads=kdp_nthreads)
+            else:
+                kdp,pdp = pyart.retrieve.kdp_vulpiani(radar=radar_4ppi,psidp_field='differential_phase',
+                                                      band='S',prefilter_psidp=True)
         radar_4ppi.add_field('specific_differential_phase',kdp)
         print('Kdp retrieved')
         if zdrbias != None:
-            radar.fields['differential_reflectivity']['data'] -= zdrbias
+            radar_4ppi.fields['differential_reflectivity']['data'] -= zdrbias
             print('Zdr bias corrected')
 
-    #Set filter
-    gatefilter = pyart.filters.GateFilter(radar_4ppi)
-    gatefilter.exclude_below('reflectivity',0) #反射強度0 dBZ未満のデータはマスクする
-
-    #CAPPI作成
-    grid = pyart.map.grid_from_radars(radar_4ppi,grid_shape=grid_shape,grid_limits=(limit_z,limit_y,limit_x), weighting_function='Cressman',
-                                    roi_func='constant', constant_roi = roi_const, gatefilters=gatefilter)
-    latlon = grid.get_point_longitude_latitude()
-    display = pyart.graph.GridMapDisplay(grid)
-
-    #保存のために4-byteバイナリデータを抽出
-    #Reflevtivity (デフォルト)
-    df = []
-    vnames = ['ref']
-    df_z, slon, dlon, slat, dlat = extract_4bytes(grid,latlon,'reflectivity')
-    df.append(df_z)
-
-    #ドップラー速度(flag_vがTrueの場合)
-    if flag_v:
-        df_v, _, _, _, _ = extract_4bytes(grid,latlon,'velocity')
-        df.append(df_v)
-        vnames.append('vel')
+    #出力する変数(GrADS/netCDFでの変数名, Py-ARTでの変数名)
+    vnames, gnames = get_varnames()
+
+    #CAPPI作成(全変数を4-byte配列df[変数,z,y,x]に直接格納する)
+    df = np.empty((len(gnames),)+tuple(grid_shape), dtype='float32')
+    with perflog.Stage('grid', f):
+        if flag_wcache and interp_method != 'Nearest':
+            #保存済みの内挿重みを使用(なければ作成して保存)
+            W, order = cappi_wcache.Get_Weights(radar_4ppi, grid_shape, (limit_z,limit_y,limit_x), roi_const, wcache_dir,
+                                                interp_method, wcache_tol[0], wcache_tol[1])
+            cappi_wcache.Grid_Fields(radar_4ppi, W, order, gnames, df, gatefilter, -9999.)
+            latlon = cappi_wcache.Get_LonLat(radar_4ppi, grid_shape, (limit_z,limit_y,limit_x))
+        else:
+            grid = pyart.map.grid_from_radars(radar_4ppi,grid_shape=grid_shape,grid_limits=(limit_z,limit_y,limit_x), weighting_function=interp_method,
+                                            roi_func='constant', constant_roi = roi_const, gatefilters=gatefilter, fields=gnames)
+            extract_4bytes(grid.fields, gnames, df, -9999.)
+            latlon = grid.get_point_longitude_latitude()
+    slon, dlon, slat, dlat = calc_lonlat_info(latlon)
 
-    #偏波パラメータ(flag_dupolがTrueの場合)
-    if flag_dupol:
-        df_zdr, _, _, _, _ = extract_4bytes(grid,latlon,'differential_reflectivity')
-        df_kdp, _, _, _, _ = extract_4bytes(grid,latlon,'specific_differential_phase')
-        df_rhv, _, _, _, _ = extract_4bytes(grid,latlon,'cross_correlation_ratio')
-        df.append(df_zdr)
-        df.append(df_kdp)
-        df.append(df_rhv)
-        vnames.append('zdr')
-        vnames.append('kdp')
-        vnames.append('rhv')
-
-    df = np.array(df,dtype='float32')
     date_dt  = define_time_fromNEXRAD(f)
 
+    #メタデータの抽出(list([standard_name,units] for _ in range(len(vnames))))
+    meta = [[radar_4ppi.fields[g]['long_name'],radar_4ppi.fields[g]['units']] for g in gnames]
+    res = {'vnames': vnames, 'meta': meta, 'latlon': latlon, 'lonlat_info': (slon, dlon, slat, dlat),
+           'date': date_dt, 'fname': basename(f), 'site': radar_4ppi.metadata.get('instrument_name',''),
+           'path': f, 'outputs': []}
+    if tile_db is not None:
+        #タイル用の反射強度(メインプロセスのwriterでタイルにする)
+        k = int(round((tile_height - limit_z[0]) / (limit_z[1] - limit_z[0]) * (grid_shape[0] - 1)))
+        res['tile_z'] = df[gnames.index('reflectivity'), min(max(k, 0), grid_shape[0] - 1)].copy()
+        res['origin'] = (float(radar_4ppi.longitude['data'][0]), float(radar_4ppi.latitude['data'][0]))
+
     #GrADSバイナリ形式で保存
-    if flag_gradsbin:
+    if flag_gradsbin and gseries is not None:
+        #時系列バイナリの該当する時刻に直接書き込む
+        #(Process_Filesで1つの時刻には1つのボリュームだけを渡すので、並列でも書き込む場所は衝突しない)
+        slot = grads_slot(gseries['t0'], date_dt)
+        if slot < 0 or slot >= gseries['nt']:
+            raise ValueError(f'{basename(f)} is out of the time range of {gseries["bin"]}')
+        with perflog.Stage('write_grads', f):
+            mm = np.memmap(gseries['bin'], dtype='<f4', mode='r+', shape=(gseries['nt'],)+df.shape)
+            mm[slot] = df
+            mm.flush()
+            del mm
+        res['slot'] = slot
+        res['outputs'].append(gseries['bin'])
+        print(f'CAPPI (GrADS binary) saved to {gseries["bin"]} (t={slot+1})')
+    elif flag_gradsbin:
         locale.setlocale(locale.LC_TIME, 'en_US.UTF-8')
         date_str = date_dt.strftime("%H:%MZ%d%b%Y")
         ctlfname = basename(f) + '_3D_xy.ctl'
         ctlfname_ll = basename(f) + '_3D_latlon.ctl'
         binfname = basename(f) + '_3D.bin'
-        Make_GradsCtl(outdir + '/bin/' + ctlfname, binfname, -9999., df_z.shape[2], -300, 1.0, df_z.shape[1], -300, 1.0, 
-                    df_z.shape[0], limit_z[0], (limit_z[1]-limit_z[0])/(grid_shape[0]-1)/1000., date_str, vnames)
-        Make_GradsCtl(outdir + '/bin/' + ctlfname_ll, binfname, -9999., df_z.shape[2], slon, dlon, df_z.shape[1], slat, dlat, 
-                    df_z.shape[0], limit_z[0], (limit_z[1]-limit_z[0])/(grid_shape[0]-1)/1000., date_str, vnames)
-        df.tofile(outdir + '/bin/' + binfname,format='<f4')
+        with perflog.Stage('write_grads', f):
+            Make_GradsCtl(outdir + '/bin/' + ctlfname, binfname, -9999., df.shape[3], -300, 1.0, df.shape[2], -300, 1.0, 
+                        df.shape[1], limit_z[0], (limit_z[1]-limit_z[0])/(grid_shape[0]-1)/1000., date_str, vnames)
+            Make_GradsCtl(outdir + '/bin/' + ctlfname_ll, binfname, -9999., df.shape[3], slon, dlon, df.shape[2], slat, dlat, 
+                        df.shape[1], limit_z[0], (limit_z[1]-limit_z[0])/(grid_shape[0]-1)/1000., date_str, vnames)
+            df.tofile(outdir + '/bin/' + binfname,format='<f4')
+        res['outputs'] += [outdir + '/bin/' + n for n in (binfname, ctlfname, ctlfname_ll)]
         print('CAPPI (GrADS binary) saved to ' + outdir + '/bin/' + binfname)
 
+    if flag_nc and nc_mode == 'series':
+        res['df'] = df
+        res['outputs'].append(outdir + '/nc/' + nc_series_name)
+        return res
+
     #netCDF形式で保存
     if flag_nc:
-        #メタデータの抽出(list([standard_name,units] for _ in range(len(vnames))))
-        meta = []
-        meta.append([grid.fields['reflectivity']['long_name'],grid.fields['reflectivity']['units']])
-        if flag_v:
-            meta.append([grid.fields['velocity']['long_name'],grid.fields['velocity']['units']]) 
-        if flag_dupol:
-            meta.append([grid.fields['differential_reflectivity']['long_name'],grid.fields['differential_reflectivity']['units']]) 
-            meta.append([grid.fields['specific_differential_phase']['long_name'],grid.fields['specific_differential_phase']['units']]) 
-            meta.append([grid.fields['cross_correlation_ratio']['long_name'],grid.fields['cross_correlation_ratio']['units']]) 
         datestr_nc = date_dt.strftime('%Y-%m-%d %H:%M:%S+00:00')
         ncname = basename(f) +'_3D.nc'
         ncdir = outdir+'/nc/'
-        out_nc(ncdir+ncname,-9999.,
-            df_z.shape[2], limit_x[0],(limit_x[1]-limit_x[0])/(grid_shape[2]-1),latlon[0], 
-            df_z.shape[1], limit_y[0],(limit_y[1]-limit_y[0])/(grid_shape[1]-1),latlon[1],
-            df_z.shape[0], limit_z[0],(limit_z[1]-limit_z[0])/(grid_shape[0]-1),
-            datestr_nc,df,vnames,meta,basename(f),ppi_use,interp_method,roi_const)
+        with perflog.Stage('write_nc', f):
+            out_nc(ncdir+ncname,-9999.,
+                df.shape[3], limit_x[0],(limit_x[1]-limit_x[0])/(grid_shape[2]-1),latlon[0], 
+                df.shape[2], limit_y[0],(limit_y[1]-limit_y[0])/(grid_shape[1]-1),latlon[1],
+                df.shape[1], limit_z[0],(limit_z[1]-limit_z[0])/(grid_shape[0]-1),
+                datestr_nc,df,vnames,meta,basename(f),ppi_use,interp_method,roi_const)
         print('CAPPI (nc) saved to ' + ncdir + ncname)
+        res['outputs'].append(ncdir + ncname)
+    return res
+
+#%%
+#Run_CAPPI: Make_CAPPIを実行し、(エラー内容, 結果)を返す(失敗しても処理は止めない)
+def Run_CAPPI(f, gseries=None, data=None):
+    try:
+        with perflog.Stage('volume', f):
+            res = Make_CAPPI(f, gseries, data)
+    except Exception:
+        return traceback.format_exc(), None
+    return None, res
+
+#%%
+#Make_Collector: i番目のファイルの結果を受け取り、成功したものをファイルリストの順番にwriter(結果)に渡す関数を返す
+#(失敗したファイルはfailedに(ファイル, エラー内容)を追加する)
+def Make_Collector(files, failed, writer=None):
+    pending = {}    #順番待ちの結果
+    nextidx = [0]   #次にwriterに渡す番号
+
+    def collect(i, err, res):
+        if err is not None:
+            failed.append((files[i], err))
+            res = None
+        pending[i] = res
+        while nextidx[0] in pending:
+            res = pending.pop(nextidx[0])
+            if res is not None and writer is not None: writer(res)
+            nextidx[0] += 1
+    return collect
+
+#%%
+#Run_Batch: ファイルリストを逐次(nproc=1)または並列に処理し、失敗したファイルの一覧を返す
+#writerを指定した場合、成功したファイルのMake_CAPPIの結果をファイルリストの順番にwriter(結果)に渡す
+def Run_Batch(files, nproc, writer=None, gseries=None):
+    failed = []
+    collect = Make_Collector(files, failed, writer)
+
+    istart = 0
+    if flag_wcache and nproc > 1 and len(files) > 1:
+        #内挿重みの作成を各プロセスで重複させないため、最初のファイルは先に処理する
+        collect(0, *Run_CAPPI(files[0], gseries))
+        istart = 1
+    if nproc <= 1:
+        for i in range(istart, len(files)):
+            collect(i, *Run_CAPPI(files[i], gseries))
+    else:
+        with ProcessPoolExecutor(max_workers=nproc) as executor:
+            futures = {executor.submit(Run_CAPPI, files[i], gseries): i for i in range(istart, len(files))}
+            for fut in as_completed(futures):
+                try:
+                    err, res = fut.result()
+                except Exception: #ワーカープロセス自体が落ちた場合
+                    err, res = traceback.format_exc(), None
+                collect(futures[fut], err, res)
+    return failed
+
+#%%
+#Run_Stream: ファイルをstream_ndl個のスレッドでダウンロードしながら、届いたものから逐次(nproc=1)または並列に処理し、
+#失敗したファイルの一覧を返す(パイプラインモード。writerはRun_Batchと同じ)
+#ダウンロード済みで処理が終わっていないボリュームはstream_queue個までとし、それ以上は処理が終わるまでダウンロードを待つ
+def Run_Stream(files, nproc, source, writer=None, gseries=None):
+    ##files: ファイル名のリスト、source: (S3クライアント, {ファイル名: (キー, ETag)})
+    import Get_Level2_fromAWS #boto3はパイプラインモードでだけ使う
+    s3, keys = source
+    failed = []
+    collect = Make_Collector(files, failed, writer)
+    slots = threading.BoundedSemaphore(stream_queue)
+
+    def fetch(f):
+        slots.acquire()
+        try:
+            data = Get_Level2_fromAWS.Fetch_Bytes(s3, *keys[f])
+            if stream_save is not None:
+                with open(join(stream_save, f), 'wb') as fp: fp.write(data)
+        except Exception:
+            slots.release()
+            raise
+        print(f'{f} downloaded ({len(data)/1e6:.1f} MB)')
+        return data
+
+    def run(i, data):
+        try:
+            return Run_CAPPI(files[i], gseries, data)
+        finally:
+            slots.release()
+
+    if stream_save is not None: makedirs(stream_save, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=stream_ndl) as downloader:
+        downloads = [downloader.submit(fetch, f) for f in files] #時刻順にダウンロードする
+        if nproc <= 1:
+            #ダウンロードが終わったものから順に処理する(処理中も次のファイルのダウンロードは続く)
+            for i, fut in enumerate(downloads):
+                try:
+                    data = fut.result()
+                except Exception:
+                    collect(i, traceback.format_exc(), None)
+                    continue
+                collect(i, *run(i, data))
+                del data
+            return failed
+
+        #ダウンロードのスレッドが動いているため、子プロセスはforkではなくforkserver(またはspawn)で起動する
+        #(ロックを持ったスレッドがある状態でforkすると子プロセスが止まることがある)
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        with ProcessPoolExecutor(max_workers=nproc, mp_context=multiprocessing.get_context(method)) as executor:
+            istart = 0
+            if flag_wcache and len(files) > 1:
+                #内挿重みの作成を各プロセスで重複させないため、最初のファイルは先に処理する
+                try:
+                    collect(0, *run(0, downloads[0].result()))
+                except Exception:
+                    collect(0, traceback.format_exc(), None)
+                istart = 1
+            waiting = {downloads[i]: i for i in range(istart, len(files))} #ダウンロード中・処理中のファイル
+            gridding = {}
+            while len(waiting) > 0:
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    i = waiting.pop(fut)
+                    try:
+                        res = fut.result()
+                    except Exception:
+                        collect(i, traceback.format_exc(), None)
+                        continue
+                    if fut in gridding:
+                        collect(i, *res)
+                    else:
+                        #ダウンロードが終わったので処理を始める(処理が終わったら次のダウンロードを許可する)
+                        g = executor.submit(Run_CAPPI, files[i], gseries, res)
+                        g.add_done_callback(lambda _: slots.release())
+                        gridding[g] = i
+                        waiting[g] = i
+    return failed
+
+#%%
+tile_conn = {} #tile_dbの接続とタイルの画素→格子の対応表(Write_CAPPI_Tilesで作成)
+
+#Write_CAPPI_Tiles: Make_CAPPIの結果の反射強度(tile_height)をWebメルカトルのタイルにしてtile_dbに保存する
+#(0 dBZ未満と欠損値は透明。色はDraw_NEXRAD_Level2.pyと同じ)
+def Write_CAPPI_Tiles(res):
+    with perflog.Stage('tiles', res['path']):
+        lons, lats = res['latlon']
+        bounds = [float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())]
+        if 'conn' not in tile_conn:
+            tile_conn['conn'] = mbtiles.Open_MBTiles(tile_db, f'NEXRAD CAPPI {tile_height} m', bounds, tile_zooms)
+            clevs_z = np.arange(0,61,5)
+            cmap_z = matplotlib.colormaps['pyart_NWSRef']
+            tile_conn['colors'] = nexrad_quicklook.Make_Colors(cmap_z, BoundaryNorm(clevs_z, cmap_z.N, extend='both'))
+        #格子はレーダーを中心とした正距方位図法なので、対応表はレーダーの位置ごとに保存する
+        luts = tile_conn.setdefault(res['origin'], {})
+        lut_func = mbtiles.Aeqd_LUT(res['origin'][0], res['origin'][1],
+                                    limit_x[0], (limit_x[1]-limit_x[0])/(grid_shape[2]-1), grid_shape[2],
+                                    limit_y[0], (limit_y[1]-limit_y[0])/(grid_shape[1]-1), grid_shape[1])
+        bounds_z, rgb = tile_conn['colors']
+        cnum = np.digitize(res['tile_z'], bounds_z).astype(np.uint8) #欠損値(-9999)は0(透明)になる
+        palette = [0, 0, 0] + rgb[1:].ravel().tolist()
+        tstr = res['date'].strftime('%Y-%m-%dT%H:%M:%SZ')
+        nnew, nsame = mbtiles.Write_Tiles(tile_conn['conn'], tstr, cnum, palette, lut_func, luts, tile_zooms, bounds)
+    print(f'Tiles saved to {tile_db} ({tstr}, new: {nnew}, unchanged: {nsame})')
+
+#%%
+#Process_Files: ファイルリストを処理し、(失敗したファイルの一覧, {ファイルパス: 出力ファイルのリスト(失敗はNone)})を返す
+#時系列出力(series)の場合は追記済みのボリュームを飛ばす
+#時系列GrADSバイナリの同じ時刻に入る他のボリュームも飛ばし、失敗したファイルの一覧に含める(エラー内容はSkipped: ...)
+#source: パイプラインモードのときのダウンロード元(Run_Stream。filesはファイル名のリスト)
+def Process_Files(files, source=None):
+    results = {f: None for f in files}
+    vnames, _ = get_varnames()
+    gseries = None
+    skipped = [] #時系列GrADSバイナリの同じ時刻に他のボリュームが入るため飛ばしたファイル
+    if flag_gradsbin and grads_mode == 'series':
+        #時系列GrADSバイナリを準備(書き込み済みの時刻のボリュームは飛ばす)
+        binname_s = outdir + '/bin/' + grads_series_name + '.bin'
+        dates = [define_time_fromNEXRAD(f) for f in files]
+        gseries, gdone = open_grads_series(binname_s, dates, len(vnames))
+        gseries['ctl'] = False
+        #1つの時刻には最も近いボリュームだけを書き込む(書き込み済みの時刻はそのボリュームのまま)
+        use = {} #時刻の番号: (時刻とのずれ, ファイル)
+        for f, d in zip(files, dates):
+            t = grads_slot(gseries['t0'], d)
+            if t in gdone:
+                if gdone[t] is None or gdone[t] == basename(f):
+                    results[f] = [binname_s]
+                else:
+                    skipped.append((f, f'Skipped: t={t+1} of {binname_s} already has {gdone[t]} (grads_tint={grads_tint} min)\n'))
+                continue
+            dt = abs((d - gseries['t0']).total_seconds() - t * grads_tint * 60.)
+            if t in use:
+                far = max(use[t], (dt, f))
+                use[t] = min(use[t], (dt, f))
+                skipped.append((far[1], f'Skipped: {basename(use[t][1])} is nearer to t={t+1} of {binname_s} '
+                                        f'(grads_tint={grads_tint} min)\n'))
+            else:
+                use[t] = (dt, f)
+        files = [f for f in files if f in {u[1] for u in use.values()}]
+        print(f'{len(gdone)}/{gseries["nt"]} times are already in {binname_s}')
+        for f, err in skipped: print(f'{basename(f)}: ' + err.strip())
+
+    ncname_s = outdir + '/nc/' + nc_series_name
+    if flag_nc and nc_mode == 'series' and exists(ncname_s):
+        #時系列netCDF4ファイルに追記済みのボリュームは飛ばす
+        with netCDF4.Dataset(ncname_s,'r') as nc:
+            done = set(nc['source_file'][:])
+        for f in files:
+            if basename(f) in done: results[f] = [ncname_s]
+        files = [f for f in files if basename(f) not in done]
+        print(f'{len(done)} volumes are already in {ncname_s}')
+
+    ncs = []
+    def writer(res):
+        if gseries is not None:
+            #ctlファイルは最初の結果から作成し、書き込み済みの時刻を記録する
+            if not gseries['ctl']:
+                gseries['ctl'] = True
+                locale.setlocale(locale.LC_TIME, 'en_US.UTF-8')
+                date_str = gseries['t0'].strftime("%H:%MZ%d%b%Y")
+                binfname = basename(gseries['bin'])
+                slon, dlon, slat, dlat = res['lonlat_info']
+                dz = (limit_z[1]-limit_z[0])/(grid_shape[0]-1)/1000.
+                Make_GradsCtl(outdir + '/bin/' + grads_series_name + '_xy.ctl', binfname, -9999., grid_shape[2], -300, 1.0,
+                              grid_shape[1], -300, 1.0, grid_shape[0], limit_z[0], dz, date_str, vnames, gseries['nt'], f'{grads_tint}mn')
+                Make_GradsCtl(outdir + '/bin/' + grads_series_name + '_latlon.ctl', binfname, -9999., grid_shape[2], slon, dlon,
+                              grid_shape[1], slat, dlat, grid_shape[0], limit_z[0], dz, date_str, vnames, gseries['nt'], f'{grads_tint}mn')
+            gdone[res['slot']] = res['fname']
+            with open(gseries['done'],'a') as fp:
+                fp.write(f'{res["slot"]} {res["fname"]}\n')
+        if flag_nc and nc_mode == 'series':
+            #時系列netCDF4ファイルに追記
+            if len(ncs) == 0:
+                ncs.append(open_nc_series(ncname_s,-9999.,
+                    grid_shape[2], limit_x[0],(limit_x[1]-limit_x[0])/(grid_shape[2]-1),res['latlon'][0],
+                    grid_shape[1], limit_y[0],(limit_y[1]-limit_y[0])/(grid_shape[1]-1),res['latlon'][1],
+                    grid_shape[0], limit_z[0],(limit_z[1]-limit_z[0])/(grid_shape[0]-1),
+                    res['date'].strftime('%Y-%m-%d %H:%M:%S+00:00'),res['vnames'],res['meta'],res['site'],
+                    ppi_use,interp_method,roi_const,nc_chunk))
+            with perflog.Stage('write_nc', res['path']):
+                append_nc_series(ncs[0],res['df'],res['vnames'],res['date'],res['fname'])
+            print('CAPPI (nc) appended to ' + ncname_s)
+        if tile_db is not None:
+            Write_CAPPI_Tiles(res)
+            res['outputs'].append(tile_db)
+        results[res['path']] = res['outputs']
+
+    try:
+        if source is None:
+            failed = Run_Batch(files, nproc, writer, gseries)
+        else:
+            failed = Run_Stream(files, nproc, source, writer, gseries)
+    finally:
+        if len(ncs) > 0: ncs[0].close()
+        if gseries is not None: close_grads_series(gseries, gdone, len(vnames), -9999.)
+    for f, _ in failed: results[f] = None
+    print(f'Finish: {len(files)-len(failed)}/{len(files)} files succeeded' +
+          (f' ({len(skipped)} files skipped)' if len(skipped) > 0 else ''))
+    return skipped + failed, results
+
+#%%
+#Report_Failed: 失敗したファイルとエラー内容をfailnameに書き出す(mode='a'なら追記)
+def Report_Failed(failed, failname, mode='w'):
+    makedirs(outdir, exist_ok=True)
+    with open(failname,mode) as fp:
+        for f, err in failed:
+            print(f'Failed: {f}')
+            fp.write(f'{f}\n{err}\n')
+    print('Error messages saved to ' + failname)
+
+#%%
+if __name__ == '__main__':
+    if flag_nc:  makedirs(outdir+'/nc/', exist_ok=True)
+    if flag_gradsbin: makedirs(outdir+'/bin/', exist_ok=True)
+    print('Input file: '+fname)
+
+    if stream_sites is not None:
+        #パイプラインモード(AWSからダウンロードしながら処理する)
+        if len(stream_sites) > 1 and ((flag_nc and nc_mode == 'series') or (flag_gradsbin and grads_mode == 'series')):
+            raise ValueError('Time series output (nc_mode or grads_mode = "series") is radar-relative. '
+                             'Give only one site in stream_sites (run once per site with different series names)')
+        import Get_Level2_fromAWS as aws
+        s3 = aws.Make_Client(aws.s3_endpoint, aws.s3_anonymous, stream_ndl)
+        sdate = datetime.datetime.strptime(stream_period[0], '%Y%m%d%H%M')
+        edate = datetime.datetime.strptime(stream_period[1], '%Y%m%d%H%M')
+        scans = sorted(sum([aws.List_Scans(s3, site, sdate, edate) for site in stream_sites], []), key=lambda s: (s[3], s[0]))
+        keys = {basename(key): (key, etag) for key, _, etag, _ in scans}
+        print(f'{len(keys)} files will be downloaded and processed')
+        with perflog.Stage('stream', ','.join(stream_sites), nfiles=len(keys)):
+            failed, _ = Process_Files(list(keys), (s3, keys))
+        if len(failed) > 0:
+            Report_Failed(failed, outdir + '/failed_stream.txt')
+            exit(1)
+    elif watch:
+        #ディレクトリ監視モード(出力に影響する設定を変えた場合は全ファイルを処理し直す)
+        phash = nexrad_watch.Params_Hash((ppi_use, grid_shape, limit_z, limit_y, limit_x, interp_method, roi_const,
+                                          flag_wcache, flag_v, flag_dupol, zdrbias, flag_nc, nc_mode, nc_series_name,
+                                          flag_gradsbin, grads_mode, grads_series_name, grads_tint))
+        def process(files):
+            failed, results = Process_Files(files)
+            if len(failed) > 0: Report_Failed(failed, outdir + '/failed_watch.txt', 'a')
+            return results
+        nexrad_watch.Watch_Dir(fname, watch_pattern, process, outdir + '/' + watch_manifest, phash, watch_interval)
+    else:
+        if flist:
+            with open(fname,'r') as f:
+                files = f.readlines()
+                files = [s.replace('\n','') for s in files]
+        else:
+            files = [fname,]
+
+        failed, _ = Process_Files(files)
+
+        #失敗したファイルの報告
+        if len(failed) > 0:
+            Report_Failed(failed, outdir + '/failed_' + basename(fname) + '.txt')
+            exit(1)
@@ -0,0 +1,181 @@
+#%%
+"""
+Make_Catalog_NEXRAD.py ver 1.0
+ディレクトリ以下のNEXRAD Level-IIファイルのヘッダ情報(サイト、時刻、VCP、各スイープの仰角・モーメント・ゲート数)を
+並列に読み出し、SQLiteのカタログ(catalog)に保存する。
+カタログから条件(サイト、期間、VCP)に合うファイルのリスト(Make_CAPPI_NEXRAD.py、Draw_NEXRAD_Level2.pyのflist用)と、
+そのファイルのスイープ番号ごとの仰角の一覧(ppi_useの選択用)を作成する。
+*レイのデータは展開しない(nexrad_l2reader.Read_Header)ため、ファイル全体の読み出しより高速
+*カタログに登録済みでサイズ・更新時刻が変わっていないファイルは読み直さない
+
+Useage
+python3 Make_Catalog_NEXRAD.py path/to/dir   #カタログの作成・更新(その後list_outが指定されていればリストを作成)
+python3 Make_Catalog_NEXRAD.py               #カタログからリストを作成するだけ
+
+カタログの内容
+ volumes(path, size, mtime, site, time, vcp, nsweeps, lat, lon, height): 1ファイル1行(timeはUTC, 'yyyy-mm-dd HH:MM:SS')
+ sweeps(path, scnum, fixed_angle, elevation): スイープ番号(0始まり)ごとの仰角
+ moments(path, scnum, moment, ngates, first_gate, gate_spacing): スイープ・モーメントごとのゲート数と配置(m)
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+"""
+
+import sqlite3
+import sys
+from sys import argv, exit
+from os import makedirs, walk, stat
+from os.path import join, dirname, abspath
+from fnmatch import fnmatch
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import nexrad_l2reader
+sys.path.append(join(dirname(abspath(__file__)), '..', 'common'))
+import perflog
+
+#%%
+##パラメータ設定
+datadir = argv[1] if len(argv) > 1 else '' #ヘッダ情報を読み出すディレクトリ(サブディレクトリも含む。''ならカタログの更新はしない)
+file_pattern = '*_V06'        #読み出すファイル名のパターン
+catalog = './nexrad_catalog.db' #カタログ(SQLite)のファイル名
+nproc = 4                     #並列に読み出すプロセス数
+
+list_out = None               #条件に合うファイルのリストの出力先(Noneなら作成しない)
+list_site = None              #サイト名(例: 'KTLX'。Noneなら全て)
+list_start = None             #期間の開始時刻(UTC, 'yyyymmddHHMM'。Noneなら制限なし)
+list_end = None               #期間の終了時刻(UTC, 'yyyymmddHHMM'。Noneなら制限なし)
+list_vcp = None               #VCP番号(Noneなら全て)
+perf_log = None               #処理段階(scan,list)ごとの時間・メモリ・読み込み量を記録するファイル(JSON lines。Noneなら記録しない)
+##パラメータ設定ここまで
+perflog.Setup(perf_log, 'Make_Catalog_NEXRAD')
+
+#%%
+#Open_Catalog: カタログを開く(なければ作成する)
+def Open_Catalog(dbname):
+    if dirname(dbname) != '': makedirs(dirname(dbname), exist_ok=True)
+    conn = sqlite3.connect(dbname)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS volumes (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, site TEXT, time TEXT,
+                                            vcp INTEGER, nsweeps INTEGER, lat REAL, lon REAL, height REAL);
+        CREATE TABLE IF NOT EXISTS sweeps (path TEXT, scnum INTEGER, fixed_angle REAL, elevation REAL,
+                                           PRIMARY KEY (path, scnum));
+        CREATE TABLE IF NOT EXISTS moments (path TEXT, scnum INTEGER, moment TEXT, ngates INTEGER,
+                                            first_gate INTEGER, gate_spacing INTEGER, PRIMARY KEY (path, scnum, moment));
+        CREATE INDEX IF NOT EXISTS volumes_site_time ON volumes (site, time);
+    ''')
+    return conn
+
+#%%
+#Find_Files: ディレクトリ以下のパターンに合うファイルを探し、[(パス, サイズ, 更新時刻)]を返す
+def Find_Files(topdir, pattern):
+    files = []
+    for d, _, names in walk(topdir):
+        for n in sorted(names):
+            if fnmatch(n, pattern):
+                st = stat(join(d, n))
+                files.append((abspath(join(d, n)), st.st_size, st.st_mtime))
+    return sorted(files)
+
+#Read_Info: 1ファイルのヘッダ情報を読み出し、(パス, ヘッダ情報, エラー内容)を返す(失敗しても処理は止めない)
+def Read_Info(path):
+    try:
+        with perflog.Stage('read', path):
+            info = nexrad_l2reader.Read_Header(path)
+    except Exception:
+        return path, None, traceback.format_exc()
+    return path, info, None
+
+#Add_Volume: 1ファイル分のヘッダ情報をカタログに登録する(登録済みの場合は置き換える)
+def Add_Volume(conn, path, size, mtime, info):
+    for table in ('volumes', 'sweeps', 'moments'):
+        conn.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+    conn.execute('INSERT INTO volumes VALUES (?,?,?,?,?,?,?,?,?,?)',
+                 (path, size, mtime, info['site'], info['time'].strftime('%Y-%m-%d %H:%M:%S'), info['vcp'],
+                  len(info['sweeps']), info['lat'], info['lon'], info['height']))
+    for s in info['sweeps']:
+        conn.execute('INSERT INTO sweeps VALUES (?,?,?,?)', (path, s['scnum'], round(s['fixed_angle'], 3),
+                                                             round(s['elevation'], 3)))
+        conn.executemany('INSERT INTO moments VALUES (?,?,?,?,?,?)',
+                         [(path, s['scnum'], m) + tuple(v) for m, v in s['moments'].items()])
+
+#%%
+#Update_Catalog: topdir以下の新しいファイル・更新されたファイルのヘッダ情報をカタログに登録し、失敗したファイルの一覧を返す
+def Update_Catalog(conn, topdir, pattern, nproc):
+    known = {p: (s, m) for p, s, m in conn.execute('SELECT path, size, mtime FROM volumes')}
+    files = Find_Files(topdir, pattern)
+    todo = {p: (s, m) for p, s, m in files if known.get(p) != (s, m)}
+    print(f'{len(files)} files found, {len(todo)} files to read')
+
+    failed = []
+    def add(path, info, err):
+        if err is not None:
+            print(f'Failed: {path}\n{err}')
+            failed.append((path, err))
+            return
+        Add_Volume(conn, path, todo[path][0], todo[path][1], info)
+
+    with perflog.Stage('scan', topdir, nfiles=len(todo)):
+        if nproc <= 1:
+            for i, p in enumerate(todo):
+                add(*Read_Info(p))
+                if i % 100 == 99: conn.commit()
+        else:
+            with ProcessPoolExecutor(max_workers=nproc) as executor:
+                for i, res in enumerate(executor.map(Read_Info, todo, chunksize=8)):
+                    add(*res)
+                    if i % 100 == 99: conn.commit()
+        conn.commit()
+    print(f'Catalog updated: {len(todo)-len(failed)}/{len(todo)} files')
+    return failed
+
+#%%
+#Query_Files: カタログから条件(サイト、期間(UTC, 'yyyymmddHHMM')、VCP)に合うファイルを時刻順に返す
+def Query_Files(conn, site=None, start=None, end=None, vcp=None):
+    where, args = [], []
+    if site is not None:
+        where.append('site = ?'); args.append(site)
+    if start is not None:
+        where.append('time >= ?'); args.append(f'{start[0:4]}-{start[4:6]}-{start[6:8]} {start[8:10]}:{start[10:12]}:00')
+    if end is not None:
+        where.append('time <= ?'); args.append(f'{end[0:4]}-{end[4:6]}-{end[6:8]} {end[8:10]}:{end[10:12]}:59')
+    if vcp is not None:
+        where.append('vcp = ?'); args.append(vcp)
+    sql = 'SELECT path FROM volumes' + (' WHERE ' + ' AND '.join(where) if len(where) > 0 else '') + ' ORDER BY time, path'
+    return [p for p, in conn.execute(sql, args)]
+
+#Sweep_Table: ファイルのリストのVCPごとに、スイープ番号ごとの仰角とモーメント(ゲート数)の一覧を返す(ppi_useの選択用)
+def Sweep_Table(conn, paths):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS selected (path TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM selected')
+    conn.executemany('INSERT OR IGNORE INTO selected VALUES (?)', [(p,) for p in paths])
+    rows = conn.execute('''
+        SELECT v.vcp, s.scnum, ROUND(s.fixed_angle, 1) AS el, COUNT(DISTINCT s.path),
+               (SELECT GROUP_CONCAT(m.moment || ':' || m.ngates, ' ') FROM moments m
+                WHERE m.path = MIN(s.path) AND m.scnum = s.scnum)
+        FROM sweeps s JOIN volumes v ON v.path = s.path JOIN selected USING (path)
+        GROUP BY v.vcp, s.scnum, el ORDER BY v.vcp, s.scnum, el''').fetchall()
+    return rows
+
+#%%
+if __name__ == '__main__':
+    conn = Open_Catalog(catalog)
+    failed = []
+    if datadir != '':
+        print(f'Input directory: {datadir}')
+        failed = Update_Catalog(conn, datadir, file_pattern, nproc)
+
+    if list_out is not None:
+        with perflog.Stage('list', catalog):
+            paths = Query_Files(conn, list_site, list_start, list_end, list_vcp)
+            if dirname(list_out) != '': makedirs(dirname(list_out), exist_ok=True)
+            with open(list_out, 'w') as fp:
+                for p in paths: fp.write(p + '\n')
+            print(f'{len(paths)} files listed in {list_out}')
+
+            #VCPごとのスイープ番号と仰角(同じスイープ番号で仰角が異なるファイルがある場合は複数行になる)
+            print('vcp scnum el[deg.] nfiles moments(ngates)')
+            for vcp, scnum, el, nfiles, moments in Sweep_Table(conn, paths):
+                print(f'{vcp} {scnum:02d} {el:4.01f} {nfiles} {moments}')
+    conn.close()
+
+    if len(failed) > 0: exit(1)
@@ -0,0 +1,259 @@
+"""
+cappi_wcache.py ver 1.3
+CAPPI作成用の内挿重み(ゲート→グリッド)を疎行列として作成・保存し、再利用するモジュール
+Make_CAPPI_NEXRAD.pyから呼び出して使用する
+
+同じサイト・VCP・グリッド設定(grid_shape, limit_*, roi_const)ではゲートの位置はほとんど変わらないため、
+重み行列を一度作成してディスクに保存し、以降のボリュームは疎行列×ベクトルの積だけで内挿する。
+*重みの計算はpyart.map.grid_from_radars(roi_func='constant')と同じ定義
+ (グリッド座標はレーダー中心・アンテナ高度基準、影響円内のゲートを重み付け平均)
+*結果はgrid_from_radarsと完全には一致しない(距離・重みをfloat32で計算し、足し合わせる順番も異なるため)
+ 反射強度の差は最大で約0.004 dBZ(Cressman)、約0.05 dBZ(Barnes2)、約0.19 dBZ(Barnes)。
+ 影響円のちょうど境界にある格子は、有効/欠損がgrid_from_radarsと異なる場合がある(21x601x601格子で数点)
+*保存先はサイト・VCP・グリッド設定と、レイ数・ゲート数の組(720/721レイなど)ごとに分ける(wcache_dir/キー/)
+ 各スイープの方位角・仰角が保存済みのどの重みからもtol_az, tol_el [deg.]以上ずれた場合は重みを作り直し、
+ 同じキーのディレクトリに別の名前で追加する(保存済みの重みは削除しないので、並列処理中の他のプロセスが読み込み中でも壊れない)
+*Nearestは線形の重みで表せないため未対応(Make_CAPPI_NEXRAD.py側でpyartを使用する)
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 複数変数をまとめて内挿し、指定した配列に直接書き込むよう変更 2026.10.18
+ver 1.2 レイの並び順、角度の比較、ゲート座標の計算をnexrad_geom.pyと共通化 2026.10.18
+ver 1.3 レイ数・ゲート数の組ごとに保存先を分け、重みを作り直したときも保存済みの重みを削除しないよう変更
+        (720/721レイのボリュームが交互に来ると毎回作り直していた。並列処理で読み込み中の重みが削除されることがあった)
+        ver 1.2以前の保存先(wcache_dir/キー/に直接保存した重み)は使われないので削除してよい 2026.10.18
+"""
+
+import numpy as np
+import pyart
+from scipy import sparse
+from os import makedirs, rename, listdir, getpid
+from os.path import exists
+import time
+import hashlib
+import nexrad_geom
+
+#読み込み済みの重み(同一プロセス内で使い回す。{キー: [(重み行列, ゲート配置), ...]})
+_weights_loaded = {}
+
+#%%
+#Weight_Func: 距離の2乗から内挿の重みを計算する(pyartの_gate_to_grid_map.pyxと同じ式)
+def Weight_Func(dist2, roi2, interp_method):
+    if interp_method == 'Cressman':
+        return (roi2 - dist2) / (roi2 + dist2)
+    elif interp_method == 'Barnes':
+        return np.exp(-dist2 / (2 * roi2)) + 1e-5
+    elif interp_method == 'Barnes2':
+        return np.exp(-dist2 / (roi2 / 4)) + 1e-5
+    else:
+        raise ValueError(f'interp_method "{interp_method}" is not supported by cappi_wcache')
+
+#%%
+#Grid_Params: グリッドの始点と間隔を求める(pyart.map.gates_to_gridの_find_grid_paramsと同じ)
+def Grid_Params(grid_shape, grid_limits):
+    starts = []
+    steps = []
+    for n, lim in zip(grid_shape, grid_limits):
+        starts.append(float(lim[0]))
+        steps.append(0. if n == 1 else (lim[1] - lim[0]) / (n - 1.))
+    return starts, steps
+
+#%%
+#Sweep_Geometry: スイープごとに方位角順に並べたレイの順番と、その方位角・仰角を返す
+def Sweep_Geometry(radar):
+    order = []
+    nrays = []
+    for s in range(radar.nsweeps):
+        order.append(nexrad_geom.Sweep_Order(radar, s))
+        nrays.append(len(order[-1]))
+    order = np.concatenate(order)
+    geom = {'nrays': np.array(nrays, dtype=np.int32),
+            'azimuth': radar.azimuth['data'][order].astype(np.float32),
+            'elevation': radar.elevation['data'][order].astype(np.float32),
+            'range': radar.range['data'].astype(np.float32)}
+    return order, geom
+
+#%%
+#Check_Geometry: 保存済みの重みが今回のボリュームに使えるか判定する
+def Check_Geometry(geom, geom_saved, tol_az, tol_el):
+    if not np.array_equal(geom['nrays'], geom_saved['nrays']):
+        return False
+    if geom['range'].shape != geom_saved['range'].shape or not np.allclose(geom['range'], geom_saved['range']):
+        return False
+    return nexrad_geom.Match_Angles(geom['azimuth'], geom['elevation'], geom_saved['azimuth'], geom_saved['elevation'],
+                                    tol_az, tol_el)
+
+#%%
+#Make_Weights: ゲート→グリッドの重み行列(ngrid x ngate, CSC形式)を作成する
+def Make_Weights(radar, order, grid_shape, grid_limits, roi, interp_method, chunk=200000):
+    starts, steps = Grid_Params(grid_shape, grid_limits)
+    roi = np.float32(roi)
+    roi2 = roi * roi
+    nz, ny, nx = grid_shape
+
+    #方位角順に並べたゲートの座標(グリッド始点を原点とする)
+    gx, gy, gz = nexrad_geom.Gate_XYZ(radar, order)
+    gz = (gz.ravel() - starts[0]).astype(np.float32)
+    gy = (gy.ravel() - starts[1]).astype(np.float32)
+    gx = (gx.ravel() - starts[2]).astype(np.float32)
+    ngate = len(gz)
+
+    #影響円に含まれうるグリッド番号の範囲(pyartのfind_min/find_maxと同じ)
+    def index_range(a, step, n):
+        if step == 0:
+            return np.zeros(len(a), dtype=np.int32), np.zeros(len(a), dtype=np.int32), 1
+        imin = np.maximum(np.ceil((a - roi) / step), 0).astype(np.int32)
+        imax = np.minimum(np.floor((a + roi) / step), n - 1).astype(np.int32)
+        return imin, imax, int(np.floor(2 * roi / step)) + 2
+
+    blocks = []
+    for c0 in range(0, ngate, chunk):
+        c1 = min(c0 + chunk, ngate)
+        z, y, x = gz[c0:c1], gy[c0:c1], gx[c0:c1]
+        zmin, zmax, kz = index_range(z, steps[0], nz)
+        ymin, ymax, ky = index_range(y, steps[1], ny)
+        xmin, xmax, kx = index_range(x, steps[2], nx)
+        rows, cols, wgts = [], [], []
+        gidx = np.arange(c1 - c0, dtype=np.int32)
+        for dz in range(kz):
+            iz = zmin + dz
+            vz = iz <= zmax
+            for dy in range(ky):
+                iy = ymin + dy
+                vzy = vz & (iy <= ymax)
+                if not vzy.any(): continue
+                for dx in range(kx):
+                    ix = xmin + dx
+                    v = vzy & (ix <= xmax)
+                    if not v.any(): continue
+                    dist2 = ((np.float32(steps[2]) * ix[v] - x[v])**2 +
+                             (np.float32(steps[1]) * iy[v] - y[v])**2 +
+                             (np.float32(steps[0]) * iz[v] - z[v])**2)
+                    inroi = dist2 <= roi2
+                    if not inroi.any(): continue
+                    rows.append(((iz[v] * ny + iy[v]) * nx + ix[v])[inroi])
+                    cols.append(gidx[v][inroi])
+                    wgts.append(Weight_Func(dist2[inroi], roi2, interp_method).astype(np.float32))
+        if len(rows) == 0:
+            blocks.append(sparse.csc_matrix((nz*ny*nx, c1 - c0), dtype=np.float32))
+            continue
+        blocks.append(sparse.csc_matrix((np.concatenate(wgts), (np.concatenate(rows), np.concatenate(cols))),
+                                        shape=(nz*ny*nx, c1 - c0), dtype=np.float32))
+    return sparse.hstack(blocks, format='csc', dtype=np.float32)
+
+#%%
+#Cache_Key: サイト、VCP、グリッド設定と、スイープごとのレイ数・ゲート数(geom)から保存名を決める
+def Cache_Key(radar, grid_shape, grid_limits, roi, interp_method, geom):
+    site = radar.metadata.get('instrument_name', 'XXXX')
+    vcp = radar.metadata.get('vcp_pattern', 0)
+    spec = repr((tuple(grid_shape), tuple(tuple(float(v) for v in l) for l in grid_limits), float(roi), interp_method))
+    layout = repr((tuple(int(n) for n in geom['nrays']), len(geom['range'])))
+    return f'{site}_vcp{vcp}_' + hashlib.md5(spec.encode()).hexdigest()[:10] + '_' + hashlib.md5(layout.encode()).hexdigest()[:6]
+
+#%%
+#Save_Weights: 重み行列とゲート配置をkeydirに新しい名前で保存し、保存先を返す
+#(一時ディレクトリに書いてから改名するので、他のプロセスから書き込み途中の重みは見えない。既存の重みは削除しない)
+def Save_Weights(keydir, W, geom):
+    name = f'w{int(time.time())}_{getpid()}'
+    tmpdir = keydir + '/.tmp_' + name
+    makedirs(tmpdir, exist_ok=True)
+    np.save(tmpdir + '/data.npy', W.data)
+    np.save(tmpdir + '/indices.npy', W.indices)
+    np.save(tmpdir + '/indptr.npy', W.indptr)
+    np.save(tmpdir + '/shape.npy', np.array(W.shape, dtype=np.int64))
+    for k, v in geom.items():
+        np.save(tmpdir + f'/geom_{k}.npy', v)
+    rename(tmpdir, keydir + '/' + name)
+    return keydir + '/' + name
+
+#%%
+#Load_Weights: 保存済みの重み行列とゲート配置を読み込む(メモリマップで読むので並列処理でも共有される)
+def Load_Weights(savedir):
+    data = np.load(savedir + '/data.npy', mmap_mode='r')
+    indices = np.load(savedir + '/indices.npy', mmap_mode='r')
+    indptr = np.load(savedir + '/indptr.npy', mmap_mode='r')
+    shape = tuple(np.load(savedir + '/shape.npy'))
+    W = sparse.csc_matrix((data, indices, indptr), shape=shape, copy=False)
+    geom = {k: np.load(savedir + f'/geom_{k}.npy') for k in ('nrays', 'azimuth', 'elevation', 'range')}
+    return W, geom
+
+#Find_Weights: keydirに保存済みの重みから、今回のボリュームに使えるものを探して読み込む(なければNone)
+def Find_Weights(keydir, geom, tol_az, tol_el):
+    if not exists(keydir):
+        return None
+    for name in sorted(listdir(keydir)):
+        if name.startswith('.'): continue #書き込み中の一時ディレクトリ
+        try:
+            W, geom_saved = Load_Weights(keydir + '/' + name)
+        except (OSError, ValueError): #壊れたファイルなど
+            continue
+        if Check_Geometry(geom, geom_saved, tol_az, tol_el):
+            return W, geom_saved
+    return None
+
+#%%
+#Get_Weights: 重み行列を取得する(保存済みで使えるものがあれば読み込み、なければ作成して保存)
+def Get_Weights(radar, grid_shape, grid_limits, roi, cachedir, interp_method='Cressman',
+                tol_az=0.25, tol_el=0.1):
+    ##Return: (重み行列[ngrid x ngate], レイの並び順)
+    order, geom = Sweep_Geometry(radar)
+    key = Cache_Key(radar, grid_shape, grid_limits, roi, interp_method, geom)
+    keydir = cachedir + '/' + key
+
+    for W, geom_saved in _weights_loaded.get(key, []):
+        if Check_Geometry(geom, geom_saved, tol_az, tol_el):
+            return W, order
+    found = Find_Weights(keydir, geom, tol_az, tol_el)
+    if found is None:
+        if exists(keydir): print('Sweep geometry changed. Interpolation weights are recomputed')
+        W = Make_Weights(radar, order, grid_shape, grid_limits, roi, interp_method)
+        makedirs(keydir, exist_ok=True)
+        found = Find_Weights(keydir, geom, tol_az, tol_el) #作成中に他のプロセスが保存した場合はそれを使う
+        if found is None:
+            savedir = Save_Weights(keydir, W, geom)
+            print('Interpolation weights saved to ' + savedir)
+            found = (W, geom)
+    _weights_loaded.setdefault(key, []).append(found)
+    return found[0], order
+
+#%%
+#Grid_Fields: 重み行列を用いてレーダーの複数の変数を1回の行列積でグリッドに内挿する
+def Grid_Fields(radar, W, order, fields, out, gatefilter=None, undef=-9999.):
+    ##out: 結果を書き込むfloat32配列(変数,z,y,x)。影響円内に有効なゲートがないグリッドはundef
+    ##Return: out
+    nvar = len(fields)
+    ngate = W.shape[1]
+    if gatefilter is not None:
+        valid_gate = ~gatefilter.gate_excluded[order].ravel()
+    else:
+        valid_gate = np.ones(ngate, dtype=bool)
+
+    #全変数の値と有効フラグを(ゲート,変数)の配列にまとめる
+    val = np.empty((ngate, nvar), dtype=np.float32)
+    valid = np.empty((ngate, nvar), dtype=np.float32)
+    for v in range(nvar):
+        fdata = radar.fields[fields[v]]['data']
+        vmask = valid_gate & ~np.ma.getmaskarray(fdata)[order].ravel()
+        valid[:, v] = vmask
+        val[:, v] = np.ma.getdata(fdata)[order].ravel()
+        val[~vmask, v] = 0.
+
+    vsum = W @ val   #(グリッド,変数)
+    wsum = W @ valid
+    del val, valid
+
+    out2d = out.reshape(nvar, -1)
+    np.divide(vsum.T, wsum.T, out=out2d, where=wsum.T > 0)
+    out2d[wsum.T == 0] = undef
+    return out
+
+#%%
+#Get_LonLat: グリッドの経度・緯度(レーダー中心の正距方位図法, pyartのGridと同じ)を求める
+def Get_LonLat(radar, grid_shape, grid_limits):
+    y = np.linspace(grid_limits[1][0], grid_limits[1][1], grid_shape[1])
+    x = np.linspace(grid_limits[2][0], grid_limits[2][1], grid_shape[2])
+    x, y = np.meshgrid(x, y)
+    lon0 = radar.longitude['data'][0]
+    lat0 = radar.latitude['data'][0]
+    lons, lats = pyart.core.cartesian_to_geographic_aeqd(x, y, lon0, lat0)
+    return lons, lats
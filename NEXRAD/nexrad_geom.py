@@ -0,0 +1,113 @@
+"""
+nexrad_geom.py ver 1.0
+スイープのゲート座標とビーム高度の円(リング)の距離を計算・キャッシュするモジュール
+Draw_NEXRAD_Level2.py、cappi_wcache.py(Make_CAPPI_NEXRAD.py)から呼び出して使用する
+
+同じサイト・VCPではスイープの仰角、ゲート配置、レイ数は変わらないため、
+(サイト, 仰角, ゲート配置, レイ数)をキーとしてゲート座標(pcolormesh用の格子点)とリングの距離を保存し、
+以降のスイープ・ファイルで使い回す。
+*レイは方位角順に並べて保存する(ファイルによってスイープの開始方位角が異なるため)
+*方位角・仰角が保存時からtol_az, tol_el [deg.]以上ずれた場合は計算し直す
+*座標はpyart(antenna_vectors_to_cartesian)と同じ4/3有効地球半径モデルで計算する
+*ビーム高度がh kmになる距離は4/3有効地球半径モデルのビーム高度の式を距離について解いて求める
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 地表面に沿った距離からスラントレンジを求める関数(Slant_Range)を追加(nexrad_quicklook.py用) 2026.10.18
+"""
+
+import numpy as np
+from pyart.core.transforms import antenna_vectors_to_cartesian
+
+ER_KM = 6371.0 * 4.0 / 3.0 #等価地球半径(km, pyartと同じ)
+
+#読み込み済みのスイープの座標(同一プロセス内で使い回す)
+_geom_cache = {}
+
+#%%
+#Beam_Height: レーダーからの距離(スラントレンジ)rng kmでのビーム中心の高度(km)
+def Beam_Height(rng, el, anthgt):
+    ##rng: スラントレンジ(km)、el: 仰角(deg.)、anthgt: アンテナ高度(km)
+    sinel = np.sin(np.deg2rad(el))
+    return np.sqrt(rng**2 + ER_KM**2 + 2.0 * rng * ER_KM * sinel) - ER_KM + anthgt
+
+#Ground_Range: スラントレンジrng kmに対応する地表面に沿った距離(km, pyartの描画座標の距離)
+def Ground_Range(rng, el, anthgt):
+    z = Beam_Height(rng, el, anthgt) - anthgt
+    return ER_KM * np.arcsin(rng * np.cos(np.deg2rad(el)) / (ER_KM + z))
+
+#Slant_Range: 地表面に沿った距離ground km(仰角el)に対応するスラントレンジ(km, Ground_Rangeの逆関数)
+def Slant_Range(ground, el):
+    phi = ground / ER_KM #地球中心から見た角度
+    return ER_KM * np.sin(phi) / np.cos(np.deg2rad(el) + phi)
+
+#%%
+#Dis_AtAlt: ビーム高度がh kmになる地表面に沿った距離(km)をビーム高度の式から直接求める
+def Dis_AtAlt(h, anthgt, el, farthest):
+    ##h: ビーム高度(km, 1d-array)、anthgt: アンテナ高度(km)、el: 仰角(deg.)
+    ##farthest: レーダーから最も遠いゲートまでの距離(km)。h kmに届かない場合はfarthest、アンテナより低い場合は0
+    ##Return: 距離(km, numpy 1d-array)
+    dh = np.asarray(h, dtype=np.float64) - anthgt
+    sinel = np.sin(np.deg2rad(el))
+    #(ER_KM+dh)^2 = rng^2 + ER_KM^2 + 2*rng*ER_KM*sin(el) をrngについて解く
+    disc = np.maximum((ER_KM * sinel)**2 + dh * (2.0 * ER_KM + dh), 0.)
+    rng = np.clip(np.sqrt(disc) - ER_KM * sinel, 0., farthest)
+    return Ground_Range(rng, el, anthgt)
+
+#%%
+#Sweep_Order: スイープsのレイを方位角順に並べた番号(レイ番号)を返す
+def Sweep_Order(radar, s):
+    i0 = radar.sweep_start_ray_index['data'][s]
+    i1 = radar.sweep_end_ray_index['data'][s] + 1
+    return i0 + np.argsort(radar.azimuth['data'][i0:i1], kind='stable')
+
+#Match_Angles: 方位角・仰角が保存時からtol_az, tol_el [deg.]以内ならTrue
+def Match_Angles(az, el, az_saved, el_saved, tol_az, tol_el):
+    if az.shape != az_saved.shape:
+        return False
+    daz = np.abs(az - az_saved)
+    daz = np.minimum(daz, 360. - daz)
+    if daz.max() > tol_az:
+        return False
+    return np.abs(el - el_saved).max() <= tol_el
+
+#%%
+#Gate_XYZ: 指定したレイの各ゲートの座標(m)を返す(radar.gate_x, gate_y, gate_zを1度の計算で求める)
+def Gate_XYZ(radar, rays, edges=False):
+    return antenna_vectors_to_cartesian(radar.range['data'], radar.azimuth['data'][rays],
+                                        radar.elevation['data'][rays], edges=edges)
+
+#%%
+#Get_Sweep_Geometry: スイープsの座標(方位角順)を取得する(保存済みで使えるものがあれば使い回す)
+def Get_Sweep_Geometry(radar, s, tol_az=0.1, tol_el=0.1, max_entries=4):
+    ##Return: 辞書 order: スイープ内のレイの並び順(0始まり)、x, y: pcolormesh用の格子点(km, レイ+1 x ゲート+1)
+    ##        rings: リングの距離を保存する辞書(Get_Ringsで使用)
+    ##*同じ座標を使い回した場合は同じ辞書を返す
+    rays = Sweep_Order(radar, s)
+    rng = radar.range['data']
+    site = radar.metadata.get('instrument_name', 'XXXX')
+    key = (site, round(float(radar.fixed_angle['data'][s]), 2), len(rng), float(rng[0]), float(rng[-1]), len(rays))
+    az = radar.azimuth['data'][rays]
+    el = radar.elevation['data'][rays]
+
+    #同じ仰角のスイープが複数ある(split cut)場合があるので、キーごとに最大max_entries個保存する
+    entries = _geom_cache.setdefault(key, [])
+    for geom in entries:
+        if Match_Angles(az, el, geom['azimuth'], geom['elevation'], tol_az, tol_el):
+            return geom
+    x, y, _ = Gate_XYZ(radar, rays, edges=True)
+    geom = {'order': rays - radar.sweep_start_ray_index['data'][s], 'azimuth': az, 'elevation': el,
+            'x': x / 1000., 'y': y / 1000., 'rings': {}}
+    entries.insert(0, geom)
+    del entries[max_entries:]
+    return geom
+
+#%%
+#Get_Rings: ビーム高度がheights kmになる距離(km)を返す(スイープの座標と一緒に保存する)
+def Get_Rings(radar, s, heights, geom=None):
+    if geom is None: geom = Get_Sweep_Geometry(radar, s)
+    hkey = tuple(float(h) for h in heights)
+    if hkey not in geom['rings']:
+        geom['rings'][hkey] = Dis_AtAlt(heights, radar.altitude['data'][0] / 1000.,
+                                        float(radar.fixed_angle['data'][s]), radar.range['data'][-1] / 1000.)
+    return geom['rings'][hkey]
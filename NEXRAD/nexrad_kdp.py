@@ -0,0 +1,146 @@
+"""
+nexrad_kdp.py ver 1.0
+偏波間位相差変化率(Kdp)をVulpiani et al.(2012)の方法で高速に計算するモジュール
+Make_CAPPI_NEXRAD.pyから呼び出して使用する
+
+pyart.retrieve.kdp_vulpiani(prefilter_psidp=True)と同じ計算を、1レイずつではなく
+複数のレイをまとめた(レイ,ゲート)配列で行い、スイープごとに並列(スレッド)で処理する。
+さらにgatefilterを指定した場合は、gatefilterを通るゲートを含むレイだけを、
+通るゲートの最遠点から計算に影響する範囲(margin)までに限って計算する(それ以外のゲートは欠損値)。
+*計算の順序と精度(float32/float64)はpyartと同じにしているので、gatefilterを通るゲートの値はpyartの結果と一致する
+ (Bench_NEXRAD.pyのkdp_fastで差を確認できる)
+*メディアンフィルタ(scipy.signal.medfilt)は欠損値(NaN)を含む場合の結果がレイの処理順に依存するため、
+ pyartと同じくレイごとに適用する
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+"""
+
+import numpy as np
+from scipy import signal
+from concurrent.futures import ThreadPoolExecutor
+import pyart
+
+#Kdpの閾値(下限, 上限, テクスチャの上限)。pyart.retrieve.kdp_procと同じ
+KDP_THRESHOLDS = {'X': (-2.0, 40.0, 5.0), 'C': (-2.0, 20.0, 5.0), 'S': (-2.0, 14.0, 5.0)}
+
+#%%
+#Filter_Psidp: 偏波間位相差の前処理(pyart.retrieve.filter_psidpと同じ処理を(レイ,ゲート)配列で行う)
+def Filter_Psidp(psidp, rhohv, minsize_seq=5, median_filter_size=7, thresh_rhohv=0.65, max_discont=90):
+    ##psidp, rhohv: (レイ,ゲート)のmasked array
+    ##Return: フィルタ後の偏波間位相差(masked array)
+    nray, ngate = psidp.shape
+    valid = ~np.ma.getmaskarray(psidp)
+    mask = np.ma.getdata(rhohv < thresh_rhohv) | ~valid
+
+    #有効なゲートだけをつないでレイ方向にunwrap(np.unwrapと同じ計算)
+    p = np.deg2rad(np.ma.getdata(psidp))
+    idx = np.where(valid, np.arange(ngate), -1)
+    prev = np.maximum.accumulate(idx, axis=1)
+    prev = np.concatenate([np.full((nray,1), -1), prev[:,:-1]], axis=1) #1つ手前の有効なゲート
+    has_prev = valid & (prev >= 0)
+    dd = np.zeros_like(p)
+    r, _ = np.nonzero(has_prev)
+    dd[has_prev] = p[has_prev] - p[r, prev[has_prev]]
+    ddmod = np.mod(dd + np.pi, 2*np.pi) - np.pi
+    np.copyto(ddmod, np.pi, where=(ddmod == -np.pi) & (dd > 0))
+    ph_correct = ddmod - dd
+    np.copyto(ph_correct, 0, where=abs(dd) < np.deg2rad(max_discont))
+    ph_correct[~has_prev] = 0
+    psi = np.where(valid, np.rad2deg(p + np.cumsum(ph_correct, axis=1)), np.nan).astype(p.dtype)
+
+    #有効なゲートが連続してminsize_seq個以下の区間を除く
+    start = valid & ~np.concatenate([np.zeros((nray,1), bool), valid[:,:-1]], axis=1)
+    run = (np.cumsum(start.ravel()) * valid.ravel()).reshape(nray, ngate)
+    short = np.bincount(run.ravel()) <= minsize_seq
+    short[0] = False
+    mask |= short[run]
+
+    #メディアンフィルタ(最後の有効なゲートまで。両端はNaNで埋める)
+    psidp_filt = np.zeros((nray, ngate))
+    last = np.where(valid.any(axis=1), ngate - 1 - np.argmax(valid[:,::-1], axis=1), -1)
+    for i in np.nonzero(last >= 0)[0]:
+        row = np.pad(psi[i,:last[i]+1], (1,1), 'constant', constant_values=(np.nan,))
+        psidp_filt[i,:last[i]+1] = signal.medfilt(row, median_filter_size)[1:-1]
+    return np.ma.masked_array(psidp_filt, mask=mask)
+
+#%%
+#Kdp_Rays: Vulpianiの方法でKdpを計算する(pyart.retrieve.kdp_proc._kdp_vulpiani_profileを(レイ,ゲート)配列で行う)
+def Kdp_Rays(psidp, dr, windsize=10, band='S', n_iter=10):
+    ##psidp: (レイ,ゲート)のmasked array、dr: ゲート間隔(m)
+    ##Return: Kdp(deg/km, masked array)
+    th1, th2, std_th = KDP_THRESHOLDS[band.upper()]
+    size = windsize
+    l2 = int(size / 2)
+    drm = dr / 1000.0
+    nn = psidp.shape[1]
+    mask = np.ma.getmaskarray(psidp)
+    psi = np.ma.filled(psidp, np.nan)
+
+    #初期値
+    kdp = np.zeros(psi.shape)
+    kdp[:,l2:nn-l2] = (psi[:,size:nn] - psi[:,0:nn-size]) / (2.0 * size * drm)
+    kdp[:,0:l2] = 0.0
+    kdp[:,nn-l2:] = 0.0
+    kdp[kdp <= th1] = 0.0
+    kdp[kdp >= th2] = 0.0
+    kdp[np.isnan(kdp)] = 0.0
+
+    #テクスチャ(前後l2ゲートの標準偏差)が大きいゲートを除く
+    tex = np.zeros(psi.shape)
+    tex[:,l2:-l2] = np.std(np.lib.stride_tricks.sliding_window_view(kdp, l2*2+1, axis=1), axis=-1)
+    kdp[tex > std_th] = 0.0
+
+    #反復計算
+    for _ in range(n_iter):
+        phidp_rec = np.cumsum(kdp, axis=1) * 2.0 * drm
+        kdp[:,l2:nn-l2] = (phidp_rec[:,size:nn] - phidp_rec[:,0:nn-size]) / (2.0 * size * drm)
+        kdp[:,0:l2] = 0.0
+        kdp[:,nn-l2:] = 0.0
+        kdp[kdp <= th1] = 0.0
+        kdp[kdp >= th2] = 0.0
+    return np.ma.masked_where(mask, kdp)
+
+#%%
+#Kdp_Vulpiani: RadarオブジェクトからKdpを計算し、pyartのフィールド形式(辞書)で返す
+def Kdp_Vulpiani(radar, gatefilter=None, psidp_field='differential_phase', rhohv_field='cross_correlation_ratio',
+                 band='S', windsize=10, n_iter=10, prefilter_psidp=True, nthreads=1):
+    ##gatefilter: 指定した場合、gatefilterを通るゲートのKdpだけを計算する
+    ##nthreads: スイープを並列に処理するスレッド数
+    if windsize % 2:
+        windsize = 10 #pyartと同じく偶数以外は10にする
+    dr = np.diff(radar.range['data'], n=1)[0]
+    psidp = radar.fields[psidp_field]['data']
+    rhohv = radar.fields[rhohv_field]['data'] if prefilter_psidp else None
+    ngate = radar.ngates
+    if gatefilter is None:
+        use = np.ones((radar.nrays, ngate), bool)
+        margin = ngate
+    else:
+        use = ~gatefilter.gate_excluded
+        #計算に影響する範囲(差分・テクスチャ・反復計算の窓、メディアンフィルタ、短い区間の判定)
+        margin = (n_iter + 2) * (windsize // 2) + 7 + 5
+
+    kdp = np.ma.masked_all((radar.nrays, ngate))
+    def sweep_kdp(s):
+        rays = np.arange(radar.sweep_start_ray_index['data'][s], radar.sweep_end_ray_index['data'][s] + 1)
+        rays = rays[use[rays].any(axis=1)]
+        if len(rays) == 0:
+            return
+        ncol = min(ngate, int(np.nonzero(use[rays].any(axis=0))[0][-1]) + 1 + margin)
+        psi = psidp[rays,:ncol]
+        if prefilter_psidp:
+            psi = Filter_Psidp(psi, rhohv[rays,:ncol])
+        k = Kdp_Rays(psi, dr, windsize, band, n_iter)
+        kdp[rays,:ncol] = np.ma.masked_where(~use[rays,:ncol], k)
+
+    if nthreads <= 1:
+        for s in range(radar.nsweeps): sweep_kdp(s)
+    else:
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(sweep_kdp, range(radar.nsweeps)))
+
+    kdp.set_fill_value(pyart.config.get_fillvalue())
+    kdp_dict = pyart.config.get_metadata('specific_differential_phase')
+    kdp_dict['data'] = kdp
+    return kdp_dict
@@ -0,0 +1,209 @@
+"""
+nexrad_l2reader.py ver 1.0
+NEXRAD Level-IIデータから必要なスイープ(仰角)と変数(モーメント)だけを読み出すモジュール
+Make_CAPPI_NEXRAD.py、Draw_NEXRAD_Level2.py、Get_ELinfo_NEXRAD.pyから呼び出して使用する
+
+Level-IIファイル(LDM形式)は約120レイごとにbzip2で圧縮されたレコードが並んでいる。
+各レコードの先頭のレイの仰角番号だけを先に展開して調べ、必要なスイープを含むレコードだけを全て展開する。
+展開したレコードを非圧縮のLevel-IIファイルとしてpyart.io.read_nexrad_archiveに渡し、
+指定した変数だけを遅延読み込み(delay_field_loading)でRadarオブジェクトにする。
+*スイープ番号(scans)はpyart.io.read_nexrad_archiveやRadar.extract_sweepsと同じ0始まりの番号
+*非圧縮のLevel-IIファイルの場合はスイープの選択による展開の省略は行わない(変数の選択は有効)
+
+ヘッダ情報だけを読む場合(Read_Header)は、最初のレコード(メタデータ)と各レコードの先頭のレイだけを展開し、
+サイト、時刻、VCP、各スイープの仰角・モーメント・ゲート数を返す(Make_Catalog_NEXRAD.py、Get_ELinfo_NEXRAD.py用)。
+*各スイープは複数のレコードにまたがる(1レコード約120レイ)ため、レコードの先頭のレイだけで全スイープの情報が得られる
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 ヘッダ情報(サイト、時刻、VCP、仰角、モーメント、ゲート数)だけを読み出すRead_Headerを追加 2026.10.18
+ver 1.2 ファイル名の代わりにファイルの中身(bytes)も渡せるよう変更(ダウンロードしたデータをメモリから読む場合用)、
+        gzipで圧縮されたファイル(AWSの古いデータ)に対応 2026.10.18
+"""
+
+import bz2
+import gzip
+import struct
+import datetime
+from io import BytesIO
+import pyart
+
+#Level-IIファイルの構造(Interface Control Document for the Archive II/User, pyart.io.nexrad_level2と同じ)
+VOLUME_HEADER_SIZE = 24  #ボリュームヘッダ
+CONTROL_WORD_SIZE = 4    #各圧縮レコードの先頭のサイズ情報
+CTM_SIZE = 12            #各メッセージの前の12バイト
+MSG_HEADER_SIZE = 16     #メッセージヘッダ
+PEEK_SIZE = CTM_SIZE + MSG_HEADER_SIZE + 32 #先頭のレイの仰角番号までのバイト数
+RECORD_SIZE = 2432       #MSG31以外のメッセージの大きさ
+
+#Py-ARTの変数名とNEXRADのモーメント名の対応
+MOMENTS = {'reflectivity': 'REF', 'velocity': 'VEL', 'spectrum_width': 'SW',
+           'differential_reflectivity': 'ZDR', 'differential_phase': 'PHI',
+           'cross_correlation_ratio': 'RHO', 'clutter_filter_power_removed': 'CFP'}
+
+#%%
+#Split_Records: LDM形式のLevel-IIファイルを圧縮レコードごとに分割する
+def Split_Records(buf):
+    ##Return: 各圧縮レコードの(開始位置, 終了位置)のリスト
+    records = []
+    pos = VOLUME_HEADER_SIZE
+    while pos + CONTROL_WORD_SIZE <= len(buf):
+        size = abs(int.from_bytes(buf[pos:pos+CONTROL_WORD_SIZE], 'big', signed=True))
+        if size == 0: break
+        records.append((pos + CONTROL_WORD_SIZE, pos + CONTROL_WORD_SIZE + size))
+        pos += CONTROL_WORD_SIZE + size
+    return records
+
+#%%
+#Peek_Elevation: 展開したレコードの先頭部分から先頭のレイの仰角番号を読む(MSG31以外ならNone)
+def Peek_Elevation(head):
+    if len(head) < PEEK_SIZE:
+        return None
+    if head[CTM_SIZE + 3] != 31:
+        return None
+    return head[CTM_SIZE + MSG_HEADER_SIZE + 22]
+
+#%%
+#Decompress_Selected: 指定したスイープを含むレコードだけを展開し、非圧縮のLevel-IIデータとして返す
+def Decompress_Selected(buf, scans=None):
+    if buf[VOLUME_HEADER_SIZE+CONTROL_WORD_SIZE:VOLUME_HEADER_SIZE+CONTROL_WORD_SIZE+2] != b'BZ':
+        return buf #非圧縮ファイル
+
+    wanted = None if scans is None else set(s + 1 for s in scans) #MSG31の仰角番号は1始まり
+    out = bytearray(buf[:VOLUME_HEADER_SIZE])
+    nskip = 0
+
+    #レコードkを展開するかどうかは、kとk+1の先頭の仰角番号の間に必要な仰角番号があるかで判断する
+    def finish(rec, elev_next):
+        nonlocal nskip
+        dec, head, elev = rec
+        if wanted is None or elev is None:
+            keep = True
+        else:
+            hi = 255 if elev_next is None else elev_next
+            keep = any(elev <= w <= hi for w in wanted)
+        if keep:
+            out.extend(head)
+            out.extend(dec.decompress(b''))
+        else:
+            nskip += 1
+
+    prev = None
+    for start, end in Split_Records(buf):
+        dec = bz2.BZ2Decompressor()
+        head = dec.decompress(buf[start:end], max_length=PEEK_SIZE)
+        elev = Peek_Elevation(head)
+        if prev is not None: finish(prev, elev)
+        prev = (dec, head, elev)
+    if prev is not None: finish(prev, None)
+
+    #pyartは非圧縮ファイルの最初の12バイト(CTM)の4-6バイト目でファイル形式を判定するため0にする
+    out[VOLUME_HEADER_SIZE+4:VOLUME_HEADER_SIZE+6] = b'\x00\x00'
+    return bytes(out)
+
+#%%
+#Read_Bytes: ファイルの中身を返す(fnameがbytesならそのまま使う。gzipで圧縮されている場合は展開する)
+def Read_Bytes(fname):
+    if isinstance(fname, (bytes, bytearray, memoryview)):
+        buf = bytes(fname)
+    else:
+        with open(fname, 'rb') as fp:
+            buf = fp.read()
+    if buf[:2] == b'\x1f\x8b':
+        buf = gzip.decompress(buf)
+    return buf
+
+#%%
+#Read_Level2: 指定したスイープと変数だけを読み出したpyartのRadarオブジェクトを返す
+def Read_Level2(fname, scans=None, fields=None):
+    ##fname: ファイル名またはファイルの中身(bytes)
+    ##scans: 読み出すスイープ番号のリスト(Noneなら全て)
+    ##fields: 読み出す変数名(Py-ARTの変数名)のリスト(Noneなら全て、[]なら変数なし)
+    buf = Decompress_Selected(Read_Bytes(fname), scans)
+    if scans is not None: scans = list(scans)
+    if fields is not None: fields = list(fields)
+    return pyart.io.read_nexrad_archive(BytesIO(buf), scans=scans, include_fields=fields,
+                                        delay_field_loading=True)
+
+#%%
+#Scan_Messages: 展開済みのメッセージ列を先頭から調べ、(メッセージ種別, 開始位置)を順に返す
+def Scan_Messages(data, pos=0):
+    while pos + CTM_SIZE + MSG_HEADER_SIZE <= len(data):
+        size, mtype = struct.unpack_from('>HxB', data, pos + CTM_SIZE)
+        yield mtype, pos
+        pos += CTM_SIZE + size * 2 if mtype == 31 and size > 0 else RECORD_SIZE
+
+#Parse_Msg31: MSG31(1レイ)のヘッダ部分から仰角番号、仰角、時刻、サイト位置、VCP、モーメントの情報を読む
+def Parse_Msg31(data, pos):
+    b = pos + CTM_SIZE + MSG_HEADER_SIZE
+    (site, ms, date, _, _, _, _, _, _, _, elev_num, _, elev, _, _, nblock) = \
+        struct.unpack_from('>4sIHHfBBHBBBBfBbH', data, b)
+    ray = {'site': site.decode('ascii', 'replace').strip(), 'elev_num': elev_num, 'elevation': elev,
+           'time': datetime.datetime(1970, 1, 1) + datetime.timedelta(days=date - 1, milliseconds=ms),
+           'moments': {}}
+    for p in struct.unpack_from(f'>{min(nblock, 10)}I', data, b + 32):
+        if p == 0 or b + p + 14 > len(data): continue
+        name = data[b+p:b+p+4].decode('ascii', 'replace')
+        if name == 'RVOL':
+            ray['lat'], ray['lon'], hgt, feedhorn = struct.unpack_from('>ffhH', data, b + p + 8)
+            ray['height'] = hgt + feedhorn #アンテナの高度(pyartのaltitudeと同じ)
+            ray['vcp'], = struct.unpack_from('>H', data, b + p + 40)
+        elif name[0] == 'D':
+            ngates, first, spacing = struct.unpack_from('>Hhh', data, b + p + 8)
+            ray['moments'][name[1:].strip()] = (ngates, first, spacing)
+    return ray
+
+#Parse_Msg5: MSG5(VCP)からVCP番号と各仰角番号の仰角(deg.)を読む
+def Parse_Msg5(data, pos):
+    b = pos + CTM_SIZE + MSG_HEADER_SIZE
+    _, _, vcp, ncuts = struct.unpack_from('>HHHH', data, b)
+    cuts = [struct.unpack_from('>H', data, b + 22 + 46 * i)[0] * 360. / 65536. for i in range(ncuts)]
+    return vcp, cuts
+
+#%%
+#Read_Header: ヘッダ情報だけを読み出す(レイのデータは展開しない)
+def Read_Header(fname):
+    ##fname: ファイル名またはファイルの中身(bytes)
+    ##Return: 辞書 site, time(最初のレイの時刻, datetime UTC), vcp, lat, lon, height(m)
+    ##        sweeps: スイープ番号順の辞書のリスト scnum(0始まり, Read_Level2のscansと同じ), fixed_angle(MSG5の仰角),
+    ##                elevation(先頭のレイの仰角), moments({モーメント名: (ゲート数, 最初のゲートの距離(m), ゲート間隔(m))})
+    buf = Read_Bytes(fname)
+    rays = []
+    msg5 = None
+    if buf[VOLUME_HEADER_SIZE+CONTROL_WORD_SIZE:VOLUME_HEADER_SIZE+CONTROL_WORD_SIZE+2] == b'BZ':
+        for k, (start, end) in enumerate(Split_Records(buf)):
+            dec = bz2.BZ2Decompressor()
+            if k == 0:
+                #メタデータのレコード(MSG5を含む)は全て展開する
+                data = dec.decompress(buf[start:end])
+                for mtype, pos in Scan_Messages(data):
+                    if mtype == 5 and msg5 is None: msg5 = Parse_Msg5(data, pos)
+                    elif mtype == 31: rays.append(Parse_Msg31(data, pos))
+                continue
+            #その他のレコードは先頭のレイだけを展開する
+            head = dec.decompress(buf[start:end], max_length=PEEK_SIZE)
+            if Peek_Elevation(head) is None: continue
+            size = CTM_SIZE + struct.unpack_from('>H', head, CTM_SIZE)[0] * 2
+            while len(head) < size and not dec.eof:
+                head += dec.decompress(b'', max_length=size - len(head))
+            rays.append(Parse_Msg31(head, 0))
+    else:
+        #非圧縮ファイルは全てのメッセージを順に調べる
+        for mtype, pos in Scan_Messages(buf, VOLUME_HEADER_SIZE):
+            if mtype == 5 and msg5 is None: msg5 = Parse_Msg5(buf, pos)
+            elif mtype == 31: rays.append(Parse_Msg31(buf, pos))
+    if len(rays) == 0:
+        raise ValueError('No MSG31 records found')
+
+    sweeps = {}
+    for ray in rays:
+        if ray['elev_num'] in sweeps: continue
+        e = ray['elev_num'] - 1
+        fixed = msg5[1][e] if msg5 is not None and e < len(msg5[1]) else ray['elevation']
+        sweeps[ray['elev_num']] = {'scnum': e, 'fixed_angle': fixed, 'elevation': ray['elevation'],
+                                   'moments': ray['moments']}
+    first = rays[0]
+    return {'site': first['site'], 'time': first['time'],
+            'vcp': msg5[0] if msg5 is not None else first.get('vcp'),
+            'lat': first.get('lat'), 'lon': first.get('lon'), 'height': first.get('height'),
+            'sweeps': [sweeps[k] for k in sorted(sweeps)]}
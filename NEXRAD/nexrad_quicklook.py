@@ -0,0 +1,154 @@
+"""
+nexrad_quicklook.py ver 1.0
+matplotlib(pcolormesh)を使わずにPPIの簡易画像(quicklook, PNG)を高速に作成するモジュール
+Draw_NEXRAD_Level2.pyから呼び出して使用する
+
+各画素の中心に最も近いレイと、その画素を含むゲートの番号を表(LUT)にしておき、
+スイープの値をLUTで画素に並べ替え、色の境界値で色番号(パレット番号)に変換してパレット付きPNGとして保存する。
+*LUTはスイープの座標(nexrad_geom.Get_Sweep_Geometry)と一緒に保存し、同じ仰角のスイープ・ファイルで使い回す
+*色は指定したカラーマップとnormで各区間の代表値を変換したもの(連続的なカラーマップはnlevels段階に分ける)
+*円(リング)、十字、タイトル、カラーバーはPIL(ImageDraw)で描く
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 座標からゲートの番号を求める部分をGate_Indexに分けた(Webタイル作成用) 2026.10.18
+"""
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from matplotlib.colors import Normalize
+from pyart.graph.common import generate_title
+import nexrad_geom
+
+BG = 0    #背景・欠損値(白)のパレット番号
+LINE = 1  #線・文字(黒)のパレット番号
+TITLE_H = 30 #タイトルの高さ(画素)
+CBAR_H = 40  #カラーバーとラベルの高さ(画素)
+GAP = 20     #パネルの間隔(画素)
+
+#%%
+#Make_LUT: 各画素(上が北、npix x npix)に対応するゲートの番号(スイープ内のレイ番号*ゲート数+ゲート番号)を返す
+def Make_LUT(geom, rng, xlim, ylim, npix, max_gap=2.0):
+    ##geom: nexrad_geom.Get_Sweep_Geometryの結果、rng: ゲートの距離(m)
+    ##xlim, ylim: 描画範囲(km)、max_gap: 最も近いレイとの方位角の差がこれ[deg.]より大きい画素は欠損
+    ##Return: (npix, npix)のint配列(データ範囲外は-1)。geomに保存して使い回す
+    key = (tuple(float(v) for v in xlim), tuple(float(v) for v in ylim), npix, float(max_gap))
+    luts = geom.setdefault('lut', {})
+    if key in luts:
+        return luts[key]
+
+    x = xlim[0] + (np.arange(npix) + 0.5) * (xlim[1] - xlim[0]) / npix
+    y = ylim[1] - (np.arange(npix) + 0.5) * (ylim[1] - ylim[0]) / npix
+    xx, yy = np.meshgrid(x, y)
+    lut = Gate_Index(geom, rng, xx, yy, max_gap)
+    luts[key] = lut
+    return lut
+
+#Gate_Index: レーダーからの座標xx, yy(km, 地表面に沿った距離)を含むゲートの番号を返す(範囲外は-1)
+def Gate_Index(geom, rng, xx, yy, max_gap=2.0):
+    az = np.rad2deg(np.arctan2(xx, yy)) % 360.
+
+    #最も近いレイ(方位角順に並んだレイの前後と、0度をまたぐ場合を比べる)
+    azs = geom['azimuth'].astype(np.float64)
+    n = len(azs)
+    ext = np.concatenate([azs[-1:] - 360., azs, azs[:1] + 360.])
+    j = np.clip(np.searchsorted(ext, az), 1, n + 1)
+    near = np.where(az - ext[j-1] <= ext[j] - az, j - 1, j)
+    dist = np.abs(az - ext[near])
+    ray = (near - 1) % n
+
+    #地表面に沿った距離からスラントレンジを求め、ゲートの番号にする
+    r = nexrad_geom.Slant_Range(np.hypot(xx, yy), geom['elevation'][ray]) * 1000.
+    dr = rng[1] - rng[0]
+    gate = np.floor((r - (rng[0] - dr / 2.)) / dr).astype(np.int64)
+    ngate = len(rng)
+    valid = (gate >= 0) & (gate < ngate) & (dist <= max_gap)
+    return np.where(valid, geom['order'][ray] * ngate + gate, -1)
+
+#%%
+#Make_Colors: 色の境界値と、各区間(境界値未満、各区間、最後の境界値以上)の色(RGB, 0-255)を返す
+def Make_Colors(cmap, norm=None, vmin=None, vmax=None, nlevels=64):
+    ##norm: BoundaryNormなど境界値を持つnorm(Noneならvmin〜vmaxを等分する)
+    if norm is not None and hasattr(norm, 'boundaries'):
+        bounds = np.asarray(norm.boundaries, dtype=np.float64)
+    else:
+        nl = min(cmap.N, nlevels)
+        bounds = np.linspace(vmin, vmax, nl + 1)
+        norm = Normalize(vmin, vmax)
+    rep = np.concatenate([[bounds[0] - 1.], (bounds[1:] + bounds[:-1]) / 2., [bounds[-1] + 1.]])
+    rgb = np.round(cmap(norm(rep))[:,:3] * 255).astype(np.uint8)
+    return bounds, rgb
+
+#%%
+#To_Index: スイープの値をLUTで画素に並べ、パレット番号(base〜)に変換する
+def To_Index(data, lut, bounds, base):
+    flat = np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan).ravel()
+    v = flat[np.maximum(lut, 0)]
+    idx = (np.digitize(v, bounds) + base).astype(np.uint8)
+    idx[np.isnan(v) | (lut < 0)] = BG
+    return idx
+
+#%%
+#Put_Text: 文字列を(x, y)を基準に配置して描く(ha: left/center/right, va: top/bottom)
+def Put_Text(draw, x, y, s, font, ha='center', va='top'):
+    l, t, r, b = draw.multiline_textbbox((0, 0), s, font=font)
+    x -= {'left': 0, 'center': (r - l) / 2., 'right': r - l}[ha]
+    y -= {'top': 0, 'bottom': b - t}[va]
+    draw.multiline_text((x - l, y - t), s, fill=LINE, font=font, align='center')
+
+#%%
+#Draw_Quicklook: スイープeの各変数のパネルを横に並べた画像(PIL.Image, パレット付き)を作成する
+def Draw_Quicklook(radar, e, panels, xlim, ylim, npix, geom=None, crange=None, clabels=None, hair_length=None):
+    ##panels: パネルごとの(変数名, 境界値, 色(Make_Colors), カラーバーのラベル)のリスト
+    ##crange: 円の半径(km)、clabels: 円に表示する文字列(Noneなら表示しない)、hair_length: 十字の長さ(km, Noneなら描かない)
+    if geom is None: geom = nexrad_geom.Get_Sweep_Geometry(radar, e)
+    lut = Make_LUT(geom, radar.range['data'], xlim, ylim, npix)
+    font = ImageFont.load_default()
+
+    #パレット(背景、線、各パネルの色)
+    palette = [255, 255, 255, 0, 0, 0]
+    bases = []
+    for _, bounds, rgb, _ in panels:
+        bases.append(len(palette) // 3)
+        palette.extend(rgb.ravel().tolist())
+    if len(palette) > 768:
+        raise ValueError('Too many colors for a palette image (reduce nlevels)')
+
+    width = len(panels) * npix + (len(panels) + 1) * GAP
+    canvas = Image.new('P', (width, TITLE_H + npix + CBAR_H), BG)
+    canvas.putpalette(palette)
+    draw = ImageDraw.Draw(canvas)
+
+    #km→画素(パネル内)
+    sx = npix / (xlim[1] - xlim[0])
+    sy = npix / (ylim[1] - ylim[0])
+    px = lambda x: (x - xlim[0]) * sx
+    py = lambda y: (ylim[1] - y) * sy
+
+    for p, ((field, bounds, rgb, label), base) in enumerate(zip(panels, bases)):
+        x0 = GAP + p * (npix + GAP)
+        panel = Image.fromarray(To_Index(radar.get_field(e, field), lut, bounds, base), 'P')
+        pdraw = ImageDraw.Draw(panel)
+        if crange is not None:
+            for i, r in enumerate(crange):
+                pdraw.ellipse([px(-r), py(r), px(r), py(-r)], outline=LINE)
+                if clabels is not None:
+                    Put_Text(pdraw, px(0), py(r + (hair_length or 0)), clabels[i], font, va='bottom')
+        if hair_length is not None:
+            pdraw.line([px(-hair_length), py(0), px(hair_length), py(0)], fill=LINE)
+            pdraw.line([px(0), py(-hair_length), px(0), py(hair_length)], fill=LINE)
+        canvas.paste(panel, (x0, TITLE_H))
+        draw.rectangle([x0 - 1, TITLE_H - 1, x0 + npix, TITLE_H + npix], outline=LINE)
+        Put_Text(draw, x0 + npix // 2, 2, generate_title(radar, field, e), font)
+
+        #カラーバー(境界値の間を等間隔に並べる)
+        nb = len(bounds) - 1
+        cy = TITLE_H + npix + 4
+        for k in range(nb):
+            draw.rectangle([x0 + k * npix // nb, cy, x0 + (k + 1) * npix // nb, cy + 8], fill=base + 1 + k)
+        step = max(1, nb // 12) if nb > 16 else 1
+        for k in range(0, nb + 1, step):
+            ha = 'left' if k == 0 else 'right' if k == nb else 'center'
+            Put_Text(draw, x0 + k * npix // nb, cy + 10, f'{bounds[k]:.4g}', font, ha=ha)
+        Put_Text(draw, x0 + npix, cy + 24, label, font, ha='right')
+    return canvas
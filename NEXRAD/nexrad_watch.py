@@ -0,0 +1,93 @@
+"""
+nexrad_watch.py ver 1.0
+ディレクトリを監視し、新しく届いた(または更新された)NEXRAD Level-IIファイルだけを処理するためのモジュール
+Make_CAPPI_NEXRAD.py、Draw_NEXRAD_Level2.pyから呼び出して使用する
+
+処理済みのファイルは処理記録ファイル(manifest)に1行1ファイルのタブ区切りで記録する
+    ファイルパス  サイズ(byte)  更新時刻(mtime)  設定のハッシュ値  状態(ok/failed)  出力ファイル(|区切り)
+同じファイルの行が複数ある場合は最後の行が有効。再起動しても処理記録ファイルを読み込んで続きから処理する。
+*サイズ・更新時刻・設定のいずれかが変わったファイル、出力ファイルが消えたファイルは処理し直す
+*失敗したファイルはファイルが更新されるまで処理し直さない
+*書き込み途中のファイルを処理しないよう、サイズと更新時刻が前回の確認時から変わらないファイルだけを処理する
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+"""
+
+import hashlib
+import time
+from glob import glob
+from os import stat
+from os.path import exists, join
+
+#%%
+#Params_Hash: 出力に影響する設定値からハッシュ値を作成する(設定を変えると全ファイルを処理し直す)
+def Params_Hash(params):
+    return hashlib.md5(repr(params).encode()).hexdigest()[:16]
+
+#%%
+#Load_Manifest: 処理記録ファイルを読み込み、{ファイルパス: 記録}の辞書を返す
+def Load_Manifest(manifest):
+    entries = {}
+    if not exists(manifest):
+        return entries
+    with open(manifest, 'r') as fp:
+        for line in fp:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 6: continue #書き込み途中で止まった行
+            entries[cols[0]] = {'size': int(cols[1]), 'mtime': float(cols[2]), 'hash': cols[3],
+                                'status': cols[4], 'outputs': [s for s in cols[5].split('|') if s != '']}
+    return entries
+
+#%%
+#Add_Manifest: 処理記録ファイルに1ファイル分の記録を追記する
+def Add_Manifest(manifest, entries, path, size, mtime, phash, status, outputs=()):
+    entries[path] = {'size': size, 'mtime': mtime, 'hash': phash, 'status': status, 'outputs': list(outputs)}
+    with open(manifest, 'a') as fp:
+        fp.write(f'{path}\t{size}\t{mtime!r}\t{phash}\t{status}\t{"|".join(outputs)}\n')
+
+#%%
+#Is_UpToDate: 処理記録と現在のファイルの状態を比べ、処理済みならTrueを返す
+def Is_UpToDate(entry, size, mtime, phash):
+    if entry is None:
+        return False
+    if entry['size'] != size or entry['mtime'] != mtime or entry['hash'] != phash:
+        return False
+    if entry['status'] != 'ok':
+        return True #失敗したファイルは更新されるまで処理しない
+    return all(exists(o) for o in entry['outputs'])
+
+#%%
+#Watch_Dir: indirを監視し、未処理のファイルをprocess(ファイルリスト)で処理する(Ctrl-Cで終了)
+def Watch_Dir(indir, pattern, process, manifest, phash, interval=30., once=False):
+    ##process: ファイルパスのリストを受け取り、{ファイルパス: 出力ファイルのリスト(失敗はNone)}を返す関数
+    ##once: Trueなら監視せずに未処理のファイルを1回だけ処理して終了する(書き込み途中の確認も行わない)
+    entries = Load_Manifest(manifest)
+    print(f'Watching {join(indir, pattern)} ({len(entries)} files in {manifest})')
+    seen = {} #前回の確認時の(サイズ, 更新時刻)
+    while True:
+        todo = []
+        for f in sorted(glob(join(indir, pattern))):
+            try:
+                st = stat(f)
+            except FileNotFoundError: #確認中に削除された
+                continue
+            state = (st.st_size, st.st_mtime)
+            if Is_UpToDate(entries.get(f), state[0], state[1], phash):
+                continue
+            if not once and seen.get(f) != state:
+                seen[f] = state #書き込み途中の可能性があるので次回の確認まで待つ
+                continue
+            todo.append((f, state))
+
+        if len(todo) > 0:
+            print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {len(todo)} new files')
+            results = process([f for f, _ in todo])
+            for f, state in todo:
+                outputs = results.get(f)
+                Add_Manifest(manifest, entries, f, state[0], state[1], phash,
+                             'failed' if outputs is None else 'ok', outputs or ())
+                seen.pop(f, None)
+        if once:
+            return
+        time.sleep(interval)
@@ -3,13 +3,10 @@
 sdate="202305221500" #yyyymmddHHMM (UTC)
 edate="202305221510"
 sitename="PGUA"
-outdir="./PGUA/"
-
-mkdir -p ${outdir}
 
+#ファイルは./サイト名/yyyymmdd/に保存される(Get_Level2_fromAWS.pyのoutdir, dir_format)
 python3 Get_Level2_fromAWS.py ${sdate} ${edate} ${sitename}
-mv *_V06 ${outdir}
 
-ls ${outdir}/*_V06 > flist
+ls ./${sitename}/*/*_V06 > flist
 python3 Draw_NEXRAD_Level2.py flist
 rm flist
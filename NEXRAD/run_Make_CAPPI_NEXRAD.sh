@@ -1,7 +1,7 @@
 #!/bin/bash
 #ディレクトリ内のNEXRADファイルからCAPPIデータを作る処理を一括で実施する
 #注意：実行前にMake_CAPPI_NEXRAD.pyの設定を確認すること
-#(flistはTrueになっているか、ppi_useは適切か、等)
+#(flistはTrueになっているか、ppi_useは適切か、並列数nprocは適切か、等)
 
 datadir="RODN/20220831"
 
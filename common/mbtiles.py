@@ -0,0 +1,154 @@
+"""
+mbtiles.py ver 1.0
+レーダー・降水強度の格子データからWebメルカトルのXYZタイル(256x256画素, PNG)を作成し、
+1つのSQLiteファイル(MBTiles形式)に保存するモジュール
+NEXRAD/Draw_NEXRAD_Level2.py、NEXRAD/Make_CAPPI_NEXRAD.py、JMA-RADAR/dl_draw_jmagpv.pyから呼び出して使用する
+
+Useage(スクリプト側)
+    conn = mbtiles.Open_MBTiles(path, name, bounds, zooms)
+    mbtiles.Write_Tiles(conn, '2026-01-01T00:00Z', colors, palette, lut_func, lut_cache, zooms, bounds)
+    colors: 格子の各点の色番号(uint8, 0は透明)、palette: 色番号ごとのRGB
+    lut_func: タイルの各画素の(経度, 緯度)から格子の番号(範囲外は-1)を返す関数(Regular_LUT, Aeqd_LUTで作成)
+
+保存形式(MBTiles 1.3の重複を除いた形式に時刻を追加)
+    images(tile_id, tile_data): タイル画像(PNG)。tile_idは色番号とパレットのハッシュ値
+    map(time, zoom_level, tile_column, tile_row, tile_id): 時刻ごとのタイル(tile_rowはTMS形式で南が0)
+    tiles(view): 最後に書き込んだ時刻(metadataのtime)のタイル(一般的なMBTilesの読み込みソフト用)
+*前の時刻と同じ内容のタイルは画像を作り直さず、mapに行を追加するだけにする
+*全画素が透明なタイルは保存しない
+*各タイルの画素→格子の対応表(LUT)はlut_cacheに保存し、同じ格子の次の時刻で使い回す
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+"""
+
+import sqlite3
+import hashlib
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+TILE = 256 #タイルの画素数
+R_AEQD = 6370997. #正距方位図法の地球半径(m, pyartと同じ)
+MAX_LAT = 85.0511287798 #Webメルカトルの緯度の範囲
+
+#%%
+#Open_MBTiles: MBTilesファイルを開く(なければ作成する)
+def Open_MBTiles(path, name, bounds, zooms):
+    ##bounds: [西端経度, 南端緯度, 東端経度, 北端緯度]、zooms: ズームレベルのリスト
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL') #書き込み中も地図表示側から読めるようにする
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+        CREATE TABLE IF NOT EXISTS map (time TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                                        tile_id TEXT, PRIMARY KEY (time, zoom_level, tile_column, tile_row));
+        CREATE VIEW IF NOT EXISTS tiles AS
+            SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row,
+                   images.tile_data AS tile_data
+            FROM map JOIN images ON images.tile_id = map.tile_id
+            WHERE map.time = (SELECT value FROM metadata WHERE name = 'time');
+    ''')
+    meta = {'name': name, 'format': 'png', 'type': 'overlay', 'version': '1.0',
+            'bounds': ','.join(f'{b:.4f}' for b in bounds), 'minzoom': str(min(zooms)), 'maxzoom': str(max(zooms))}
+    conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)', meta.items())
+    conn.commit()
+    return conn
+
+#%%
+#Tile_Range: boundsを含むタイル番号の範囲(x0, x1, y0, y1)を返す(両端を含む。yは北が0)
+def Tile_Range(bounds, z):
+    n = 2 ** z
+    def tx(lon): return int(np.clip(np.floor((lon + 180.) / 360. * n), 0, n - 1))
+    def ty(lat):
+        lat = np.deg2rad(np.clip(lat, -MAX_LAT, MAX_LAT))
+        return int(np.clip(np.floor((1. - np.arcsinh(np.tan(lat)) / np.pi) / 2. * n), 0, n - 1))
+    return tx(bounds[0]), tx(bounds[2]), ty(bounds[3]), ty(bounds[1])
+
+#Tile_LonLat: タイル(z, x, y)の各画素の中心の経度・緯度(TILE x TILE)を返す
+def Tile_LonLat(z, x, y):
+    n = 2 ** z
+    p = np.arange(TILE) + 0.5
+    lon = (x + p / TILE) / n * 360. - 180.
+    lat = np.rad2deg(np.arctan(np.sinh(np.pi * (1. - 2. * (y + p / TILE) / n))))
+    return np.meshgrid(lon, lat)
+
+#%%
+#Lonlat_To_Aeqd: 経度・緯度を(lon_0, lat_0)中心の正距方位図法の座標(m)に変換する
+#(pyart.core.geographic_to_cartesian_aeqdと同じ式)
+def Lonlat_To_Aeqd(lon, lat, lon_0, lat_0):
+    lon, lat = np.deg2rad(lon), np.deg2rad(lat)
+    lon_0, lat_0 = np.deg2rad(lon_0), np.deg2rad(lat_0)
+    dlon = lon - lon_0
+    arg = np.clip(np.sin(lat_0) * np.sin(lat) + np.cos(lat_0) * np.cos(lat) * np.cos(dlon), -1., 1.)
+    c = np.arccos(arg)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = np.where(c == 0, 1., c / np.sin(c))
+    x = R_AEQD * k * np.cos(lat) * np.sin(dlon)
+    y = R_AEQD * k * (np.cos(lat_0) * np.sin(lat) - np.sin(lat_0) * np.cos(lat) * np.cos(dlon))
+    return x, y
+
+#%%
+#Regular_LUT: 等間隔の経度・緯度格子(格子点の中心lon0+i*dlon, lat0+j*dlat, [j, i]の順)用のlut_funcを返す
+def Regular_LUT(lon0, dlon, nx, lat0, dlat, ny):
+    def lut_func(lon, lat):
+        i = np.floor((lon - lon0) / dlon + 0.5).astype(np.int64)
+        j = np.floor((lat - lat0) / dlat + 0.5).astype(np.int64)
+        return np.where((i >= 0) & (i < nx) & (j >= 0) & (j < ny), j * nx + i, -1)
+    return lut_func
+
+#Aeqd_LUT: (lon_0, lat_0)中心の正距方位図法の等間隔格子(x0+i*dx, y0+j*dy [m], [j, i]の順)用のlut_funcを返す
+def Aeqd_LUT(lon_0, lat_0, x0, dx, nx, y0, dy, ny):
+    def lut_func(lon, lat):
+        x, y = Lonlat_To_Aeqd(lon, lat, lon_0, lat_0)
+        i = np.floor((x - x0) / dx + 0.5).astype(np.int64)
+        j = np.floor((y - y0) / dy + 0.5).astype(np.int64)
+        return np.where((i >= 0) & (i < nx) & (j >= 0) & (j < ny), j * nx + i, -1)
+    return lut_func
+
+#%%
+#Encode_PNG: 色番号のタイルをパレット付きPNG(色番号0は透明)にする
+def Encode_PNG(idx, palette):
+    img = Image.fromarray(idx.reshape(TILE, TILE), 'P')
+    img.putpalette(palette)
+    buf = BytesIO()
+    img.save(buf, 'PNG', transparency=0)
+    return buf.getvalue()
+
+#%%
+#Write_Tiles: 1時刻分のタイルを作成して保存し、(作成したタイル数, 使い回したタイル数)を返す
+def Write_Tiles(conn, time, colors, palette, lut_func, lut_cache, zooms, bounds):
+    ##time: 時刻(文字列)、colors: 格子の色番号(uint8)、palette: 色番号ごとのRGBを並べたリスト
+    ##lut_cache: 格子ごとのLUTを保存する辞書(格子が変わったら空の辞書を渡す)
+    colors_ext = np.append(np.asarray(colors, dtype=np.uint8).ravel(), np.uint8(0)) #LUTの-1(範囲外)は透明
+    pal_hash = hashlib.md5(bytes(bytearray(palette))).digest()
+    prev = lut_cache.setdefault('_prev', {}) #前の時刻の各タイルのtile_id
+    nnew, nsame = 0, 0
+    rows = []
+    for z in zooms:
+        x0, x1, y0, y1 = Tile_Range(bounds, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                if (z, x, y) not in lut_cache:
+                    lut = lut_func(*Tile_LonLat(z, x, y)).ravel()
+                    lut_cache[(z, x, y)] = lut.astype(np.int32) if (lut >= 0).any() else None
+                lut = lut_cache[(z, x, y)]
+                if lut is None:
+                    continue
+                idx = colors_ext[lut]
+                if not idx.any():
+                    continue
+                tid = hashlib.md5(pal_hash + idx.tobytes()).hexdigest()
+                if prev.get((z, x, y)) == tid or \
+                   conn.execute('SELECT 1 FROM images WHERE tile_id = ?', (tid,)).fetchone() is not None:
+                    nsame += 1
+                else:
+                    conn.execute('INSERT OR REPLACE INTO images VALUES (?, ?)', (tid, Encode_PNG(idx, palette)))
+                    nnew += 1
+                prev[(z, x, y)] = tid
+                rows.append((time, z, x, 2 ** z - 1 - y, tid))
+    conn.execute('DELETE FROM map WHERE time = ?', (time,))
+    conn.executemany('INSERT INTO map VALUES (?, ?, ?, ?, ?)', rows)
+    conn.execute("INSERT OR REPLACE INTO metadata VALUES ('time', ?)", (time,))
+    conn.commit()
+    return nnew, nsame
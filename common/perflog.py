@@ -0,0 +1,182 @@
+"""
+perflog.py ver 1.1
+各スクリプトの処理段階(ダウンロード、読み出し、デコード、グリッド化、描画、書き出しなど)ごとに
+経過時間・CPU時間・最大メモリ使用量(RSS)・読み書きしたバイト数を計測し、JSON lines形式で記録するモジュール
+NEXRAD、JMA-RADAR、Get_radarimgsの各スクリプトから呼び出して使用する
+
+Useage(スクリプト側)
+    sys.path.append(<このディレクトリ>)
+    import perflog
+    perflog.Setup(perf_log, 'スクリプト名')  #perf_log=Noneなら何も記録しない
+    with perflog.Stage('read', fname):
+        ...
+記録の集計
+    python3 perflog.py perf_log.jsonl  #スクリプト・段階ごとの合計と平均を表示
+
+記録する項目(1段階1行)
+ time: 段階の開始時刻、script: スクリプト名、pid: プロセスID、stage: 段階名、file: 処理中のファイル
+ wall: 経過時間(秒)、cpu: CPU時間(秒、段階中に終了した子プロセスがあればその分も含む)
+ peak_rss_mb: 段階中の最大RSS(MB)、read_bytes/write_bytes: 段階中に読み書きしたバイト数(ネットワークを含む)
+*最大RSSと読み書きしたバイト数はLinuxの/procから取得する(それ以外のOSではプロセス全体の最大RSSを記録し、バイト数は記録しない)
+*並列処理の各プロセスは同じファイルに追記する(1行ずつ書き込むので行が混ざることはない)
+*メインスレッド以外(ダウンロードのスレッドなど)の段階は、そのスレッドの経過時間・CPU時間・読み書きしたバイト数だけを記録する
+ (peak_rss_mbはNone。最大RSSのリセットや入れ子の段階の計測は行わないので、メインスレッドの段階と同時に計測できる)
+ メインスレッドの段階のCPU時間・最大RSS・バイト数はプロセス全体の値なので、同時に動いているスレッドの分も含まれる
+
+HISTORY(yyyy.mm.dd)
+ver 1.0 First created 2026.10.18
+ver 1.1 メインスレッド以外のStageはスレッドごとの値だけを記録するよう変更(他の段階の最大RSSをリセットしていた) 2026.10.18
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError: #Windows
+    resource = None
+
+_config = {'log': None, 'script': ''}
+_stack = [] #入れ子になった段階の計測中の最大RSS
+
+#%%
+#Setup: 記録先のファイルとスクリプト名を設定する(lognameがNoneなら記録しない)
+def Setup(logname, script):
+    _config['log'] = logname
+    _config['script'] = script
+    if logname is not None:
+        d = os.path.dirname(logname)
+        if d != '': os.makedirs(d, exist_ok=True)
+
+def Enabled():
+    return _config['log'] is not None
+
+#%%
+#Read_IO: これまでに読み書きしたバイト数(Linux以外はNone。thread=Trueなら呼び出したスレッドの分)
+def Read_IO(thread=False):
+    try:
+        with open('/proc/thread-self/io' if thread else '/proc/self/io', 'r') as fp:
+            io = dict(l.split(': ') for l in fp.read().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+#Read_HWM: 最大RSS(MB)。Linuxでは/proc/self/statusのVmHWM、それ以外はgetrusage
+def Read_HWM():
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for l in fp:
+                if l.startswith('VmHWM:'):
+                    return int(l.split()[1]) / 1024.
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024. / 1024. if sys.platform == 'darwin' else rss / 1024.
+
+#Reset_HWM: 最大RSSを現在のRSSに戻す(Linuxのみ。失敗した場合はFalse)
+def Reset_HWM():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except OSError:
+        return False
+
+def Read_CPU():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+#%%
+#Stage: with文で囲んだ処理を1つの段階として計測し、記録する
+@contextmanager
+def Stage(stage, fname=None, **extra):
+    ##fname: 処理中のファイル(任意)、extra: 記録に追加する項目(任意)
+    if not Enabled():
+        yield
+        return
+    if threading.current_thread() is not threading.main_thread():
+        with Thread_Stage(stage, fname, **extra):
+            yield
+        return
+    #外側の段階の最大RSSを保存してから計測を始める
+    hwm = Read_HWM()
+    if len(_stack) > 0 and hwm is not None: _stack[-1] = max(_stack[-1], hwm)
+    Reset_HWM()
+    _stack.append(0.)
+    start = datetime.datetime.now().isoformat(timespec='milliseconds')
+    rb0, wb0 = Read_IO()
+    t0, c0 = time.perf_counter(), Read_CPU()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - t0, Read_CPU() - c0
+        rb1, wb1 = Read_IO()
+        hwm = Read_HWM()
+        peak = _stack.pop()
+        if hwm is not None: peak = max(peak, hwm)
+        if len(_stack) > 0: _stack[-1] = max(_stack[-1], peak)
+        rec = {'time': start, 'script': _config['script'], 'pid': os.getpid(), 'stage': stage,
+               'file': None if fname is None else os.path.basename(str(fname)),
+               'wall': round(wall, 6), 'cpu': round(cpu, 6), 'peak_rss_mb': None if hwm is None else round(peak, 1),
+               'read_bytes': None if rb0 is None else rb1 - rb0, 'write_bytes': None if wb0 is None else wb1 - wb0}
+        rec.update(extra)
+        Write_Record(rec)
+
+#Thread_Stage: メインスレッド以外の段階をそのスレッドの経過時間・CPU時間・読み書きしたバイト数で計測し、記録する(Stageから呼ばれる)
+@contextmanager
+def Thread_Stage(stage, fname=None, **extra):
+    start = datetime.datetime.now().isoformat(timespec='milliseconds')
+    rb0, wb0 = Read_IO(thread=True)
+    t0, c0 = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - t0, time.thread_time() - c0
+        rb1, wb1 = Read_IO(thread=True)
+        rec = {'time': start, 'script': _config['script'], 'pid': os.getpid(), 'stage': stage,
+               'file': None if fname is None else os.path.basename(str(fname)),
+               'wall': round(wall, 6), 'cpu': round(cpu, 6), 'peak_rss_mb': None,
+               'read_bytes': None if rb0 is None else rb1 - rb0, 'write_bytes': None if wb0 is None else wb1 - wb0,
+               'thread': threading.current_thread().name}
+        rec.update(extra)
+        Write_Record(rec)
+
+#Write_Record: 1段階分の記録を1行追記する
+def Write_Record(rec):
+    with open(_config['log'], 'a') as fp:
+        fp.write(json.dumps(rec) + '\n')
+
+#%%
+#Summarize: 記録ファイルをスクリプト・段階ごとに集計して表示する
+def Summarize(logname):
+    stats = {}
+    with open(logname, 'r') as fp:
+        for line in fp:
+            try:
+                rec = json.loads(line)
+            except ValueError: #書き込み途中で止まった行
+                continue
+            s = stats.setdefault((rec['script'], rec['stage']), {'n': 0, 'wall': 0., 'cpu': 0., 'peak': 0.,
+                                                                 'rb': 0, 'wb': 0})
+            s['n'] += 1
+            s['wall'] += rec['wall']
+            s['cpu'] += rec['cpu']
+            s['peak'] = max(s['peak'], rec['peak_rss_mb'] or 0.)
+            s['rb'] += rec['read_bytes'] or 0
+            s['wb'] += rec['write_bytes'] or 0
+    print(f'{"script":<24}{"stage":<16}{"n":>6}{"wall[s]":>10}{"mean[s]":>10}{"cpu[s]":>10}'
+          f'{"peakRSS[MB]":>13}{"read[MB]":>10}{"write[MB]":>10}')
+    for (script, stage), s in stats.items():
+        print(f'{script:<24}{stage:<16}{s["n"]:>6}{s["wall"]:>10.2f}{s["wall"]/s["n"]:>10.3f}{s["cpu"]:>10.2f}'
+              f'{s["peak"]:>13.1f}{s["rb"]/1e6:>10.1f}{s["wb"]/1e6:>10.1f}')
+    return stats
+
+#%%
+if __name__ == '__main__':
+    Summarize(sys.argv[1])